@@ -0,0 +1,185 @@
+'''
+asyncio facade over main.py for non-blocking frontends
+
+Every function mirrors the one with the same name in main.py, but runs
+the database work on a bounded thread pool so the event loop never
+blocks on SQLite. Connections are opened through the backend of the
+collection, so collections on a MemoryBackend work too. Searches which
+return many statuses are async iterators which fetch rows in batches
+instead of building a list:
+
+    await async_main.add_user('dave03', 'dave@uw.edu', 'Dave', 'Yuen', users)
+    async for status in async_main.filter_status_by_string('day', statuses):
+        print(status.status_text)
+
+Author: Marcus Bakke
+'''
+import asyncio
+import functools
+import itertools
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+import main
+import socialnetwork_model as sm
+
+# Threads running ordinary calls, and how many searches may stream at once
+MAX_WORKERS = 4
+MAX_STREAMS = 4
+# Rows fetched from a search cursor per trip to its thread
+STREAM_BATCH = 100
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='async_main')
+_MAX_STREAMS = MAX_STREAMS
+# One semaphore per event loop limiting the number of open streams
+_STREAM_SLOTS = weakref.WeakKeyDictionary()
+
+
+def configure(max_workers=MAX_WORKERS, max_streams=MAX_STREAMS):
+    '''
+    Replaces the thread pool and stream limit. Call before any other
+    function in this module is awaited.
+    '''
+    global _EXECUTOR, _MAX_STREAMS  # pylint: disable=W0603
+    _EXECUTOR.shutdown(wait=False)
+    _EXECUTOR = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='async_main')
+    _MAX_STREAMS = max_streams
+    _STREAM_SLOTS.clear()
+
+
+async def run(func, *args, **kwargs):
+    '''
+    Runs a blocking function on the thread pool and returns its result
+
+    The pool thread opens a connection through the backend of the
+    collection passed to func for the call and closes it afterwards, so
+    idle threads never hold connections.
+    '''
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_EXECUTOR,
+                                      functools.partial(in_connection, func, *args, **kwargs))
+
+
+def in_connection(func, *args, **kwargs):
+    '''
+    Calls func with a connection open on the current thread
+    '''
+    with connection_context(args, kwargs):
+        return func(*args, **kwargs)
+
+
+def connection_context(args, kwargs):
+    '''
+    Returns the connection context of the backend of the collection
+    among the arguments of a call (a no-op for MemoryBackend), or of
+    sm.db if there is no collection
+    '''
+    for value in itertools.chain(args, kwargs.values()):
+        backend = getattr(value, 'backend', None)
+        if backend is not None:
+            return backend.connection_context(value.database)
+    return sm.db.connection_context()
+
+
+async def stream(func, *args, **kwargs):
+    '''
+    Async iterator over the iterator returned by a blocking search function
+
+    The query and every fetch run on one dedicated thread, since a cursor
+    must stay on the connection (and so the thread) which opened it.
+    Nothing is yielded if the search returns None.
+    '''
+    loop = asyncio.get_running_loop()
+    slots = _STREAM_SLOTS.setdefault(loop, asyncio.Semaphore(_MAX_STREAMS))
+    async with slots:
+        thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix='async_main_stream')
+        connection = connection_context(args, kwargs)
+        try:
+            await loop.run_in_executor(thread, connection.__enter__)
+            result = await loop.run_in_executor(thread, functools.partial(func, *args, **kwargs))
+            if result is None:
+                return
+            rows = iter(result)
+            while True:
+                batch = await loop.run_in_executor(thread, next_batch, rows, STREAM_BATCH)
+                for row in batch:
+                    yield row
+                if len(batch) < STREAM_BATCH:
+                    return
+        finally:
+            # Runs after any fetch still in flight, then the thread exits
+            thread.submit(connection.__exit__, None, None, None)
+            thread.shutdown(wait=False)
+
+
+async def init_database(filename=sm.FILE, **options):
+    '''
+    Opens (or creates) the database file used by the collections, as
+    main.init_database
+    '''
+    def init_and_release():
+        # Hand the connection opened by init_database back to the pool
+        database = main.init_database(filename, **options)
+        database.close()
+        return database
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_EXECUTOR, init_and_release)
+
+
+def next_batch(rows, size):
+    '''
+    Returns a list of up to size rows from an iterator
+    '''
+    return list(itertools.islice(rows, size))
+
+
+def _blocking(func):
+    '''
+    Wraps a main.py function as a coroutine function run on the thread pool
+    '''
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+    return wrapper
+
+
+def _streaming(func):
+    '''
+    Wraps a main.py search function as an async iterator
+    '''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return stream(func, *args, **kwargs)
+    return wrapper
+
+
+# Creating collections does no I/O, so these stay synchronous
+init_user_collection = main.init_user_collection
+init_status_collection = main.init_status_collection
+
+load_users = _blocking(main.load_users)
+load_status_updates = _blocking(main.load_status_updates)
+save_users = _blocking(main.save_users)
+save_status_updates = _blocking(main.save_status_updates)
+sync_users = _blocking(main.sync_users)
+sync_status_updates = _blocking(main.sync_status_updates)
+add_user = _blocking(main.add_user)
+update_user = _blocking(main.update_user)
+delete_user = _blocking(main.delete_user)
+search_user = _blocking(main.search_user)
+search_users_many = _blocking(main.search_users_many)
+add_users = _blocking(main.add_users)
+update_users = _blocking(main.update_users)
+delete_users = _blocking(main.delete_users)
+add_status = _blocking(main.add_status)
+update_status = _blocking(main.update_status)
+delete_status = _blocking(main.delete_status)
+search_status = _blocking(main.search_status)
+search_statuses_many = _blocking(main.search_statuses_many)
+add_statuses = _blocking(main.add_statuses)
+update_statuses = _blocking(main.update_statuses)
+delete_statuses = _blocking(main.delete_statuses)
+latest_statuses = _blocking(main.latest_statuses)
+
+search_all_status_updates = _streaming(main.search_all_status_updates)
+filter_status_by_string = _streaming(main.filter_status_by_string)
+search_status_by_phrase = _streaming(main.search_status_by_phrase)
@@ -0,0 +1,806 @@
+'''
+Storage backends behind UserCollection and UserStatusCollection
+
+A backend stores the rows of the Users and Status tables. The collection
+classes keep their caches, membership filters and logging, and leave
+every read and write to a backend:
+
+- PeeweeBackend stores rows in the SQLite database the models are bound
+  to (see socialnetwork_model.init_db). It is the default.
+- SqliteBackend stores rows in the same database, but runs point
+  lookups, single inserts and single deletes as prepared sqlite3
+  statements instead of through the query builder. Opt in to it for
+  workloads dominated by those calls.
+- MemoryBackend stores rows in dicts indexed by primary key and user_id,
+  optionally saving them to a snapshot file between runs. Use one
+  instance for both collections, as statuses must refer to its users.
+
+Tables are named by their model class (socialnetwork_model.Users or
+Status) and rows are dicts keyed by column name (user_id rather than
+Status.user). Both backends return model instances, or compact records
+(see socialnetwork_model.record_type) when fields are given, and raise
+peewee.IntegrityError for rows breaking a constraint of the table.
+'''
+# pylint: disable=E1101,W0212
+import functools
+import gzip
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from contextlib import nullcontext
+import peewee as pw
+import socialnetwork_model as sm
+import instrumentation
+from bloom import BloomFilter
+
+
+class Backend:
+    '''
+    Interface of a storage backend, see the module docstring
+
+    Every method must be safe to call from many threads at once.
+    '''
+    # True if load_checkpointed can record its progress in this backend
+    checkpoints = False
+
+    def atomic(self, model):
+        '''
+        Returns a context manager running its block as one transaction
+        on the table of model, rolled back if the block raises. It
+        returns a transaction with a rollback() method, and may be nested.
+        '''
+        raise NotImplementedError
+
+    def use_profile(self, model, profile):
+        '''
+        Returns a context manager applying the named database profile
+        (see socialnetwork_model.PROFILES) for the length of its block
+        '''
+        raise NotImplementedError
+
+    def connection_context(self, model):
+        '''
+        Returns a context manager for work done on a short-lived thread
+        '''
+        raise NotImplementedError
+
+    def insert(self, model, row):
+        '''
+        Inserts one row
+        '''
+        raise NotImplementedError
+
+    def insert_rows(self, model, rows, results):
+        '''
+        Inserts (index, row) pairs, setting results[index] to True for
+        each row inserted. Rows which cannot be inserted are logged and
+        skipped. Must be called inside a transaction.
+        '''
+        raise NotImplementedError
+
+    def insert_many(self, model, rows, conflict='fail'):
+        '''
+        Inserts rows, resolving rows whose primary key exists as
+        main.load_collection describes for conflict ('fail', 'ignore'
+        or 'replace'). Returns the number of rows inserted, except for
+        'replace'. Must be called inside a transaction.
+        '''
+        raise NotImplementedError
+
+    def update(self, model, key, values):
+        '''
+        Updates the columns in values of the row with primary key key.
+        Returns the number of rows updated.
+        '''
+        raise NotImplementedError
+
+    def update_rows(self, model, rows):
+        '''
+        Updates rows by primary key, as socialnetwork_model.update_rows
+        '''
+        raise NotImplementedError
+
+    def delete(self, model, keys):
+        '''
+        Deletes the rows with primary keys in keys, and the statuses of
+        deleted users. Returns the number of rows deleted.
+        '''
+        raise NotImplementedError
+
+    def get(self, model, key, fields=None):
+        '''
+        Returns the row with primary key key, or None
+        '''
+        raise NotImplementedError
+
+    def get_many(self, model, keys, fields=None):
+        '''
+        Yields (primary key, row) for each of keys which exists
+        '''
+        raise NotImplementedError
+
+    def existing_ids(self, model, keys):
+        '''
+        Returns the set of keys which exist
+        '''
+        raise NotImplementedError
+
+    def count(self, model):
+        '''
+        Returns the number of rows of model
+        '''
+        raise NotImplementedError
+
+    def rows(self, model, fields):
+        '''
+        Yields a tuple of the values of fields for every row of model
+        '''
+        raise NotImplementedError
+
+    def row_hashes(self, model):
+        '''
+        Returns the stored and missing row hashes of model, as
+        socialnetwork_model.row_hashes
+        '''
+        raise NotImplementedError
+
+    def statuses_by_user(self, user_id, fields=None):
+        '''
+        Returns a query (see MemoryQuery) of the statuses of user_id
+        '''
+        raise NotImplementedError
+
+    def statuses_containing(self, text, fields=None):
+        '''
+        Returns a query of the statuses containing text, ignoring case
+        '''
+        raise NotImplementedError
+
+    def statuses_matching(self, phrase, fields=None):
+        '''
+        Returns a query of the statuses containing the words of phrase
+        in order
+        '''
+        raise NotImplementedError
+
+    def latest_statuses(self, user_id, limit, before=None):
+        '''
+        Returns a list of up to limit statuses of user_id, newest first,
+        starting after the status_id before if given
+        '''
+        raise NotImplementedError
+
+    def primary_key_filter(self, model, registry):
+        '''
+        Returns a BloomFilter holding every primary key of model, sized for
+        twice the current number of rows so it has room to grow, and adds it
+        to registry (the set of filters new keys are added to)
+        '''
+        id_filter = BloomFilter(max(2 * self.count(model), 1024))
+        # registered before the scan so keys inserted meanwhile are not missed
+        registry.add(id_filter)
+        primary_key = model._meta.primary_key
+        for batch in pw.chunked(self.rows(model, [primary_key]), 10 * sm.BATCH_SIZE):
+            id_filter.update(row[0] for row in batch)
+        logging.info('Loaded %i %s ids into a membership filter.', len(id_filter),
+                     model._meta.table_name)
+        return id_filter
+
+
+class PeeweeBackend(Backend):
+    '''
+    Backend storing rows in the database the models are bound to
+    '''
+    checkpoints = True
+
+    def atomic(self, model):
+        return sm.bound_database(model).atomic()
+
+    def use_profile(self, model, profile):
+        return sm.use_profile(profile, sm.bound_database(model))
+
+    def connection_context(self, model):
+        return sm.bound_database(model).connection_context()
+
+    def insert(self, model, row):
+        model.insert(row).execute()
+
+    def insert_rows(self, model, rows, results):
+        sm.insert_rows(model, rows, results)
+
+    def insert_many(self, model, rows, conflict='fail'):
+        query = model.insert_many(rows)
+        if conflict == 'fail':
+            return query.as_rowcount().execute()
+        primary_key = model._meta.primary_key
+        if conflict == 'ignore':
+            # ON CONFLICT DO NOTHING, unlike INSERT OR IGNORE, only skips
+            # duplicate keys and still fails rows breaking a CHECK
+            return query.on_conflict(conflict_target=[primary_key], action='NOTHING') \
+                .as_rowcount().execute()
+        preserve = [model._meta.columns[column] for column in rows[0]
+                    if column != primary_key.column_name]
+        query.on_conflict(conflict_target=[primary_key], preserve=preserve).execute()
+        return None
+
+    def update(self, model, key, values):
+        return model.update(values).where(model._meta.primary_key == key).execute()
+
+    def update_rows(self, model, rows):
+        sm.update_rows(model, rows)
+
+    def delete(self, model, keys):
+        deleted = 0
+        for batch in pw.chunked(keys, sm.BATCH_SIZE):
+            deleted += model.delete().where(model._meta.primary_key.in_(batch)).execute()
+        return deleted
+
+    def get(self, model, key, fields=None):
+        query = model.select()
+        if fields is not None:
+            query = sm.select_fields(query, model, fields)
+        return query.where(model._meta.primary_key == key).first()
+
+    def get_many(self, model, keys, fields=None):
+        return sm.select_by_ids(model, keys, fields)
+
+    def existing_ids(self, model, keys):
+        primary_key = model._meta.primary_key
+        found = set()
+        for batch in pw.chunked(set(keys), sm.BATCH_SIZE):
+            query = model.select(primary_key).where(primary_key.in_(batch))
+            found.update(row[0] for row in query.tuples())
+        return found
+
+    def count(self, model):
+        return model.select().count()
+
+    def rows(self, model, fields):
+        return model.select(*fields).tuples().iterator()
+
+    def row_hashes(self, model):
+        return sm.row_hashes(model)
+
+    def statuses_by_user(self, user_id, fields=None):
+        return self._select(sm.Status.select().where(sm.Status.user_id == user_id), fields)
+
+    def statuses_containing(self, text, fields=None):
+        return self._select(sm.Status.select().where(sm.Status.status_text.contains(text)),
+                            fields)
+
+    def statuses_matching(self, phrase, fields=None):
+        index = sm.StatusIndex
+        match = '"' + phrase.replace('"', '""') + '"'
+        matches = index.select(index.rowid).where(index.match(match))
+        return self._select(sm.Status.select().where(pw.SQL('rowid').in_(matches)), fields)
+
+    def latest_statuses(self, user_id, limit, before=None):
+        query = sm.Status.select().where(sm.Status.user_id == user_id)
+        if before is not None:
+            # (sequence, status_id) < (sequence of before, before), spelt so
+            # SQLite can still range scan the index on the sequence
+            sequence = status_sequence(before)
+            query = query.where((sm.STATUS_SEQUENCE <= sequence) &
+                                ((sm.STATUS_SEQUENCE < sequence) |
+                                 (sm.Status.status_id < before)))
+        return list(query.order_by(sm.STATUS_SEQUENCE.desc(), sm.Status.status_id.desc())
+                    .limit(limit))
+
+    @staticmethod
+    def _select(query, fields):
+        '''
+        Narrows a status query to compact records of fields if given
+        '''
+        return query if fields is None else sm.select_fields(query, sm.Status, fields)
+
+
+class SqliteBackend(PeeweeBackend):
+    '''
+    PeeweeBackend whose get, insert and single-key delete skip the query
+    builder
+
+    Each runs a fixed SQL string, built once per table (and set of
+    fields), directly on the sqlite3 connection peewee opened for this
+    thread, so it takes part in the same transactions. sqlite3 keeps a
+    cache of prepared statements per connection keyed by the SQL text, so
+    after the first call only the parameters are bound. Rows are turned
+    into model instances without going through peewee's cursor wrapper;
+    this relies on every column of the tables being text, which needs no
+    conversion. All other methods are those of PeeweeBackend.
+    '''
+
+    def get(self, model, key, fields=None):
+        fields = None if fields is None else tuple(fields)
+        sql, build = point_select(model, fields)
+        row = self._execute(model, sql, (key,)).fetchone()
+        return None if row is None else build(row)
+
+    def insert(self, model, row):
+        self._execute(model, insert_sql(model, tuple(row)), tuple(row.values()))
+
+    def delete(self, model, keys):
+        keys = list(keys)
+        if len(keys) != 1:
+            return super().delete(model, keys)
+        return self._execute(model, delete_sql(model), (keys[0],)).rowcount
+
+    @staticmethod
+    def _execute(model, sql, params):
+        '''
+        Runs sql on the connection of this thread, raising peewee's
+        IntegrityError rather than sqlite3's. The statement skips peewee's
+        logger, so it is counted for the instrumentation here.
+        '''
+        instrumentation.count_query()
+        try:
+            return sm.bound_database(model).connection().execute(sql, params)
+        except sqlite3.IntegrityError as err:
+            raise pw.IntegrityError(*err.args) from err
+
+
+@functools.lru_cache(maxsize=None)
+def point_select(model, fields=None):
+    '''
+    Returns the SQL selecting the row of model with a given primary key,
+    and a function turning the row read into a model instance, or a
+    compact record of fields if given
+    '''
+    if fields is None:
+        selected = list(model._meta.sorted_fields)
+    else:
+        selected = [sm.model_field(model, name) for name in fields]
+    columns = ', '.join(f'"{field.column_name}"' for field in selected)
+    sql = (f'SELECT {columns} FROM "{model._meta.table_name}" '
+           f'WHERE "{primary_key_column(model)}" = ?')
+    if fields is not None:
+        return sql, sm.record_type(model, fields)._make
+    names = [field.name for field in selected]
+
+    def build(row):
+        instance = model(__no_default__=1)
+        instance.__data__ = dict(zip(names, row))
+        return instance
+    return sql, build
+
+
+@functools.lru_cache(maxsize=None)
+def insert_sql(model, columns):
+    '''
+    Returns the SQL inserting a row of model with the given columns
+    '''
+    names = ', '.join(f'"{sm.model_field(model, column).column_name}"' for column in columns)
+    values = ', '.join('?' * len(columns))
+    return f'INSERT INTO "{model._meta.table_name}" ({names}) VALUES ({values})'
+
+
+@functools.lru_cache(maxsize=None)
+def delete_sql(model):
+    '''
+    Returns the SQL deleting the row of model with a given primary key
+    '''
+    return f'DELETE FROM "{model._meta.table_name}" WHERE "{primary_key_column(model)}" = ?'
+
+
+class MemoryBackend(Backend):
+    '''
+    Backend storing rows in dicts, indexed by primary key and (for
+    statuses) by user_id and by the words of status_text
+
+    The constraints of the tables are enforced as SQLite would: unique
+    primary keys, the length checks of Users, statuses referring to an
+    existing user and deleting a user deleting their statuses.
+    Transactions keep an undo journal, so a rollback restores every row
+    changed since the transaction began. One transaction runs at a time;
+    other threads wait for it to finish.
+
+    If path is given and the file exists, the rows saved there by save()
+    are loaded. Nothing is written until save() is called.
+    '''
+    # pylint: disable=R0904
+
+    def __init__(self, path=None):
+        self.path = path
+        self._tables = {sm.Users: {}, sm.Status: {}}
+        # Status ids of each user_id, in the order they were added
+        self._by_user = {}
+        # Status ids containing each word of status_text, for phrase searches
+        self._by_word = {}
+        self._lock = threading.RLock()
+        # Undo entries of the open transaction, or None outside one
+        self._journal = None
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    def atomic(self, model):
+        return MemoryTransaction(self)
+
+    def use_profile(self, model, profile):
+        sm.profile_pragmas(profile)
+        return nullcontext()
+
+    def connection_context(self, model):
+        return nullcontext()
+
+    def insert(self, model, row):
+        row = self._row(model, row)
+        with self._lock:
+            key = row[primary_key_column(model)]
+            if key in self._tables[model]:
+                raise pw.IntegrityError(f'UNIQUE constraint failed: {key}')
+            self._check(model, row)
+            self._put(model, key, row)
+
+    def insert_rows(self, model, rows, results):
+        with self._lock:
+            for i, row in rows:
+                try:
+                    self.insert(model, row)
+                    results[i] = True
+                except pw.IntegrityError:
+                    logging.error('Unable to add %s.', next(iter(row.values())))
+
+    def insert_many(self, model, rows, conflict='fail'):
+        primary_key = primary_key_column(model)
+        table = self._tables[model]
+        inserted = 0
+        with self._lock:
+            for row in rows:
+                row = self._row(model, row)
+                key = row[primary_key]
+                if key not in table:
+                    self._check(model, row)
+                    self._put(model, key, row)
+                    inserted += 1
+                elif conflict == 'fail':
+                    raise pw.IntegrityError(f'UNIQUE constraint failed: {key}')
+                elif conflict == 'replace':
+                    values = {column: value for column, value in row.items()
+                              if column != primary_key}
+                    self.update(model, key, values)
+        return inserted if conflict != 'replace' else None
+
+    def update(self, model, key, values):
+        with self._lock:
+            row = self._tables[model].get(key)
+            if row is None:
+                return 0
+            values = self._columns(model, values)
+            row = dict(row, **values)
+            if 'row_hash' not in values:
+                # As the row_hash trigger does, a write not setting row_hash resets it
+                row['row_hash'] = None
+            self._check(model, row)
+            self._put(model, key, row)
+            return 1
+
+    def update_rows(self, model, rows):
+        primary_key = primary_key_column(model)
+        with self._lock:
+            for row in rows:
+                row = self._columns(model, row)
+                self.update(model, row.pop(primary_key), row)
+
+    def delete(self, model, keys):
+        deleted = 0
+        with self._lock:
+            for key in keys:
+                if key not in self._tables[model]:
+                    continue
+                if model is sm.Users:
+                    for status_id in list(self._by_user.get(key, ())):
+                        self._put(sm.Status, status_id, None)
+                self._put(model, key, None)
+                deleted += 1
+        return deleted
+
+    def get(self, model, key, fields=None):
+        row = self._tables[model].get(key)
+        return None if row is None else self._instance(model, row, fields)
+
+    def get_many(self, model, keys, fields=None):
+        table = self._tables[model]
+        for key in keys:
+            row = table.get(key)
+            if row is not None:
+                yield key, self._instance(model, row, fields)
+
+    def existing_ids(self, model, keys):
+        table = self._tables[model]
+        return {key for key in keys if key in table}
+
+    def count(self, model):
+        return len(self._tables[model])
+
+    def rows(self, model, fields):
+        columns = [field.column_name for field in fields]
+        with self._lock:
+            rows = list(self._tables[model].values())
+        for row in rows:
+            yield tuple(row[column] for column in columns)
+
+    def row_hashes(self, model):
+        with self._lock:
+            rows = list(self._tables[model].items())
+        columns = sm.hashed_columns(model)
+        hashes, missing = {}, {}
+        for key, row in rows:
+            if row['row_hash'] is None:
+                missing[key] = sm.content_hash(row[column] for column in columns)
+            else:
+                hashes[key] = row['row_hash']
+        hashes.update(missing)
+        return hashes, missing
+
+    def statuses_by_user(self, user_id, fields=None):
+        def rows():
+            table = self._tables[sm.Status]
+            with self._lock:
+                return [table[status_id] for status_id in self._by_user.get(user_id, ())]
+        return MemoryQuery(rows, sm.Status, fields, self)
+
+    def statuses_containing(self, text, fields=None):
+        text = text.casefold()
+        return self._scan(lambda row: text in row['status_text'].casefold(), fields)
+
+    def statuses_matching(self, phrase, fields=None):
+        words = words_of(phrase)
+
+        def rows():
+            table = self._tables[sm.Status]
+            with self._lock:
+                # Only statuses containing every word can contain the phrase
+                candidates = [self._by_word.get(word, set()) for word in set(words)]
+                candidates.sort(key=len)
+                status_ids = set.intersection(*candidates) if candidates else set()
+                found = [table[status_id] for status_id in status_ids]
+            return [row for row in found if has_phrase(words_of(row['status_text']), words)]
+        return MemoryQuery(rows, sm.Status, fields, self)
+
+    def latest_statuses(self, user_id, limit, before=None):
+        rows = self.statuses_by_user(user_id).rows()
+        def key(row):
+            return status_sequence(row['status_id']), row['status_id']
+
+        if before is not None:
+            before = status_sequence(before), before
+            rows = [row for row in rows if key(row) < before]
+        rows.sort(key=key, reverse=True)
+        return [self._instance(sm.Status, row) for row in rows[:limit]]
+
+    def save(self, path=None):
+        '''
+        Writes every row to the snapshot file path (by default the path
+        the backend was created with), through gzip if it ends with .gz.
+        The file is replaced in one step, so a crash while saving leaves
+        the previous snapshot intact. Returns the path.
+        '''
+        path = path or self.path
+        if path is None:
+            raise ValueError('No snapshot path given.')
+        with self._lock:
+            snapshot = {model._meta.table_name: list(table.values())
+                        for model, table in self._tables.items()}
+        partial = f'{path}.partial'
+        with open_snapshot(partial, 'w', path.endswith('.gz')) as file:
+            json.dump(snapshot, file)
+        os.replace(partial, path)
+        logging.info('Saved %i users and %i statuses to %s.', len(snapshot['users']),
+                     len(snapshot['status']), path)
+        return path
+
+    def load(self, path):
+        '''
+        Replaces every row with those of the snapshot file path
+        '''
+        with open_snapshot(path, 'r') as file:
+            snapshot = json.load(file)
+        with self._lock:
+            for table in self._tables.values():
+                table.clear()
+            self._by_user.clear()
+            self._by_word.clear()
+            for model in self._tables:
+                primary_key = primary_key_column(model)
+                for row in snapshot.get(model._meta.table_name, []):
+                    self._put(model, row[primary_key], row)
+        logging.info('Loaded %i users and %i statuses from %s.', self.count(sm.Users),
+                     self.count(sm.Status), path)
+
+    def _scan(self, predicate, fields):
+        '''
+        Returns a query of the statuses for which predicate(row) is true
+        '''
+        def rows():
+            with self._lock:
+                return [row for row in self._tables[sm.Status].values() if predicate(row)]
+        return MemoryQuery(rows, sm.Status, fields, self)
+
+    def _put(self, model, key, row):
+        '''
+        Stores row under key (deleting it if row is None), keeping the
+        user_id index and the journal of the open transaction up to date
+        '''
+        table = self._tables[model]
+        previous = table.get(key)
+        if self._journal is not None:
+            self._journal.append((model, key, previous))
+        if model is sm.Status and previous is not None:
+            self._by_user[previous['user_id']].pop(key, None)
+            for word in set(words_of(previous['status_text'])):
+                self._by_word[word].discard(key)
+        if row is None:
+            table.pop(key, None)
+            return
+        table[key] = row
+        if model is sm.Status:
+            self._by_user.setdefault(row['user_id'], {})[key] = None
+            for word in set(words_of(row['status_text'])):
+                self._by_word.setdefault(word, set()).add(key)
+
+    def _check(self, model, row):
+        '''
+        Raises IntegrityError if row breaks a constraint of model
+        '''
+        for column, limit in MAX_LENGTHS.get(model, {}).items():
+            if len(row[column]) >= limit:
+                raise pw.IntegrityError(f'CHECK constraint failed: {column}')
+        if model is sm.Status and row['user_id'] not in self._tables[sm.Users]:
+            raise pw.IntegrityError('FOREIGN KEY constraint failed')
+
+    def _row(self, model, row):
+        '''
+        Returns row with every column of model, raising IntegrityError
+        for a missing one
+        '''
+        row = self._columns(model, row)
+        row.setdefault('row_hash', None)
+        for column in model._meta.columns:
+            if row.get(column) is None and column != 'row_hash':
+                raise pw.IntegrityError(f'NOT NULL constraint failed: {column}')
+        return row
+
+    @staticmethod
+    def _columns(model, values):
+        '''
+        Returns values keyed by column rather than field name
+        '''
+        return {sm.model_field(model, name).column_name: value for name, value in values.items()}
+
+    @staticmethod
+    def _instance(model, row, fields=None):
+        '''
+        Returns row as a model instance, or a compact record of fields
+        '''
+        if fields is None:
+            return model(**row)
+        fields = tuple(fields)
+        return sm.record_type(model, fields)(
+            *(row[sm.model_field(model, name).column_name] for name in fields))
+
+
+# Length limits of Users.Meta.constraints, which MemoryBackend enforces
+MAX_LENGTHS = {sm.Users: {'user_id': 30, 'user_name': 30, 'user_last_name': 100}}
+
+
+class MemoryTransaction:
+    '''
+    Transaction of a MemoryBackend, see MemoryBackend.atomic
+
+    Holds the backend lock while open and records where its part of the
+    undo journal starts, so nested transactions behave as savepoints.
+    '''
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._start = None
+        self._outermost = False
+
+    def __enter__(self):
+        backend = self.backend
+        backend._lock.acquire()  # pylint: disable=R1732
+        self._outermost = backend._journal is None
+        if self._outermost:
+            backend._journal = []
+        self._start = len(backend._journal)
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            if exc_type is not None:
+                self.rollback()
+        finally:
+            if self._outermost:
+                self.backend._journal = None
+            self.backend._lock.release()
+
+    def rollback(self):
+        '''
+        Undoes every change made since the transaction began
+        '''
+        backend = self.backend
+        journal = backend._journal
+        while len(journal) > self._start:
+            model, key, previous = journal.pop()
+            backend._journal = None
+            backend._put(model, key, previous)
+            backend._journal = journal
+
+
+class MemoryQuery:
+    '''
+    Query of a MemoryBackend, with the methods of a peewee select which
+    user_status.StatusSearchResult uses
+
+    rows is called to read the matching rows each time the query runs.
+    '''
+
+    def __init__(self, rows, model, fields, backend):
+        self.rows = rows
+        self.model = model
+        self.fields = fields
+        self.backend = backend
+
+    def exists(self):
+        '''
+        Returns True if any row matches
+        '''
+        return bool(self.rows())
+
+    def count(self):
+        '''
+        Returns the number of matching rows
+        '''
+        return len(self.rows())
+
+    def iterator(self):
+        '''
+        Returns an iterator over the matching rows as model instances, or
+        compact records of fields if given
+        '''
+        return (self.backend._instance(self.model, row, self.fields) for row in self.rows())
+
+
+def primary_key_column(model):
+    '''
+    Returns the column name of the primary key of model
+    '''
+    return model._meta.primary_key.column_name
+
+
+def status_sequence(status_id):
+    '''
+    Returns the number after the first underscore of status_id (0 if it
+    is not a number), the value of socialnetwork_model.STATUS_SEQUENCE
+    '''
+    match = re.match(r'\s*([+-]?\d+)', status_id.partition('_')[2])
+    return int(match.group(1)) if match else 0
+
+
+def words_of(text):
+    '''
+    Returns the lowercase words of text, as the full-text index splits it
+    '''
+    return re.findall(r'\w+', text.casefold())
+
+
+def has_phrase(words, phrase):
+    '''
+    Returns True if the list phrase appears in the list words
+    '''
+    size = len(phrase)
+    return any(words[i:i + size] == phrase for i in range(len(words) - size + 1))
+
+
+def open_snapshot(path, mode, compress=None):
+    '''
+    Opens a snapshot file as text, through gzip if compress is True, or
+    if compress is None and path ends with .gz
+    '''
+    if compress is None:
+        compress = path.endswith('.gz')
+    if compress:
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
@@ -0,0 +1,5 @@
+'''
+Benchmarks for the social network project
+
+Run "python -m benchmarks --help" from the project directory.
+'''
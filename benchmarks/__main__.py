@@ -0,0 +1,43 @@
+'''
+Command line entry point: python -m benchmarks --scale 10k --scale 1M
+'''
+import argparse
+import json
+import logging
+from benchmarks import concurrency, run
+
+
+def main():
+    '''
+    Runs the benchmarks for each requested scale and appends the results
+    to the output file
+    '''
+    parser = argparse.ArgumentParser(description='Benchmark the social network database.')
+    parser.add_argument('--scale', action='append',
+                        help="number of statuses, e.g. 10k, 1M or 10M (repeatable)")
+    parser.add_argument('--output', default='benchmark_results.jsonl',
+                        help='JSON lines file the results are appended to')
+    parser.add_argument('--directory', help='where to put the temporary data and database')
+    parser.add_argument('--workers', type=int, default=1, help='validation processes')
+    parser.add_argument('--profile', default='balanced', help='database profile')
+    parser.add_argument('--backend', action='append', choices=run.BACKENDS,
+                        help='storage backend to time (repeatable, default sqlite)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--threads', type=int, action='append',
+                        help='also time concurrent reads with this many threads (repeatable)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    for scale in args.scale or ['10k']:
+        for backend in args.backend or ['sqlite']:
+            results = run.run(scale, args.directory, args.seed, args.workers, args.profile,
+                              backend)
+            run.write_results(results, args.output)
+            print(json.dumps(results, indent=2))
+    if args.threads:
+        results = concurrency.run_reads(args.directory, args.threads, args.profile)
+        run.write_results(results, args.output)
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
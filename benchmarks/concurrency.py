@@ -0,0 +1,73 @@
+'''
+Measures read throughput of one UserCollection shared by increasing
+numbers of threads, each using its own pooled database connection
+'''
+import os
+import platform
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+import main
+import socialnetwork_model as sm
+from benchmarks import run
+
+USERS = 200
+READS_PER_THREAD = 500
+THREAD_COUNTS = [1, 2, 4, 8]
+
+
+def read_throughput(user_collection, threads, users=USERS, reads=READS_PER_THREAD):
+    '''
+    Runs reads search_user calls for the ids user0 to user<users - 1> on
+    each of threads worker threads and returns (reads per second, number
+    of failed reads).
+    '''
+    found = []
+
+    def worker(offset):
+        with sm.db.connection_context():
+            for i in range(reads):
+                user_id = f'user{(offset + i) % users}'
+                user = user_collection.search_user(user_id)
+                if user is not None and user.user_id == user_id:
+                    found.append(user_id)
+
+    workers = [threading.Thread(target=worker, args=(i * 37,)) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return threads * reads / elapsed, threads * reads - len(found)
+
+
+def run_reads(directory=None, thread_counts=None, profile='balanced'):
+    '''
+    Times concurrent reads in a fresh file database (WAL needs a real
+    file) in directory, a temporary one by default, for each number of
+    threads in thread_counts. Returns a dictionary of results in the
+    format of run.run.
+    '''
+    thread_counts = thread_counts or THREAD_COUNTS
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        main.init_database(os.path.join(tmp, 'concurrency.db'), profile=profile)
+        user_collection = main.init_user_collection()
+        main.add_users([(f'user{i}', f'user{i}@uw.edu', 'Stress', 'Test')
+                        for i in range(USERS)], user_collection)
+        results = {}
+        for threads in thread_counts:
+            rate, failures = read_throughput(user_collection, threads)
+            if failures:
+                raise RuntimeError(f'{failures} reads failed with {threads} threads')
+            operations = threads * READS_PER_THREAD
+            results[f'concurrent_reads_{threads}'] = {
+                'seconds': round(operations / rate, 6), 'operations': operations,
+                'ops_per_second': round(rate, 1)}
+        sm.db.close_all()
+    return {'users': USERS, 'profile': profile, 'commit': run.git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+            'results': results}
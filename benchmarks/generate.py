@@ -0,0 +1,86 @@
+'''
+Synthetic data generator for the benchmarks
+
+Writes users in the accounts.csv format (USER_ID,NAME,LASTNAME,EMAIL)
+and statuses in the status updates format (STATUS_ID,USER_ID,STATUS_TEXT),
+both accepted by main.load_users and main.load_status_updates.
+'''
+import csv
+import random
+
+FIRST_NAMES = ['Brittaney', 'Keri', 'Isabel', 'Brigitta', 'Adelaida', 'Cora', 'Binny',
+               'Lonnie', 'Talya', 'Joanna', 'Audrie', 'Marcus', 'Kathleen', 'Eve', 'David']
+LAST_NAMES = ['Gentry', 'Royce', 'Avivah', 'Balsam', 'Pearman', 'Zarger', "O'Connell",
+              'Fielding', 'Demb', 'Hughett', 'Morris', 'Bakke', 'Wong', 'Miles', 'Yuen']
+DOMAINS = ['goodmail.com', 'funmail.com', 'uw.edu']
+WORDS = ['thinkable', 'existence', 'hug', 'aback', 'sky', 'stormy', 'remind', 'encouraging',
+         'cough', 'troubled', 'deal', 'parsimonious', 'blade', 'rich', 'wilderness', 'leave',
+         'foolish', 'crowded', 'carry', 'obtainable', 'spade', 'wee', 'step', 'beautiful',
+         'day', 'rustic', 'rest', 'naughty', 'basketball', 'carve', 'hurt', 'afraid', 'eye']
+# Statuses per user, as in the sample data (1,000 users, 100,000 statuses)
+STATUSES_PER_USER = 100
+SCALE_SUFFIXES = {'k': 1000, 'm': 1000000}
+
+
+def parse_scale(scale):
+    '''
+    Converts a scale such as '10k', '1M' or '2500' to a number of statuses
+    '''
+    scale = str(scale).strip().lower()
+    if scale[-1:] in SCALE_SUFFIXES:
+        return int(float(scale[:-1]) * SCALE_SUFFIXES[scale[-1]])
+    return int(scale)
+
+
+def user_ids(count):
+    '''
+    Returns count distinct user_ids such as Brittaney.Gentry86
+    '''
+    ids = []
+    for i in range(count):
+        first = FIRST_NAMES[i % len(FIRST_NAMES)]
+        last = LAST_NAMES[i // len(FIRST_NAMES) % len(LAST_NAMES)].replace("'", '')
+        ids.append(f'{first}.{last}{i}')
+    return ids
+
+
+def write_users(filename, count, seed=0):
+    '''
+    Writes count users to filename and returns their user_ids
+    '''
+    rng = random.Random(seed)
+    ids = user_ids(count)
+    with open(filename, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['USER_ID', 'NAME', 'LASTNAME', 'EMAIL'])
+        for user_id in ids:
+            name, last_name = user_id.split('.')[0], rng.choice(LAST_NAMES)
+            writer.writerow([user_id, name, last_name, f'{user_id}@{rng.choice(DOMAINS)}'])
+    return ids
+
+
+def write_statuses(filename, ids, count, seed=0):
+    '''
+    Writes count statuses, spread round-robin over the given user_ids,
+    each with five random words of text
+    '''
+    rng = random.Random(seed)
+    with open(filename, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['STATUS_ID', 'USER_ID', 'STATUS_TEXT'])
+        for i in range(count):
+            user_id = ids[i % len(ids)]
+            writer.writerow([f'{user_id}_{i // len(ids) + 1:05d}', user_id,
+                             ' '.join(rng.choices(WORDS, k=5))])
+
+
+def generate(directory, statuses, seed=0):
+    '''
+    Writes users.csv and statuses.csv for the given number of statuses to
+    directory, and returns (users file, statuses file, user_ids)
+    '''
+    users_file = f'{directory}/users.csv'
+    statuses_file = f'{directory}/statuses.csv'
+    ids = write_users(users_file, max(1, statuses // STATUSES_PER_USER), seed)
+    write_statuses(statuses_file, ids, statuses, seed)
+    return users_file, statuses_file, ids
@@ -0,0 +1,142 @@
+'''
+Times the main operations of the social network against synthetic data
+and writes the results as JSON so runs can be compared across commits
+'''
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+import backends
+import main
+import socialnetwork_model as sm
+from benchmarks import generate
+
+# Number of calls timed for each repeated operation
+LOOKUPS = 1000
+SCANS = 100
+DELETES = 10
+SEARCH_WORDS = ['existence', 'beautiful day', 'sky', 'wilderness', 'basketball']
+# Storage backends which can be benchmarked, see backends.py
+BACKENDS = ('sqlite', 'sqlite-raw', 'memory')
+
+
+@contextmanager
+def timer(results, name, operations=1):
+    '''
+    Context manager which times its block and stores the seconds taken
+    and operations per second under results[name]
+    '''
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    results[name] = {'seconds': round(seconds, 6), 'operations': operations,
+                     'ops_per_second': round(operations / seconds, 1) if seconds else None}
+
+
+def consume(result):
+    '''
+    Iterates a search result to the end and returns the number of rows
+    '''
+    return sum(1 for _ in result or [])
+
+
+def git_commit():
+    '''
+    Returns the current git commit, or None outside of a git checkout
+    '''
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def open_backend(backend, directory, profile):
+    '''
+    Returns the storage backend named backend (one of BACKENDS) for the
+    collections, opening a database in directory unless it is 'memory'
+    '''
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend: {backend}')
+    if backend == 'memory':
+        return main.init_memory_backend()
+    sm.init_db(os.path.join(directory, 'benchmark.db'), profile=profile)
+    return backends.SqliteBackend() if backend == 'sqlite-raw' else None
+
+
+def run(scale, directory=None, seed=0, workers=1, profile='balanced', backend='sqlite'):
+    '''
+    Generates scale statuses (e.g. '10k', '1M'), loads them into a fresh
+    database in directory (a temporary one by default) and times each
+    operation. Returns a dictionary of results.
+
+    backend is 'sqlite' for the database, 'sqlite-raw' for the database
+    with point queries run as prepared sqlite3 statements, or 'memory'
+    for the in-memory backend (profile then has no effect).
+    '''
+    # pylint: disable=R0913,R0914,R0917
+    statuses = generate.parse_scale(scale)
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        users_file, statuses_file, ids = generate.generate(tmp, statuses, seed)
+        store = open_backend(backend, tmp, profile)
+        user_collection = main.init_user_collection(backend=store)
+        status_collection = main.init_status_collection(backend=store)
+        rng = random.Random(seed)
+        results = {}
+
+        with timer(results, 'load_users', len(ids)):
+            if not main.load_users(users_file, user_collection, workers=workers,
+                                   profile='bulk-load'):
+                raise RuntimeError(f'Unable to load {users_file}')
+        with timer(results, 'load_status_updates', statuses):
+            if not main.load_status_updates(statuses_file, status_collection,
+                                            workers=workers, profile='bulk-load'):
+                raise RuntimeError(f'Unable to load {statuses_file}')
+        sample = rng.choices(ids, k=LOOKUPS)
+        with timer(results, 'search_user', LOOKUPS):
+            for user_id in sample:
+                main.search_user(user_id, user_collection)
+        with timer(results, 'search_status', LOOKUPS):
+            for user_id in sample:
+                main.search_status(f'{user_id}_00001', status_collection)
+        added = [(user_id, f'{user_id}_{90000 + i}') for i, user_id in enumerate(sample)]
+        with timer(results, 'add_status', LOOKUPS):
+            for user_id, status_id in added:
+                main.add_status(user_id, status_id, 'Benchmarking', status_collection)
+        with timer(results, 'delete_status', LOOKUPS):
+            for _, status_id in added:
+                main.delete_status(status_id, status_collection)
+        with timer(results, 'search_all_status_updates', SCANS):
+            for user_id in sample[:SCANS]:
+                consume(main.search_all_status_updates(user_id, status_collection))
+        with timer(results, 'filter_status_by_string', len(SEARCH_WORDS)):
+            for word in SEARCH_WORDS:
+                consume(main.filter_status_by_string(word, status_collection))
+        with timer(results, 'search_status_by_phrase', len(SEARCH_WORDS)):
+            for word in SEARCH_WORDS:
+                consume(main.search_status_by_phrase(word, status_collection))
+        doomed = rng.sample(ids, min(DELETES, len(ids)))
+        with timer(results, 'delete_user_cascade', len(doomed)):
+            for user_id in doomed:
+                main.delete_user(user_id, user_collection)
+        if backend != 'memory':
+            sm.db.close_all()
+    return {'scale': statuses, 'users': len(ids), 'seed': seed, 'workers': workers,
+            'profile': profile, 'backend': backend, 'commit': git_commit(),
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+            'results': results}
+
+
+def write_results(results, filename):
+    '''
+    Appends results as one JSON line to filename
+    '''
+    with open(filename, 'a', encoding='utf-8') as file:
+        file.write(json.dumps(results) + '\n')
@@ -0,0 +1,63 @@
+'''
+Bloom filter used by the collections to answer "is this ID certainly
+absent?" without a database round trip
+'''
+import hashlib
+import math
+import threading
+
+
+class BloomFilter:
+    '''
+    Compact set of strings which can report false positives but never
+    false negatives
+
+    The filter is sized for capacity keys at roughly error_rate false
+    positives. Adding more keys than that raises the false positive
+    rate, but a key which was added is always reported as present.
+    Keys cannot be removed. All methods are safe to call from several
+    threads.
+    '''
+
+    def __init__(self, capacity=1024, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, key):
+        '''
+        Returns the bit positions of key, derived from one digest by
+        double hashing
+        '''
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        '''
+        Adds key to the filter
+        '''
+        self.update((key,))
+
+    def update(self, keys):
+        '''
+        Adds every key in keys to the filter
+        '''
+        positions = [self._positions(key) for key in keys]
+        with self._lock:
+            for key_positions in positions:
+                for position in key_positions:
+                    self._bits[position >> 3] |= 1 << (position & 7)
+            self.count += len(positions)
+
+    def __contains__(self, key):
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+    def __len__(self):
+        return self.count
@@ -0,0 +1,111 @@
+'''
+Bounded read-through cache for the collection classes
+'''
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    '''
+    Least-recently-used cache holding at most maxsize entries
+
+    Entries older than ttl seconds (if given) are treated as missing.
+    hits and misses count lookups so the cache can be sized. All methods
+    are safe to call from several threads.
+
+    generation counts the removals. A read-through caller takes it before
+    reading the value and passes it to put, which then drops the value if
+    an entry was removed in the meantime, as the value may be stale.
+    '''
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Returns the cached value for key, or None on a miss
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None \
+                    and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, generation=None):
+        '''
+        Stores value under key, evicting the least recently used entry
+        if the cache is full. If generation is given and entries have been
+        removed since it was taken, value is not stored.
+        '''
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        '''
+        Removes key from the cache if present
+        '''
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(key, None)
+
+    def discard_if(self, predicate):
+        '''
+        Removes every entry whose value satisfies predicate
+        '''
+        with self._lock:
+            self.generation += 1
+            for key in [key for key, entry in self._entries.items() if predicate(entry[0])]:
+                del self._entries[key]
+
+    def clear(self):
+        '''
+        Removes all entries and resets the counters
+        '''
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        '''
+        Returns a dictionary with the current size, hits and misses
+        '''
+        with self._lock:
+            return {'size': len(self._entries), 'maxsize': self.maxsize,
+                    'hits': self.hits, 'misses': self.misses}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def shared_cache(cache_size, cache_ttl, registry):
+    '''
+    Returns an LRUCache of cache_size entries (expiring after cache_ttl
+    seconds) added to registry, the set of caches a write invalidates
+    together, or None if cache_size is 0
+    '''
+    if not cache_size:
+        return None
+    cache = LRUCache(cache_size, cache_ttl)
+    registry.add(cache)
+    return cache
@@ -0,0 +1,254 @@
+'''
+Per-operation timing and query-count instrumentation
+
+Functions and methods wrapped with instrumented (or classes wrapped with
+instrument_class) record, per operation, the number of calls and errors,
+a latency histogram, the rows returned and the SQL statements issued.
+Recording is off by default and is switched at runtime with enable() and
+disable(); while off, a wrapped call costs one flag check.
+
+    instrumentation.enable()
+    ...
+    print(instrumentation.prometheus_text())
+
+SQL statements are counted from the debug records peewee logs for every
+query, so they are attributed to every operation active on the calling
+thread. Code running SQL without peewee (backends.SqliteBackend) calls
+count_query for each statement instead. Lazy results (iterators) count
+as zero rows, and statements they run while being iterated are not
+attributed to the operation.
+
+Author: Marcus Bakke
+'''
+# pylint: disable=R0903
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+
+# Upper bounds (in seconds) of the latency histogram buckets
+BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+_STATE = {'enabled': False, 'peewee_level': logging.NOTSET}
+_STATS = {}
+_LOCK = threading.Lock()
+# Stack of query counters of the operations running on each thread
+_ACTIVE = threading.local()
+
+
+class OperationStats:
+    '''
+    Counters for a single operation
+    '''
+    __slots__ = ('calls', 'errors', 'seconds', 'buckets', 'rows', 'queries')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.rows = 0
+        self.queries = 0
+
+    def record(self, seconds, rows, queries, error):
+        '''
+        Adds one call to the counters
+        '''
+        self.calls += 1
+        self.errors += error
+        self.seconds += seconds
+        self.rows += rows
+        self.queries += queries
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+    def as_dict(self):
+        '''
+        Returns the counters as a dictionary
+        '''
+        return {'calls': self.calls, 'errors': self.errors,
+                'seconds': round(self.seconds, 6), 'rows': self.rows, 'queries': self.queries,
+                'histogram': dict(zip([str(bound) for bound in BUCKETS] + ['+Inf'],
+                                      self.buckets))}
+
+
+class _QueryCounter(logging.Filter):
+    '''
+    Filter on the peewee logger counting each query for the operations
+    active on the current thread
+    '''
+    def __init__(self):
+        super().__init__()
+        self.passthrough = False
+
+    def filter(self, record):
+        count_query()
+        # Only let the record through if peewee debug logging was wanted
+        return self.passthrough
+
+
+_QUERY_COUNTER = _QueryCounter()
+
+
+def count_query():
+    '''
+    Counts one SQL statement for the operations active on the current
+    thread. Only needed for statements which bypass peewee's logger.
+    '''
+    for counter in getattr(_ACTIVE, 'stack', ()):
+        counter[0] += 1
+
+
+def enable():
+    '''
+    Starts recording
+    '''
+    if _STATE['enabled']:
+        return
+    peewee_logger = logging.getLogger('peewee')
+    _QUERY_COUNTER.passthrough = peewee_logger.isEnabledFor(logging.DEBUG)
+    _STATE['peewee_level'] = peewee_logger.level
+    peewee_logger.addFilter(_QUERY_COUNTER)
+    peewee_logger.setLevel(logging.DEBUG)
+    _STATE['enabled'] = True
+    logging.info('Instrumentation enabled.')
+
+
+def disable():
+    '''
+    Stops recording; the counters are kept until reset()
+    '''
+    if not _STATE['enabled']:
+        return
+    _STATE['enabled'] = False
+    peewee_logger = logging.getLogger('peewee')
+    peewee_logger.removeFilter(_QUERY_COUNTER)
+    peewee_logger.setLevel(_STATE['peewee_level'])
+    logging.info('Instrumentation disabled.')
+
+
+def is_enabled():
+    '''
+    Returns True while recording
+    '''
+    return _STATE['enabled']
+
+
+def reset():
+    '''
+    Clears all counters
+    '''
+    with _LOCK:
+        _STATS.clear()
+
+
+def row_count(result):
+    '''
+    Returns the number of rows in an operation's result
+    '''
+    if result is None or isinstance(result, (bool, int)):
+        return 0
+    if hasattr(result, '_fields'):
+        # A compact record is one row, not a tuple of rows
+        return 1
+    if isinstance(result, dict):
+        # Lookups of many ids map the ids not found to None, which count
+        # as no row, just like a single lookup returning None
+        return sum(value is not None for value in result.values())
+    if isinstance(result, (list, tuple, set)):
+        return len(result)
+    if hasattr(result, '__next__'):
+        return 0
+    return 1
+
+
+def instrumented(func):
+    '''
+    Decorator recording calls of func under module.qualname
+    '''
+    name = f'{func.__module__}.{func.__qualname__}'
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _STATE['enabled']:
+            return func(*args, **kwargs)
+        stack = getattr(_ACTIVE, 'stack', None)
+        if stack is None:
+            stack = _ACTIVE.stack = []
+        counter = [0]
+        stack.append(counter)
+        result = None
+        error = True
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+            error = False
+            return result
+        finally:
+            seconds = time.perf_counter() - start
+            stack.pop()
+            with _LOCK:
+                stats = _STATS.get(name)
+                if stats is None:
+                    stats = _STATS[name] = OperationStats()
+                stats.record(seconds, row_count(result), counter[0], error)
+    return wrapper
+
+
+def instrument_class(cls):
+    '''
+    Class decorator applying instrumented to every public method
+    '''
+    for attribute, value in list(vars(cls).items()):
+        if inspect.isfunction(value) and not attribute.startswith('_'):
+            setattr(cls, attribute, instrumented(value))
+    return cls
+
+
+def snapshot():
+    '''
+    Returns a dictionary of operation name to its counters
+    '''
+    with _LOCK:
+        return {name: stats.as_dict() for name, stats in sorted(_STATS.items())}
+
+
+def dump(filename=None):
+    '''
+    Returns the counters as JSON, also writing them to filename if given
+    '''
+    text = json.dumps(snapshot(), indent=2)
+    if filename:
+        with open(filename, 'w', encoding='utf-8') as file:
+            file.write(text)
+    return text
+
+
+def prometheus_text(prefix='socialnetwork_operation'):
+    '''
+    Returns the counters in the Prometheus text exposition format
+    '''
+    lines = [f'# HELP {prefix}_seconds Latency of social network operations.',
+             f'# TYPE {prefix}_seconds histogram']
+    counters = {'errors': [], 'rows': [], 'queries': []}
+    for name, stats in snapshot().items():
+        label = f'operation="{name}"'
+        total = 0
+        for bound, count in stats['histogram'].items():
+            total += count
+            lines.append(f'{prefix}_seconds_bucket{{{label},le="{bound}"}} {total}')
+        lines.append(f'{prefix}_seconds_sum{{{label}}} {stats["seconds"]}')
+        lines.append(f'{prefix}_seconds_count{{{label}}} {stats["calls"]}')
+        for counter, samples in counters.items():
+            samples.append(f'{prefix}_{counter}_total{{{label}}} {stats[counter]}')
+    for counter, samples in counters.items():
+        lines.append(f'# HELP {prefix}_{counter}_total Total {counter} of social network '
+                     'operations.')
+        lines.append(f'# TYPE {prefix}_{counter}_total counter')
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
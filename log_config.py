@@ -0,0 +1,57 @@
+'''
+Non-blocking logging setup
+
+Records are put on an in-memory queue by a QueueHandler and written to
+the log file by a QueueListener thread, so callers never wait on disk.
+
+Per-record messages from the collection classes (added, modified,
+deleted, found) are logged at the ROW level, which sits just below INFO.
+They are skipped entirely unless row logging is turned on, so bulk loads
+and tight loops don't pay for a log record per row.
+'''
+import logging
+import logging.handlers
+import queue
+
+ROW = logging.INFO - 5
+logging.addLevelName(ROW, 'ROW')
+
+FILE_FORMAT = "%(asctime)s %(filename)s:%(lineno)-4d %(levelname)s %(message)s"
+
+
+def setup_logging(filename, level=logging.INFO, row_logging=False):
+    '''
+    Sends records from the root logger to filename through a queue and
+    returns the started QueueListener; pass it to stop_logging on exit.
+    '''
+    file_handler = logging.FileHandler(filename)
+    file_handler.setFormatter(logging.Formatter(FILE_FORMAT))
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, file_handler)
+    logger = logging.getLogger()
+    logger.setLevel(min(level, ROW) if row_logging else level)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    return listener
+
+
+def set_row_logging(enabled, level=logging.INFO):
+    '''
+    Turns per-record messages from the collection classes on or off
+    '''
+    logging.getLogger().setLevel(min(level, ROW) if enabled else level)
+
+
+def stop_logging(listener):
+    '''
+    Removes the queue handler, writes out any queued records and closes
+    the log file
+    '''
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        if isinstance(handler, logging.handlers.QueueHandler) and \
+                handler.queue is listener.queue:
+            logger.removeHandler(handler)
+    listener.stop()
+    for handler in listener.handlers:
+        handler.close()
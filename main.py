@@ -3,73 +3,202 @@ main driver for a simple social network project
 
 Authors: Kathleen Wong and Marcus Bakke
 '''
+# pylint: disable=C0302
 import csv
+import gzip
+import hashlib
+import os
 import re
 import logging
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import Future, ProcessPoolExecutor
 import peewee as pw
+import backends
 import users
 import user_status
 import socialnetwork_model as sm
+from instrumentation import instrumented
 
 
-def init_user_collection():
+def init_database(filename=sm.FILE, **options):
+    '''
+    Opens (or creates) the database file used by the collections
+
+    Requirements:
+    - Must be called before the collections are used.
+    - options are passed on to socialnetwork_model.init_db.
+    '''
+    return sm.init_db(filename, **options)
+
+
+def init_memory_backend(snapshot=None):
+    '''
+    Creates and returns an in-memory storage backend, which replaces the
+    database for collections created with it
+
+    Requirements:
+    - Pass the same backend to init_user_collection and
+      init_status_collection.
+    - If snapshot names an existing file, the rows saved there are loaded.
+      Call save() on the backend to write them back.
+    '''
+    return backends.MemoryBackend(snapshot)
+
+
+def init_user_collection(cache_size=0, cache_ttl=None, id_filter=False, backend=None):
     '''
     Creates and returns a new instance of UserCollection
+
+    cache_size and cache_ttl configure the optional search_user cache,
+    and id_filter the optional membership filter of user_ids. backend
+    defaults to the database opened by init_database.
     '''
-    return users.UserCollection()
+    return users.UserCollection(cache_size, cache_ttl, id_filter, backend)
 
 
-def init_status_collection():
+def init_status_collection(cache_size=0, cache_ttl=None, id_filter=False, backend=None):
     '''
     Creates and returns a new instance of UserStatusCollection
 
+    cache_size and cache_ttl configure the optional search_status cache,
+    and id_filter the optional membership filter of status_ids. backend
+    defaults to the database opened by init_database.
+
     Author: Marcus Bakke
     '''
-    return user_status.UserStatusCollection()
+    return user_status.UserStatusCollection(cache_size, cache_ttl, id_filter, backend)
 
 
-def load_users(filename, user_collection):
+@instrumented
+def load_users(filename, user_collection, **options):
     '''
     Opens a CSV file with user data and
     adds it to an existing instance of
     UserCollection
 
     Requirements:
-    - If a user_id already exists, it
-    will ignore it and continue to the
-    next.
+    - If a user_id already exists, the
+    load fails unless conflict='ignore'
+    (skip it) or conflict='replace'
+    (overwrite it) is passed.
     - Returns False if there are any errors
     (such as empty fields in the source CSV file)
     - Otherwise, it returns True.
+
+    Any options (such as chunk_size, workers, profile, conflict or checkpoint) are passed
+    on to load_collection, whose LoadResult is returned.
     '''
     # Loop through each row in csv file
-    keys = {'USER_ID':  {'validate': validate_user_id,  'key': 'user_id'},
-            'EMAIL':    {'validate': validate_email,    'key': 'user_email'},
-            'NAME':     {'validate': validate_name,     'key': 'user_name'},
-            'LASTNAME': {'validate': validate_name,     'key': 'user_last_name'}}
-    return load_collection(filename, keys, user_collection)
+    return load_collection(filename, USER_KEYS, user_collection, **options)
 
 
-def load_status_updates(filename, status_collection):
+@instrumented
+def load_status_updates(filename, status_collection, **options):
     '''
     Opens a CSV file with status data and adds it to an existing
     instance of UserStatusCollection
 
     Requirements:
-    - If a status_id already exists, it will ignore it and continue to
-      the next.
+    - If a status_id already exists, the load fails unless
+      conflict='ignore' (skip it) or conflict='replace' (overwrite it)
+      is passed.
     - Returns False if there are any errors(such as empty fields in the
       source CSV file)
     - Otherwise, it returns True.
 
+    Any options (such as chunk_size, workers, profile, conflict or checkpoint) are passed
+    on to load_collection, whose LoadResult is returned.
+
     Author: Marcus Bakke
     '''
-    keys = {'STATUS_ID':   {'validate': validate_status_id,   'key': 'status_id'},
-            'USER_ID':     {'validate': validate_user_id,     'key': 'user_id'},
-            'STATUS_TEXT': {'validate': validate_status_text, 'key': 'status_text'}}
-    return load_collection(filename, keys, status_collection)
+    return load_collection(filename, STATUS_KEYS, status_collection, **options)
+
+
+@instrumented
+def sync_users(filename, user_collection, **options):
+    '''
+    Makes the users table match a full snapshot of accounts in the
+    load_users CSV format
+
+    Requirements:
+    - Users missing from the table are added, users whose fields differ
+      are updated and users missing from the snapshot are deleted
+      (with their statuses). Unchanged users are not written.
+    - Returns a false SyncResult if there are any errors, in which case
+      nothing is changed.
+
+    Any options (such as chunk_size, workers or profile) are passed on to
+    sync_collection.
+    '''
+    return sync_collection(filename, USER_KEYS, user_collection, user_collection.delete_users,
+                           **options)
 
 
+@instrumented
+def sync_status_updates(filename, status_collection, **options):
+    '''
+    Makes the status table match a full snapshot of status updates in
+    the load_status_updates CSV format
+
+    Requirements:
+    - Statuses missing from the table are added, statuses whose user or
+      text differ are updated and statuses missing from the snapshot are
+      deleted. Unchanged statuses are not written.
+    - Returns a false SyncResult if there are any errors (such as a
+      status of an unknown user), in which case nothing is changed.
+
+    Any options (such as chunk_size, workers or profile) are passed on to
+    sync_collection.
+
+    Author: Marcus Bakke
+    '''
+    return sync_collection(filename, STATUS_KEYS, status_collection,
+                           status_collection.delete_statuses, **options)
+
+
+@instrumented
+def save_users(filename, user_collection, compress=None):
+    '''
+    Writes every user in user_collection to a CSV file in the format
+    read by load_users
+
+    Requirements:
+    - Rows are streamed from the database, so memory use stays flat.
+    - The file is gzip compressed if compress is True, or if compress is
+      None and filename ends with .gz.
+    - Returns False if the file cannot be written, otherwise True.
+    '''
+    model = user_collection.database
+    columns = {'USER_ID': model.user_id,
+               'EMAIL': model.user_email,
+               'NAME': model.user_name,
+               'LASTNAME': model.user_last_name}
+    return save_collection(filename, columns, user_collection, compress)
+
+
+@instrumented
+def save_status_updates(filename, status_collection, compress=None):
+    '''
+    Writes every status in status_collection to a CSV file in the format
+    read by load_status_updates
+
+    Requirements:
+    - Rows are streamed from the database, so memory use stays flat.
+    - The file is gzip compressed if compress is True, or if compress is
+      None and filename ends with .gz.
+    - Returns False if the file cannot be written, otherwise True.
+
+    Author: Marcus Bakke
+    '''
+    model = status_collection.database
+    columns = {'STATUS_ID': model.status_id,
+               'USER_ID': model.user_id,
+               'STATUS_TEXT': model.status_text}
+    return save_collection(filename, columns, status_collection, compress)
+
+
+@instrumented
 def add_user(user_id, email, user_name, user_last_name, user_collection):
     '''
     Creates a new instance of User and stores it in user_collection
@@ -86,6 +215,7 @@ def add_user(user_id, email, user_name, user_last_name, user_collection):
     return user_collection.add_user(user_id, email, user_name, user_last_name)
 
 
+@instrumented
 def update_user(user_id, email, user_name, user_last_name, user_collection):
     '''
     Updates the values of an existing user
@@ -100,6 +230,7 @@ def update_user(user_id, email, user_name, user_last_name, user_collection):
     return user_collection.modify_user(user_id, email, user_name, user_last_name)
 
 
+@instrumented
 def delete_user(user_id, user_collection):
     '''
     Deletes a user from user_collection.
@@ -111,21 +242,38 @@ def delete_user(user_id, user_collection):
     return user_collection.delete_user(user_id)
 
 
-def search_user(user_id, user_collection):
+@instrumented
+def search_user(user_id, user_collection, fields=None):
     '''
     Searches for a user in user_collection(which is an instance of
     UserCollection).
 
     Requirements:
-    - If the user is found, returns the corresponding User instance.
+    - If the user is found, returns the corresponding User instance,
+      or a named tuple of just the given fields (e.g. ['user_id',
+      'user_name']) if fields is passed.
     - Otherwise, it returns None.
     '''
-    result = user_collection.search_user(user_id)
+    result = user_collection.search_user(user_id, fields)
     if result:
         return result
     return None
 
 
+@instrumented
+def search_users_many(user_ids, user_collection, fields=None):
+    '''
+    Searches for many users in user_collection at once
+
+    Requirements:
+    - Returns a dict mapping each user_id to what search_user would
+      return for it: the User instance (or named tuple of fields), or
+      None if it is not found.
+    '''
+    return user_collection.search_users_many(user_ids, fields)
+
+
+@instrumented
 def add_status(user_id, status_id, status_text, status_collection):
     '''
     Creates a new instance of UserStatus and stores it in
@@ -145,6 +293,39 @@ def add_status(user_id, status_id, status_text, status_collection):
     return status_collection.add_status(status_id, user_id, status_text)
 
 
+@instrumented
+def open_status_writer(status_collection, max_size=500, max_delay=1.0, background=True):
+    '''
+    Returns a StatusWriter which adds statuses to status_collection in
+    batches of up to max_size, or after max_delay seconds, in a single
+    transaction each. Pass it to add_status_buffered and close it (or
+    use it in a with block) when done.
+
+    Author: Marcus Bakke
+    '''
+    return status_collection.buffered_writer(max_size, max_delay, background)
+
+
+@instrumented
+def add_status_buffered(user_id, status_id, status_text, status_writer):
+    '''
+    Queues a new status on a StatusWriter, as add_status
+
+    Requirements:
+    - Returns a Future which resolves to True once the status is added,
+      or to False if it could not be added.
+    - Invalid inputs resolve to False straight away, without queueing.
+
+    Author: Marcus Bakke
+    '''
+    if not validate_status_inputs(status_id, user_id, status_text):
+        future = Future()
+        future.set_result(False)
+        return future
+    return status_writer.add(status_id, user_id, status_text)
+
+
+@instrumented
 def update_status(status_id, user_id, status_text, status_collection):
     '''
     Updates the values of an existing status_id
@@ -161,6 +342,7 @@ def update_status(status_id, user_id, status_text, status_collection):
     return status_collection.modify_status(status_id, user_id, status_text)
 
 
+@instrumented
 def delete_status(status_id, status_collection):
     '''
     Deletes a status_id from user_collection.
@@ -174,98 +356,677 @@ def delete_status(status_id, status_collection):
     return status_collection.delete_status(status_id)
 
 
-def search_status(status_id, status_collection):
+@instrumented
+def search_status(status_id, status_collection, fields=None):
     '''
     Searches for a status in status_collection
 
     Requirements:
     - If the status is found, returns the corresponding
-    UserStatus instance.
+    UserStatus instance, or a named tuple of just the given fields
+    if fields is passed.
     - Otherwise, it returns None.
 
     Author: Marcus Bakke
     '''
-    result = status_collection.search_status(status_id)
+    result = status_collection.search_status(status_id, fields)
     if result:
         return result
     return None
 
 
-def filter_status_by_string(search_word, status_collection):
+@instrumented
+def search_statuses_many(status_ids, status_collection, fields=None):
+    '''
+    Searches for many statuses in status_collection at once
+
+    Requirements:
+    - Returns a dict mapping each status_id to what search_status would
+      return for it: the UserStatus instance (or named tuple of fields),
+      or None if it is not found.
+
+    Author: Marcus Bakke
+    '''
+    return status_collection.search_statuses_many(status_ids, fields)
+
+
+@instrumented
+def filter_status_by_string(search_word, status_collection, fields=None):
     '''
     Searches statuses that contains the search word
 
+    If fields is passed, the statuses are named tuples of just those
+    fields, which use much less memory than Status instances.
+
     Author: Kathleen Wong
     '''
-    result = status_collection.filter_status_by_string(search_word)
+    result = status_collection.filter_status_by_string(search_word, fields)
     return result
 
 
-def search_all_status_updates(user_id: str, status_collection: user_status.UserStatusCollection):
+@instrumented
+def latest_statuses(user_id, limit, status_collection, before=None):
+    '''
+    Returns a page of at most limit statuses for user_id, newest first
+
+    Requirements:
+    - before is the status_id of the last status on the previous page.
+    - Returns an empty list if there are no more statuses.
+    '''
+    if before is not None and not validate_status_id(before):
+        logging.error('Invalid status_id: %s', before)
+        return []
+    return status_collection.latest_statuses(user_id, limit, before)
+
+
+@instrumented
+def search_status_by_phrase(phrase, status_collection, fields=None):
+    '''
+    Searches statuses that contain the phrase using the full-text index
+
+    Requirements:
+    - Returns a lazy iterator over the matching statuses (named tuples
+      of just the given fields if fields is passed).
+    - Otherwise, it returns None.
+    '''
+    return status_collection.search_status_by_phrase(phrase, fields)
+
+
+@instrumented
+def search_all_status_updates(user_id: str, status_collection: user_status.UserStatusCollection,
+                              fields=None):
     '''
     Given user_id and StatusCollection,
     return all status updates for that user.
 
+    If fields is passed, the statuses are named tuples of just those
+    fields.
+
     Author: Marcus Bakke
     '''
-    result = status_collection.search_all_status_updates(user_id)
+    result = status_collection.search_all_status_updates(user_id, fields)
     if result:
         return result
     return None
 
 
-def load_collection(filename, keys, collection):
+@instrumented
+def add_users(records, user_collection):
+    '''
+    Adds many users to user_collection in a single transaction
+
+    Requirements:
+    - records is an iterable of (user_id, email, user_name,
+      user_last_name) tuples, as passed to add_user.
+    - Returns a list with True for each record added and False for
+      each record that is invalid or could not be added.
+    '''
+    return apply_batch(records, lambda record: validate_user_inputs(*record),
+                       user_collection.add_users)
+
+
+@instrumented
+def update_users(records, user_collection):
+    '''
+    Updates many existing users in a single transaction
+
+    Requirements:
+    - records is an iterable of (user_id, email, user_name,
+      user_last_name) tuples, as passed to update_user.
+    - Returns a list with True for each user updated and False for each
+      record that is invalid or whose user does not exist.
+    '''
+    return apply_batch(records, lambda record: validate_user_inputs(*record),
+                       user_collection.modify_users)
+
+
+@instrumented
+def delete_users(user_ids, user_collection):
+    '''
+    Deletes many users (and their statuses) in a single transaction
+
+    Requirements:
+    - Returns a list with True for each user deleted and False for each
+      user_id that was not found.
+    '''
+    return user_collection.delete_users(user_ids)
+
+
+@instrumented
+def add_statuses(records, status_collection):
+    '''
+    Adds many statuses to status_collection in a single transaction
+
+    Requirements:
+    - records is an iterable of (user_id, status_id, status_text)
+      tuples, as passed to add_status.
+    - Returns a list with True for each record added and False for
+      each record that is invalid or could not be added.
+
+    Author: Marcus Bakke
+    '''
+    records = [(status_id, user_id, status_text)
+               for user_id, status_id, status_text in records]
+    return apply_batch(records, lambda record: validate_status_inputs(*record),
+                       status_collection.add_statuses)
+
+
+@instrumented
+def update_statuses(records, status_collection):
+    '''
+    Updates many existing statuses in a single transaction
+
+    Requirements:
+    - records is an iterable of (status_id, user_id, status_text)
+      tuples, as passed to update_status.
+    - Returns a list with True for each status updated and False for
+      each record that is invalid or whose status does not exist.
+
+    Author: Marcus Bakke
+    '''
+    return apply_batch(records, lambda record: validate_status_inputs(*record),
+                       status_collection.modify_statuses)
+
+
+@instrumented
+def delete_statuses(status_ids, status_collection):
+    '''
+    Deletes many statuses in a single transaction
+
+    Requirements:
+    - Returns a list with True for each status deleted and False for each
+      status_id that was not found.
+
+    Author: Marcus Bakke
+    '''
+    return status_collection.delete_statuses(status_ids)
+
+
+def apply_batch(records, validate, write):
+    '''
+    Validates each record and passes the valid ones to write in one call,
+    returning a result per record in the original order
+    '''
+    records = list(records)
+    valid = [i for i, record in enumerate(records) if validate(record)]
+    results = [False] * len(records)
+    for i, result in zip(valid, write([records[i] for i in valid])):
+        results[i] = result
+    return results
+
+
+# What load_collection does with rows whose ID is already in the database
+CONFLICT_POLICIES = ('fail', 'ignore', 'replace')
+# Bytes read from the start of a file to fingerprint a checkpointed load
+FINGERPRINT_BYTES = 65536
+
+
+class LoadResult:
+    '''
+    Outcome of load_collection: true if the load succeeded, with the
+    number of rows inserted, skipped (existing IDs left alone) and
+    replaced (existing IDs overwritten)
+    '''
+    # pylint: disable=R0903
+
+    def __init__(self, success, inserted=0, skipped=0, replaced=0):
+        self.success = success
+        self.inserted = inserted
+        self.skipped = skipped
+        self.replaced = replaced
+
+    def __bool__(self):
+        return self.success
+
+    def __repr__(self):
+        return (f'LoadResult(success={self.success}, inserted={self.inserted}, '
+                f'skipped={self.skipped}, replaced={self.replaced})')
+
+
+@instrumented
+def load_collection(filename, keys, collection, *, chunk_size=10000, workers=1, profile=None,
+                    conflict='fail', checkpoint=False):
     '''
     Method which loads status or user collection from CSV file
 
+    Rows are read, validated and inserted chunk_size rows at a time so
+    memory use stays bounded by the chunk size rather than the file size.
+    All chunks are inserted in a single transaction which is rolled back
+    if any row fails, so the load is still all-or-nothing.
+
+    If workers is greater than 1, chunks are validated in a pool of that
+    many processes while this process inserts the chunks which have
+    already passed. Results are consumed in file order, so the first bad
+    line reported is the same one the serial path would report.
+
+    If profile is given (e.g. 'bulk-load'), the connection is switched to
+    that database profile for the length of the import.
+
+    conflict decides what happens to rows whose ID already exists:
+    'fail' rolls back the whole load, 'ignore' skips the row (rows
+    breaking any other constraint still fail the load) and
+    'replace' overwrites the existing row in place (an upsert, so
+    statuses of a replaced user are kept). Returns a LoadResult, which
+    is false if the load failed.
+
+    If checkpoint is True, the load is no longer all-or-nothing: each
+    chunk is committed together with the position reached in the file
+    (see load_checkpointed), and a rerun on the same file carries on
+    after the last committed chunk. Only backends which can record the
+    position (the database, not the memory backend) support this.
+
     Author: Marcus Bakke
     '''
-    # Loop through each row in csv file
+    # pylint: disable=R0913,R0914
+    if conflict not in CONFLICT_POLICIES:
+        raise ValueError(f'Unknown conflict policy {conflict!r}; '
+                         f'expected one of {", ".join(CONFLICT_POLICIES)}')
+    backend = collection.backend
+    if checkpoint and not backend.checkpoints:
+        raise ValueError(f'{type(backend).__name__} does not support checkpointed loads')
+    profile_context = backend.use_profile(collection.database, profile) if profile \
+        else nullcontext()
+    result = LoadResult(True)
     try:
-        with open(filename, 'r', encoding="utf-8") as file:
+        if checkpoint:
+            with profile_context:
+                return load_checkpointed(filename, keys, collection, chunk_size=chunk_size,
+                                         workers=workers, conflict=conflict)
+        with open_csv(filename, 'r') as file:
             reader = csv.DictReader(file)
-            data = []
-            for row in reader:
-                new_row = row.copy()
-                # Check for errors in current row
-                for key, value in row.items():
-                    if value.replace(' ', '') == '':
-                        print(f'Empty value found for {key} on ' \
-                            f'line {reader.line_num} of {filename}.')
-                        return False
-                    # Validate input
+            # Execute bulk data insertion
+            with profile_context, backend.atomic(collection.database) as transaction:
+                loaded = 0
+                chunks = read_chunks(reader, chunk_size)
+                for rows, error in validated_chunks(chunks, keys, filename, workers):
+                    if error:
+                        print(error)
+                        transaction.rollback()
+                        return LoadResult(False)
+                    logging.info('-> Loading entries %s through %s.',
+                                 loaded + 1, loaded + len(rows))
                     try:
-                        if not keys[key]['validate'](value):
-                            return False
-                    except KeyError:
-                        return False
-                    # Replace keys
-                    new_row[keys[key]['key']] = new_row.pop(key)
-                # Append data
-                data.append(new_row)
-        # Execute bulk data insertion
-        with sm.db.atomic():
-            # This specifies how large the chunks to load with insert_many should be
-            # It seems this number is dependent on the specs of the computer...
-            # You may need to adjust this if it doesn't run on your computer.
-            # Source: https://stackoverflow.com/a/36788489
-            num = 10000
-            for i in range(0, len(data), num):
-                subset = data[i:i+num]
-                logging.info('-> Loading entries %s through %s.',
-                             i+1,
-                             i+num if i+num < len(data) else len(data))
+                        insert_chunk(rows, keys, collection, conflict, result)
+                    except pw.IntegrityError as err:
+                        logging.error('peewee IntegrityError encountered: %s', err.args[0])
+                        transaction.rollback()
+                        return LoadResult(False)
+                    loaded += len(rows)
+        logging.info('Loaded %s: %i inserted, %i skipped, %i replaced.', filename,
+                     result.inserted, result.skipped, result.replaced)
+        return result
+    except FileNotFoundError:
+        logging.error('File does not exist: %s', filename)
+        return LoadResult(False)
+
+
+class SyncResult:
+    '''
+    Outcome of sync_collection: true if the sync succeeded, with the
+    number of rows inserted, updated, deleted and left unchanged
+    '''
+    # pylint: disable=R0903
+
+    def __init__(self, success, inserted=0, updated=0, deleted=0, unchanged=0):
+        # pylint: disable=R0913
+        self.success = success
+        self.inserted = inserted
+        self.updated = updated
+        self.deleted = deleted
+        self.unchanged = unchanged
+
+    def __bool__(self):
+        return self.success
+
+    def __repr__(self):
+        return (f'SyncResult(success={self.success}, inserted={self.inserted}, '
+                f'updated={self.updated}, deleted={self.deleted}, '
+                f'unchanged={self.unchanged})')
+
+
+@instrumented
+def sync_collection(filename, keys, collection, delete, *, chunk_size=10000, workers=1,
+                    profile=None):
+    '''
+    Applies the difference between a full CSV snapshot and the table of
+    collection
+
+    Each row of the snapshot is hashed and compared with the row_hash
+    stored next to the row with the same ID, so only the IDs and hashes
+    of the table are read, and only new, changed and missing rows are
+    written: new rows with insert_many, changed rows with one
+    executemany UPDATE and missing rows by passing their IDs to delete
+    (the bulk delete method of collection). Stored hashes which were
+    reset by other writes are recomputed from their rows and saved.
+
+    The snapshot is validated as in load_collection, and all changes are
+    made in one transaction which is rolled back on any error.
+
+    Author: Marcus Bakke
+    '''
+    # pylint: disable=R0913,R0914
+    model = collection.database
+    backend = collection.backend
+    primary_key = model._meta.primary_key.name  # pylint: disable=W0212
+    columns = sm.hashed_columns(model)
+    profile_context = backend.use_profile(model, profile) if profile else nullcontext()
+    try:
+        with open_csv(filename, 'r') as file:
+            with profile_context, backend.atomic(model) as transaction:
+                hashes, missing = backend.row_hashes(model)
+                inserts, updates, seen = [], [], set()
+                chunks = read_chunks(csv.DictReader(file), chunk_size)
+                for rows, error in validated_chunks(chunks, keys, filename, workers):
+                    if error:
+                        print(error)
+                        return SyncResult(False)
+                    for row in rows:
+                        row_id = row[primary_key]
+                        if row_id in seen:
+                            logging.error('Duplicate %s %s in %s.', primary_key, row_id, filename)
+                            return SyncResult(False)
+                        seen.add(row_id)
+                        row['row_hash'] = sm.content_hash(row[column] for column in columns)
+                        stored = hashes.get(row_id)
+                        if stored is None:
+                            inserts.append(row)
+                        elif stored != row['row_hash']:
+                            updates.append(row)
+                            missing.pop(row_id, None)
+                deleted = [row_id for row_id in hashes if row_id not in seen]
                 try:
-                    collection.database.insert_many(subset).execute()
+                    if deleted:
+                        delete(deleted)
+                    for batch in pw.chunked(inserts, sm.BATCH_SIZE):
+                        backend.insert_many(model, batch)
+                    collection.remember_ids(row[primary_key] for row in inserts)
+                    backend.update_rows(model, updates)
+                    backend.update_rows(model, [{primary_key: row_id, 'row_hash': row_hash}
+                                                for row_id, row_hash in missing.items()
+                                                if row_id in seen])
                 except pw.IntegrityError as err:
                     logging.error('peewee IntegrityError encountered: %s', err.args[0])
-                    return False
-        return True
+                    transaction.rollback()
+                    return SyncResult(False)
+        collection.forget_ids(row[primary_key] for row in updates)
+        result = SyncResult(True, len(inserts), len(updates), len(deleted),
+                            len(seen) - len(inserts) - len(updates))
+        logging.info('Synced %s: %i inserted, %i updated, %i deleted, %i unchanged.', filename,
+                     result.inserted, result.updated, result.deleted, result.unchanged)
+        return result
     except FileNotFoundError:
         logging.error('File does not exist: %s', filename)
+        return SyncResult(False)
+
+
+def load_checkpointed(filename, keys, collection, *, chunk_size, workers, conflict):
+    '''
+    Loads a CSV file as load_collection does, committing each chunk in
+    its own transaction together with the byte offset and line number
+    it ends at in the ImportProgress table.
+
+    If progress was recorded for the same file (by fingerprint) and
+    table, the file is read from that offset, so the committed chunks
+    are neither validated nor inserted again. The progress row is
+    deleted once the whole file has loaded. Chunks committed before a
+    failure stay in the database, and the false LoadResult returned
+    counts their rows; if the file is then corrected, its fingerprint
+    changes, so rerun it with conflict='ignore'.
+
+    Author: Marcus Bakke
+    '''
+    # pylint: disable=R0913,R0914
+    database = sm.bound_database(collection.database)
+    key = {'fingerprint': file_fingerprint(filename),
+           'table_name': collection.database._meta.table_name}  # pylint: disable=W0212
+    progress = sm.ImportProgress.get_or_none(**key)
+    result = LoadResult(True)
+    with open_binary(filename) as file:
+        position = [0]
+        header = csv.reader(tracked_lines(file, position))
+        fieldnames = next(header, None)
+        first_line = header.line_num
+        if progress is not None:
+            logging.info('Resuming %s from line %i.', filename, progress.line + 1)
+            file.seek(progress.offset)
+            position[0] = progress.offset
+            first_line = progress.line
+        reader = csv.DictReader(tracked_lines(file, position), fieldnames=fieldnames)
+        # Offset and line each chunk ends at, in the order they were read
+        marks = deque()
+        chunks = marked_chunks(read_chunks(reader, chunk_size, first_line), position, marks)
+        for rows, error in validated_chunks(chunks, keys, filename, workers):
+            offset, line = marks.popleft()
+            # Counts of the chunks committed so far
+            committed = (result.inserted, result.skipped, result.replaced)
+            if error:
+                print(error)
+                return LoadResult(False, *committed)
+            logging.info('-> Loading entries through line %s.', line)
+            try:
+                with database.atomic():
+                    insert_chunk(rows, keys, collection, conflict, result)
+                    sm.ImportProgress.replace(filename=filename, offset=offset, line=line,
+                                              **key).execute()
+            except pw.IntegrityError as err:
+                logging.error('peewee IntegrityError encountered: %s', err.args[0])
+                return LoadResult(False, *committed)
+    # The file is fully loaded, so a rerun should start from the top
+    sm.ImportProgress.delete().where(  # pylint: disable=E1120
+        (sm.ImportProgress.fingerprint == key['fingerprint']) &
+        (sm.ImportProgress.table_name == key['table_name'])).execute()
+    logging.info('Loaded %s: %i inserted, %i skipped, %i replaced.', filename,
+                 result.inserted, result.skipped, result.replaced)
+    return result
+
+
+def file_fingerprint(filename):
+    '''
+    Returns a digest of the size, modification time and first block of a
+    file, which identifies it between runs without reading all of it
+    '''
+    stat = os.stat(filename)
+    digest = hashlib.sha256(f'{stat.st_size}:{stat.st_mtime_ns}:'.encode())
+    with open(filename, 'rb') as file:
+        digest.update(file.read(FINGERPRINT_BYTES))
+    return digest.hexdigest()
+
+
+def open_binary(filename):
+    '''
+    Opens a file for reading as bytes, through gzip if filename ends
+    with .gz. Both kinds of file can seek to an offset of the content.
+    '''
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def tracked_lines(file, position):
+    '''
+    Generator which yields the lines of a binary file as text, keeping
+    position[0] at the byte offset just past the last line yielded
+    '''
+    for line in file:
+        position[0] += len(line)
+        yield line.decode('utf-8')
+
+
+def marked_chunks(chunks, position, marks):
+    '''
+    Passes chunks through, appending the (byte offset, line number) each
+    chunk ends at to marks as it is read
+    '''
+    for chunk in chunks:
+        marks.append((position[0], chunk[-1][0]))
+        yield chunk
+
+
+def insert_chunk(rows, keys, collection, conflict, result):
+    '''
+    Inserts one validated chunk using the given conflict policy and adds
+    the rows inserted, skipped and replaced to result
+
+    With conflict='fail' and a collection with an id_filter, an ID which
+    is repeated in the chunk or already loaded is found before anything
+    is inserted, and raised as an IntegrityError naming the ID.
+    '''
+    # pylint: disable=W0613
+    model = collection.database
+    backend = collection.backend
+    primary_key = model._meta.primary_key  # pylint: disable=W0212
+    ids = [row[primary_key.name] for row in rows]
+    if conflict == 'fail':
+        duplicate = find_duplicate(ids, collection) if collection.id_filter is not None else None
+        if duplicate is not None:
+            raise pw.IntegrityError(f'Duplicate {primary_key.name} {duplicate}')
+        result.inserted += backend.insert_many(model, rows)
+    elif conflict == 'ignore':
+        inserted = backend.insert_many(model, rows, 'ignore')
+        result.inserted += inserted
+        result.skipped += len(rows) - inserted
+    else:
+        # Later rows with the same ID replace earlier ones in the chunk
+        seen = collection.existing_ids(ids)
+        replaced = set()
+        for row_id in ids:
+            if row_id in seen:
+                replaced.add(row_id)
+                result.replaced += 1
+            else:
+                seen.add(row_id)
+                result.inserted += 1
+        backend.insert_many(model, rows, 'replace')
+        collection.forget_ids(replaced)
+    collection.remember_ids(ids)
+
+
+def find_duplicate(ids, collection):
+    '''
+    Returns the first of ids which is repeated in ids or already in the
+    database (including rows inserted earlier in the same transaction),
+    or None. Only the IDs the id_filter of collection reports as
+    possibly present are looked up in the database.
+    '''
+    seen = set()
+    for row_id in ids:
+        if row_id in seen:
+            return row_id
+        seen.add(row_id)
+    # A missed duplicate still fails the insert, so the filter can be trusted
+    existing = collection.backend.existing_ids(
+        collection.database, [row_id for row_id in ids if row_id in collection.id_filter])
+    return next((row_id for row_id in ids if row_id in existing), None)
+
+
+def save_collection(filename, columns, collection, compress=None):
+    '''
+    Streams the given columns (a dict of CSV column to field) of every
+    row of collection to a CSV file, as plain tuples rather than model
+    instances
+
+    Author: Marcus Bakke
+    '''
+    try:
+        with open_csv(filename, 'w', compress) as file:
+            writer = csv.writer(file)
+            writer.writerow(columns)
+            writer.writerows(collection.backend.rows(collection.database, columns.values()))
+        logging.info('Saved %s.', filename)
+        return True
+    except OSError as err:
+        logging.error('Unable to save %s: %s', filename, err)
         return False
 
 
+def open_csv(filename, mode, compress=None):
+    '''
+    Opens a CSV file for reading ('r') or writing ('w') as text, through
+    gzip if compress is True, or if compress is None and filename ends
+    with .gz
+    '''
+    if compress is None:
+        compress = filename.endswith('.gz')
+    if compress:
+        return gzip.open(filename, mode + 't', encoding='utf-8', newline='')
+    return open(filename, mode, encoding='utf-8', newline='')
+
+
+def read_chunks(reader, chunk_size, first_line=0):
+    '''
+    Generator which yields lists of (line number, row) pairs read from
+    a csv.DictReader, at most chunk_size rows at a time. first_line is
+    added to the line numbers, for readers which start partway through
+    a file.
+
+    This specifies how large the chunks to load with insert_many should be.
+    It seems this number is dependent on the specs of the computer...
+    You may need to adjust this if it doesn't run on your computer.
+    Source: https://stackoverflow.com/a/36788489
+    '''
+    chunk = []
+    for row in reader:
+        chunk.append((first_line + reader.line_num, row))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def validated_chunks(chunks, keys, filename, workers=1):
+    '''
+    Generator which yields validate_chunk results for each chunk, in order.
+
+    With more than one worker, chunks are validated in a process pool with
+    at most two chunks per worker in flight, so memory stays bounded.
+    '''
+    if workers <= 1:
+        for chunk in chunks:
+            yield validate_chunk(chunk, keys, filename)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        try:
+            for chunk in chunks:
+                pending.append(executor.submit(validate_chunk, chunk, keys, filename))
+                if len(pending) >= 2 * workers:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            # Drop queued work if the caller stopped early (e.g. on a bad row)
+            for future in pending:
+                future.cancel()
+
+
+def validate_chunk(chunk, keys, filename):
+    '''
+    Validates a chunk of (line number, row) pairs and renames the CSV
+    columns to model fields.
+
+    Returns (rows, None) if every row is valid, otherwise (None, error)
+    where error describes the first invalid row in the chunk.
+    '''
+    rows = []
+    for line_num, row in chunk:
+        new_row = {}
+        # Check for errors in current row
+        for key, value in row.items():
+            if key not in keys:
+                return None, f'Unknown column {key} on line {line_num} of {filename}.'
+            if value is None or value.replace(' ', '') == '':
+                return None, f'Empty value found for {key} on ' \
+                    f'line {line_num} of {filename}.'
+            # Validate input
+            if not keys[key]['validate'](value):
+                return None, f'Invalid value for {key} on line {line_num} of {filename}.'
+            # Replace keys
+            new_row[keys[key]['key']] = value
+        rows.append(new_row)
+    return rows, None
+
+
 def validate_user_id(user_id):
     '''
     Validates user_id
@@ -369,3 +1130,14 @@ def validate_status_inputs(status_id, user_id, status_text):
         logging.error('Invalid status_text: %s', status_text)
         return False
     return True
+
+
+# CSV columns of the load_users and load_status_updates files, with the
+# validator and model column of each
+USER_KEYS = {'USER_ID':  {'validate': validate_user_id,  'key': 'user_id'},
+             'EMAIL':    {'validate': validate_email,    'key': 'user_email'},
+             'NAME':     {'validate': validate_name,     'key': 'user_name'},
+             'LASTNAME': {'validate': validate_name,     'key': 'user_last_name'}}
+STATUS_KEYS = {'STATUS_ID':   {'validate': validate_status_id,   'key': 'status_id'},
+               'USER_ID':     {'validate': validate_user_id,     'key': 'user_id'},
+               'STATUS_TEXT': {'validate': validate_status_text, 'key': 'status_text'}}
@@ -4,21 +4,24 @@ Provides a basic frontend
 Kathleen incorporated all changes to users.py
 Marcus incorporated all changes to user_status.py code.
 '''
+import argparse
+import atexit
 import sys
 import logging
 from datetime import datetime
 import main
+import log_config
 
-# Build logger
-FILE_FORMAT = "%(asctime)s %(filename)s:%(lineno)-4d %(levelname)s %(message)s"
-formatter = logging.Formatter(FILE_FORMAT)
+# Columns shown for a user and a status; searches return just these as
+# named tuples
+USER_FIELDS = ['user_id', 'user_email', 'user_name', 'user_last_name']
+STATUS_FIELDS = ['status_id', 'user_id', 'status_text']
+
+# Build logger; records are written to the file on a background thread
 LOG_FILE = f'log_{datetime.today():%d-%m-%Y}.log'
-file_handler = logging .FileHandler(LOG_FILE)
-file_handler.setLevel(logging.INFO)
-file_handler.setFormatter(formatter)
+log_listener = log_config.setup_logging(LOG_FILE)
+atexit.register(log_config.stop_logging, log_listener)
 logger = logging.getLogger()
-logger.setLevel(logging.INFO)
-logger.addHandler(file_handler)
 # Add launch statement
 logger.info('Session launched at %s.', datetime.today().strftime(':%H:%M:%S'))
 
@@ -76,7 +79,7 @@ def search_user():
     Searches a user in the database
     '''
     user_id = input('Enter user ID to search: ')
-    result = main.search_user(user_id, user_collection)
+    result = main.search_user(user_id, user_collection, USER_FIELDS)
     if not result:
         logging.info("ERROR: User does not exist")
     else:
@@ -128,7 +131,7 @@ def search_status():
     Searches a status in the database
     '''
     status_id = input('Enter status ID to search: ')
-    result = main.search_status(status_id, status_collection)
+    result = main.search_status(status_id, status_collection, STATUS_FIELDS)
     if not result:
         logging.info("ERROR: Status does not exist")
     else:
@@ -142,7 +145,7 @@ def filter_status_by_string():
     Filters statuses by phrases
     '''
     search_word = input('Enter the string to search: ')
-    result = main.filter_status_by_string(search_word, status_collection)
+    result = main.filter_status_by_string(search_word, status_collection, STATUS_FIELDS)
     try:
         while True:
             yn_review = input('Review the next status? (Y/N): ')
@@ -161,7 +164,7 @@ def search_all_status_updates_matching_a_string():
     Filters statuses by phrase
     '''
     search_word = input('Enter the string to search: ')
-    result = main.filter_status_by_string(search_word, status_collection)
+    result = main.filter_status_by_string(search_word, status_collection, ['status_text'])
     try:
         for result_x in result:
             print(result_x.status_text)
@@ -174,7 +177,7 @@ def flagged_status_updates():
     Filter statuses for search word and turn results into tuples
     '''
     search_word = input('Enter the string to search: ')
-    result = main.filter_status_by_string(search_word, status_collection)
+    result = main.filter_status_by_string(search_word, status_collection, STATUS_FIELDS)
     try:
         [print((x.status_id, x.user_id, x.status_text)) for x in result]
     except TypeError:
@@ -218,7 +221,7 @@ def search_all_status_updates():
     ask user if they'd like to print each one
     '''
     user_id = input('Enter user ID to find status for: ')
-    query = main.search_all_status_updates(user_id, status_collection)
+    query = main.search_all_status_updates(user_id, status_collection, ['status_text'])
     # If successful query, build and loop through generator
     if query:
         status_gen = status_generator(query)
@@ -257,8 +260,23 @@ def quit_program():
 
 
 if __name__ == '__main__':
-    user_collection = main.init_user_collection()
-    status_collection = main.init_status_collection()
+    parser = argparse.ArgumentParser(description='Social network menu.')
+    parser.add_argument('--memory', action='store_true',
+                        help='keep users and statuses in memory instead of the database')
+    parser.add_argument('--snapshot', help='with --memory, file loaded at start and saved on quit')
+    parser.add_argument('--id-filter', action='store_true',
+                        help='skip lookups of ids never added through this process; rows '
+                             'added by other processes are then not found')
+    args = parser.parse_args()
+    backend = None
+    if args.memory:
+        backend = main.init_memory_backend(args.snapshot)
+        if args.snapshot:
+            atexit.register(backend.save)
+    else:
+        main.init_database()
+    user_collection = main.init_user_collection(id_filter=args.id_filter, backend=backend)
+    status_collection = main.init_status_collection(id_filter=args.id_filter, backend=backend)
     menu_options = {
         'A': load_users,
         'B': load_status_updates,
@@ -2,19 +2,21 @@
 Implementation of database model.
 Authors: Kathleen Wong and Marcus Bakke
 '''
-# pylint: disable=R0903
+# pylint: disable=R0903,W0212,E1101
+import functools
+import hashlib
 import os
 import logging
+from collections import namedtuple
+from contextlib import contextmanager
 import peewee as pw
+from playhouse.pool import PooledSqliteDatabase
+from playhouse.sqlite_ext import FTS5Model, SearchField
 
 FILE = 'socialnetwork.db'
-if not os.path.exists(FILE):
-    logging.info('Creating database as %s', FILE)
-else:
-    logging.info('Loading database: %s', FILE)
-db = pw.SqliteDatabase(FILE)
-db.connect()
-db.execute_sql('PRAGMA foreign_keys = ON;')
+# Deferred until init_db is called, so importing this module is cheap.
+# Each thread gets its own connection from the pool, see init_db.
+db = PooledSqliteDatabase(None)
 
 class BaseModel(pw.Model):
     '''
@@ -35,6 +37,8 @@ class Users(BaseModel):
     user_name = pw.CharField(max_length=30)
     user_last_name = pw.CharField(max_length=100)
     user_email = pw.CharField()
+    # Hash of the other columns, see add_row_hash
+    row_hash = pw.CharField(null=True)
 
     class Meta:
         '''
@@ -44,12 +48,350 @@ class Users(BaseModel):
                        pw.Check('LENGTH(user_name) < 30'),
                        pw.Check('LENGTH(user_last_name) < 100')]
 
+    @classmethod
+    def create_table(cls, safe=True, **options):
+        '''
+        Create the table, adding row_hash to tables created without it
+        '''
+        super().create_table(safe=safe, **options)
+        add_row_hash(cls)
+
 class Status(BaseModel):
     '''
     Defines the Status
     '''
     status_id = pw.CharField(primary_key=True, unique=True)
-    user = pw.ForeignKeyField(Users, on_delete='CASCADE', to_field='user_id')
+    # Not indexed on its own: status_user_sequence_id below leads with user_id
+    user = pw.ForeignKeyField(Users, on_delete='CASCADE', to_field='user_id', index=False)
     status_text = pw.CharField()
+    # Hash of the other columns, see add_row_hash
+    row_hash = pw.CharField(null=True)
+
+    @classmethod
+    def create_table(cls, safe=True, **options):
+        '''
+        Create the table, adding row_hash to tables created without it and
+        dropping the indexes status_user_sequence_id replaced
+        '''
+        super().create_table(safe=safe, **options)
+        add_row_hash(cls)
+        for index in ['status_user_sequence', 'status_user_id']:
+            cls._meta.database.execute_sql(f'DROP INDEX IF EXISTS {index}')
+
+# Numeric suffix of status_id (e.g. 12 for dave03_00012). The same SQL text
+# must be used in queries for SQLite to pick the expression index below,
+# which ends in status_id to order statuses with equal suffixes.
+STATUS_SEQUENCE = pw.SQL("CAST(substr(status_id, instr(status_id, '_') + 1) AS INTEGER)")
+Status.add_index(pw.SQL('CREATE INDEX IF NOT EXISTS status_user_sequence_id '
+                        "ON status (user_id, CAST(substr(status_id, instr(status_id, '_') + 1) "
+                        'AS INTEGER), status_id)'))
+
+class StatusIndex(FTS5Model):
+    '''
+    Full-text index over Status.status_text
+
+    This is an external content FTS5 table keyed on the rowid of Status,
+    so the text itself is only stored once. Triggers on Status keep it in
+    sync on insert, update and delete (including ON DELETE CASCADE).
+    '''
+    status_text = SearchField()
+
+    class Meta:
+        '''
+        Use Status as the external content table
+        '''
+        database = db
+        table_name = 'status_index'
+        options = {'content': 'status', 'content_rowid': 'rowid'}
+
+    @classmethod
+    def create_table(cls, safe=True, **options):
+        '''
+        Create the index and its triggers, and index any existing statuses
+        '''
+        exists = cls.table_exists()
+        Status.create_table(safe=True)
+        super().create_table(safe=safe, **options)
+        database = cls._meta.database
+        for trigger in STATUS_INDEX_TRIGGERS:
+            database.execute_sql(trigger)
+        if not exists:
+            cls.rebuild()
+        logging.info('Status index initialized.')
+
+STATUS_INDEX_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS status_index_insert AFTER INSERT ON status BEGIN
+         INSERT INTO status_index (rowid, status_text) VALUES (new.rowid, new.status_text);
+       END;''',
+    '''CREATE TRIGGER IF NOT EXISTS status_index_delete AFTER DELETE ON status BEGIN
+         INSERT INTO status_index (status_index, rowid, status_text)
+         VALUES ('delete', old.rowid, old.status_text);
+       END;''',
+    '''CREATE TRIGGER IF NOT EXISTS status_index_update AFTER UPDATE OF status_text ON status BEGIN
+         INSERT INTO status_index (status_index, rowid, status_text)
+         VALUES ('delete', old.rowid, old.status_text);
+         INSERT INTO status_index (rowid, status_text) VALUES (new.rowid, new.status_text);
+       END;''']
+
+def hashed_columns(model):
+    '''
+    Returns the names of the columns covered by the row_hash of model
+    '''
+    return [field.column_name for field in model._meta.sorted_fields
+            if field is not model._meta.primary_key and field.name != 'row_hash']
+
+def content_hash(values):
+    '''
+    Returns the row_hash of a row with the given hashed column values
+    '''
+    text = '\x1f'.join(str(value) for value in values)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+def add_row_hash(model):
+    '''
+    Adds the row_hash column to a table created before it existed, and a
+    trigger resetting row_hash to NULL whenever a hashed column changes
+    without row_hash being set in the same statement. Writes which don't
+    know about hashes therefore never leave a stale one behind; NULL
+    hashes are recomputed from the row by the next sync.
+    '''
+    database = model._meta.database
+    table = model._meta.table_name
+    if 'row_hash' not in {column.name for column in database.get_columns(table)}:
+        logging.info('Adding row_hash to %s.', table)
+        database.execute_sql(f'ALTER TABLE {table} ADD COLUMN row_hash VARCHAR(255)')
+    database.execute_sql(
+        f'CREATE TRIGGER IF NOT EXISTS {table}_row_hash '
+        f'AFTER UPDATE OF {", ".join(hashed_columns(model))} ON {table} '
+        'WHEN new.row_hash IS old.row_hash BEGIN '
+        f'UPDATE {table} SET row_hash = NULL WHERE rowid = new.rowid; END;')
+
+class ImportProgress(BaseModel):
+    '''
+    Byte offset and line number reached by a checkpointed load of a file,
+    identified by its fingerprint, into a table
+    '''
+    fingerprint = pw.CharField()
+    table_name = pw.CharField()
+    filename = pw.CharField()
+    offset = pw.IntegerField()
+    line = pw.IntegerField()
+
+    class Meta:
+        '''
+        One row per file and table
+        '''
+        primary_key = pw.CompositeKey('fingerprint', 'table_name')
+
+MODELS = [Users, Status, StatusIndex, ImportProgress]
+
+# Named sets of SQLite pragmas trading durability for write speed.
+# durable:   WAL with a full fsync on every commit.
+# balanced:  WAL, fsync only at checkpoints (safe against app crashes,
+#            the last commits may be lost on power failure).
+# bulk-load: WAL with no fsync at all. The database survives the app
+#            crashing, but an OS crash or power failure during an import
+#            can corrupt the whole file, not just the import, so only use
+#            it on a database that is backed up or can be rebuilt.
+PROFILES = {
+    'durable':   {'journal_mode': 'wal', 'synchronous': 'full', 'cache_size': -16000,
+                  'mmap_size': 0, 'temp_store': 'default', 'busy_timeout': 5000},
+    'balanced':  {'journal_mode': 'wal', 'synchronous': 'normal', 'cache_size': -64000,
+                  'mmap_size': 268435456, 'temp_store': 'memory', 'busy_timeout': 5000},
+    'bulk-load': {'journal_mode': 'wal', 'synchronous': 'off', 'cache_size': -262144,
+                  'mmap_size': 1073741824, 'temp_store': 'memory', 'busy_timeout': 5000}}
+
+def profile_pragmas(profile):
+    '''
+    Returns the pragmas of the named profile
+    '''
+    if profile not in PROFILES:
+        raise ValueError(f'Unknown database profile: {profile}')
+    return PROFILES[profile]
 
-db.create_tables([Users, Status])
+@contextmanager
+def use_profile(profile, database=None):
+    '''
+    Context manager which switches the current connection to the named
+    profile and restores the previous settings afterwards.
+
+    Must be entered outside of a transaction, as SQLite ignores changes
+    to journal_mode and synchronous inside one.
+    '''
+    database = database or db
+    pragmas = profile_pragmas(profile)
+    previous = {name: database.pragma(name) for name in pragmas}
+    logging.info('Switching database to %s profile.', profile)
+    for name, value in pragmas.items():
+        database.pragma(name, value)
+    try:
+        yield database
+    finally:
+        for name, value in previous.items():
+            database.pragma(name, value)
+
+def init_db(path=FILE, profile='durable', **options):
+    '''
+    Opens the database at path (creating it if needed) and creates the
+    tables. path may also be ':memory:'.
+
+    profile names one of PROFILES, applied to every connection. options
+    are passed on to PooledSqliteDatabase, e.g. max_connections,
+    stale_timeout, timeout or extra pragmas. Foreign keys are always
+    enabled. The models are (re)bound to this database. Returns the
+    database.
+
+    Every thread that uses the models transparently checks out its own
+    pooled connection, so the collections can be shared by many worker
+    threads. Short-lived threads should wrap their work in
+    db.connection_context() so the connection goes back to the pool.
+    Note that each connection to ':memory:' is a separate database, so
+    in-memory databases should only be used from one thread.
+    '''
+    if path != ':memory:' and not os.path.exists(path):
+        logging.info('Creating database as %s', path)
+    else:
+        logging.info('Loading database: %s', path)
+    if not db.deferred:
+        db.close_all()
+    pragmas = dict(profile_pragmas(profile), **options.pop('pragmas', {}), foreign_keys=1)
+    # Pooled connections are handed to whichever thread asks next
+    options.setdefault('check_same_thread', False)
+    db.init(path, pragmas=pragmas, **options)
+    db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+    db.connect()
+    db.create_tables(MODELS)
+    return db
+
+def bound_database(model):
+    '''
+    Returns the database model is currently bound to (tests rebind the
+    models to an in-memory database)
+    '''
+    return model._meta.database
+
+# Maximum number of rows or ids sent in one INSERT or IN (...) statement
+BATCH_SIZE = 500
+
+def insert_rows(model, rows, results):
+    '''
+    Inserts (index, row) pairs with insert_many, setting results[index]
+    to True for each row inserted. Must be called inside a transaction.
+
+    If a batch fails (e.g. a CHECK constraint) its rows are retried one at
+    a time in savepoints so only the offending records are marked False.
+    '''
+    database = bound_database(model)
+    for batch in pw.chunked(rows, BATCH_SIZE):
+        try:
+            with database.atomic():
+                model.insert_many([row for _, row in batch]).execute()
+            for i, _ in batch:
+                results[i] = True
+        except pw.IntegrityError:
+            for i, row in batch:
+                try:
+                    with database.atomic():
+                        model.insert(row).execute()
+                    results[i] = True
+                except pw.IntegrityError:
+                    logging.error('Unable to add %s.', next(iter(row.values())))
+
+def update_rows(model, rows):
+    '''
+    Updates rows of model by primary key with a single executemany. rows
+    is a list of dicts of column name to value which all have the same
+    columns, including the primary key. Must be called inside a
+    transaction.
+    '''
+    if not rows:
+        return
+    primary_key = model._meta.primary_key.column_name
+    columns = [column for column in rows[0] if column != primary_key]
+    assignments = ', '.join(f'{column} = ?' for column in columns)
+    bound_database(model).cursor().executemany(
+        f'UPDATE {model._meta.table_name} SET {assignments} WHERE {primary_key} = ?',
+        [[row[column] for column in columns] + [row[primary_key]] for row in rows])
+
+def row_hashes(model):
+    '''
+    Returns two dicts of primary key to row_hash for every row of model:
+    all rows, and the subset whose row_hash was NULL and so had to be
+    computed from the row
+    '''
+    primary_key = model._meta.primary_key
+    hashes = dict(model.select(primary_key, model.row_hash)
+                  .where(model.row_hash.is_null(False)).tuples().iterator())
+    content = [model._meta.columns[column] for column in hashed_columns(model)]
+    missing = {row[0]: content_hash(row[1:])
+               for row in model.select(primary_key, *content)
+               .where(model.row_hash.is_null()).tuples().iterator()}
+    hashes.update(missing)
+    return hashes, missing
+
+@functools.lru_cache(maxsize=None)
+def record_type(model, fields):
+    '''
+    Returns the named tuple class of compact records of model holding
+    fields (a tuple of names)
+    '''
+    return namedtuple(f'{model.__name__}Record', fields)
+
+def model_field(model, name):
+    '''
+    Returns the field of model with the given field or column name
+    '''
+    field = model._meta.combined.get(name)
+    if field is None:
+        raise ValueError(f'Unknown field of {model.__name__}: {name}')
+    return field
+
+def select_fields(query, model, fields):
+    '''
+    Narrows a select query on model to the named fields, so each row is
+    returned as a compact record (see record_type) instead of a model
+    instance. Field or column names may be used, e.g. user_id for
+    Status.user.
+    '''
+    fields = tuple(fields)
+    selected = [model_field(model, name).alias(name) for name in fields]
+    return query.select(*selected).objects(record_type(model, fields))
+
+def as_record(instance, fields):
+    '''
+    Returns the compact record of a model instance holding fields, with
+    the same values select_fields would read (foreign keys as their id)
+    '''
+    fields = tuple(fields)
+    model = type(instance)
+    return record_type(model, fields)(*(instance.__data__.get(model_field(model, name).name)
+                                        for name in fields))
+
+def copy_instance(instance):
+    '''
+    Returns a new model instance holding the values of instance, so the
+    collection caches never hand two callers the same object
+    '''
+    copy = type(instance)(**instance.__data__)
+    copy._dirty.clear()
+    return copy
+
+def select_by_ids(model, ids, fields=None):
+    '''
+    Yields (primary key, row) for each row of model whose primary key is
+    in ids, reading BATCH_SIZE ids per IN query. Rows are model instances,
+    or compact records of fields if given.
+    '''
+    primary_key = model._meta.primary_key
+    if fields is None:
+        for batch in pw.chunked(ids, BATCH_SIZE):
+            for row in model.select().where(primary_key.in_(batch)):
+                yield row.__data__[primary_key.name], row
+        return
+    fields = tuple(fields)
+    record = record_type(model, fields)
+    selected = [model_field(model, name) for name in fields]
+    for batch in pw.chunked(ids, BATCH_SIZE):
+        query = model.select(primary_key, *selected).where(primary_key.in_(batch))
+        for row in query.tuples():
+            yield row[0], record(*row[1:])
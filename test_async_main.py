@@ -0,0 +1,125 @@
+'''
+Unittests for async_main.py.
+Author: Marcus Bakke
+'''
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import peewee as pw
+import async_main
+import main
+import socialnetwork_model as sm
+
+
+class TestAsyncMain(unittest.IsolatedAsyncioTestCase):
+    '''
+    Test class for async_main.py
+
+    Work runs on other threads, so this uses a file database rather than
+    an in-memory one (which would be separate per connection).
+    '''
+    async def asyncSetUp(self):
+        '''
+        Create a database file and load some data.
+        '''
+        self.directory = tempfile.mkdtemp()
+        await async_main.init_database(os.path.join(self.directory, 'async.db'))
+        self.user_collection = async_main.init_user_collection()
+        self.status_collection = async_main.init_status_collection()
+        await async_main.load_users(os.path.join('test_files', 'test_good_accounts.csv'),
+                                    self.user_collection)
+        await async_main.load_status_updates(os.path.join('test_files',
+                                                          'test_good_status_updates.csv'),
+                                             self.status_collection)
+
+    async def test_users(self):
+        '''
+        Test the user functions.
+        '''
+        self.assertTrue(await async_main.add_user('kwong', 'kwong@gmail.com', 'Kathleen',
+                                                  'Wong', self.user_collection))
+        user = await async_main.search_user('kwong', self.user_collection)
+        self.assertEqual(user.user_email, 'kwong@gmail.com')
+        self.assertTrue(await async_main.delete_user('kwong', self.user_collection))
+        self.assertIsNone(await async_main.search_user('kwong', self.user_collection))
+
+    async def test_streams(self):
+        '''
+        Test searches are streamed as async iterators.
+        '''
+        statuses = [status.status_id async for status in
+                    async_main.search_all_status_updates('evmiles97', self.status_collection)]
+        self.assertEqual(statuses, ['evmiles97_00001', 'evmiles97_00002'])
+        statuses = [status.status_id async for status in
+                    async_main.filter_status_by_string('missing', self.status_collection)]
+        self.assertEqual(statuses, [])
+        async_main.STREAM_BATCH = 1
+        try:
+            async for status in async_main.filter_status_by_string('i',
+                                                                   self.status_collection):
+                self.assertTrue(status.status_id)
+                break
+        finally:
+            async_main.STREAM_BATCH = 100
+
+    async def test_configure(self):
+        '''
+        Test configure replaces the thread pool.
+        '''
+        async_main.configure(max_workers=2, max_streams=1)
+        status = await async_main.search_status('dave03_00001', self.status_collection)
+        self.assertEqual(status.status_text, 'Sunny in Seattle this morning')
+        statuses = [status async for status in
+                    async_main.search_status_by_phrase('seattle', self.status_collection)]
+        self.assertEqual(len(statuses), 1)
+        async_main.configure()
+
+    async def asyncTearDown(self):
+        '''
+        Close every pooled connection and remove the database.
+        '''
+        sm.db.close_all()
+        shutil.rmtree(self.directory)
+
+
+class TestAsyncMemory(unittest.IsolatedAsyncioTestCase):
+    '''
+    Test async_main.py with collections on a MemoryBackend, which must
+    not need the database at all
+    '''
+    async def asyncSetUp(self):
+        '''
+        Swap in an uninitialized database and load some data.
+        '''
+        patcher = mock.patch.object(sm, 'db', pw.SqliteDatabase(None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        backend = main.init_memory_backend()
+        self.user_collection = async_main.init_user_collection(backend=backend)
+        self.status_collection = async_main.init_status_collection(backend=backend)
+        await async_main.load_users(os.path.join('test_files', 'test_good_accounts.csv'),
+                                    self.user_collection)
+        await async_main.load_status_updates(os.path.join('test_files',
+                                                          'test_good_status_updates.csv'),
+                                             self.status_collection)
+
+    async def test_memory(self):
+        '''
+        Test blocking calls and streams.
+        '''
+        self.assertTrue(await async_main.add_user('kwong', 'kwong@gmail.com', 'Kathleen',
+                                                  'Wong', self.user_collection))
+        user = await async_main.search_user('kwong', self.user_collection)
+        self.assertEqual(user.user_email, 'kwong@gmail.com')
+        statuses = [status.status_id async for status in
+                    async_main.search_all_status_updates('evmiles97', self.status_collection)]
+        self.assertEqual(statuses, ['evmiles97_00001', 'evmiles97_00002'])
+        statuses = [status async for status in
+                    async_main.search_status_by_phrase('seattle', self.status_collection)]
+        self.assertEqual(len(statuses), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
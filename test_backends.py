@@ -0,0 +1,325 @@
+'''
+Unittests for backends.py.
+Author: Marcus Bakke
+'''
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import peewee as pw
+import main
+import backends
+import socialnetwork_model as sm
+
+MODELS = [sm.Users, sm.Status, sm.StatusIndex, sm.ImportProgress]
+USER_COLUMNS = [sm.Users.user_id, sm.Users.user_email, sm.Users.user_name,
+                sm.Users.user_last_name, sm.Users.row_hash]
+test_db = pw.SqliteDatabase(':memory:')
+
+
+class TestMemoryBackend(unittest.TestCase):
+    '''
+    Test class for backends.MemoryBackend, used through main.py
+    '''
+    def setUp(self):
+        '''
+        Create collections sharing one memory backend.
+        '''
+        self.directory = tempfile.mkdtemp()
+        self.backend = main.init_memory_backend()
+        self.user_collection = main.init_user_collection(backend=self.backend)
+        self.status_collection = main.init_status_collection(backend=self.backend)
+        main.load_users(os.path.join('test_files', 'test_good_accounts.csv'),
+                        self.user_collection)
+        main.load_status_updates(os.path.join('test_files', 'test_good_status_updates.csv'),
+                                 self.status_collection)
+
+    def tearDown(self):
+        '''
+        Remove the scratch directory.
+        '''
+        shutil.rmtree(self.directory)
+
+    def test_users(self):
+        '''
+        Test adding, modifying, searching and deleting users.
+        '''
+        self.assertEqual(self.backend.count(sm.Users), 2)
+        self.assertTrue(main.add_user('kwong', 'kwong@gmail.com', 'Kathleen', 'Wong',
+                                      self.user_collection))
+        self.assertFalse(main.add_user('kwong', 'kwong@gmail.com', 'Kathleen', 'Wong',
+                                       self.user_collection))
+        self.assertFalse(self.user_collection.add_user('k' * 30, 'k@gmail.com', 'K', 'W'))
+        self.assertTrue(main.update_user('kwong', 'kw@uw.edu', 'Kat', 'Wong',
+                                         self.user_collection))
+        self.assertFalse(main.update_user('nobody', 'kw@uw.edu', 'Kat', 'Wong',
+                                          self.user_collection))
+        user = main.search_user('kwong', self.user_collection)
+        self.assertIsInstance(user, sm.Users)
+        self.assertEqual((user.user_email, user.user_name), ('kw@uw.edu', 'Kat'))
+        self.assertEqual(main.search_user('kwong', self.user_collection, ['user_name']),
+                         ('Kat',))
+        self.assertEqual(set(main.search_users_many(['kwong', 'nobody'], self.user_collection)
+                             .items()), {('kwong', user), ('nobody', None)})
+        self.assertEqual(main.add_users([('mbak79', 'mb@uw.edu', 'Marcus', 'Bakke'),
+                                         ('kwong', 'kw@uw.edu', 'Kat', 'Wong')],
+                                        self.user_collection), [True, False])
+        self.assertTrue(main.delete_user('dave03', self.user_collection))
+        self.assertFalse(main.delete_user('dave03', self.user_collection))
+        # dave03's status went with them
+        self.assertIsNone(main.search_status('dave03_00001', self.status_collection))
+        self.assertEqual(self.backend.count(sm.Status), 2)
+
+    def test_statuses(self):
+        '''
+        Test status writes and each kind of search.
+        '''
+        self.assertFalse(main.add_status('nobody', 'nobody_00001', 'Who am I?',
+                                         self.status_collection))
+        self.assertTrue(main.add_status('dave03', 'dave03_00010', 'A beautiful day today',
+                                        self.status_collection))
+        self.assertTrue(main.update_status('dave03_00001', 'dave03', 'Rain in Seattle',
+                                           self.status_collection))
+        status = main.search_status('dave03_00001', self.status_collection)
+        self.assertEqual((status.user_id, status.status_text), ('dave03', 'Rain in Seattle'))
+        found = main.search_all_status_updates('evmiles97', self.status_collection,
+                                               ['status_id'])
+        self.assertEqual(found.count(), 2)
+        self.assertEqual([row.status_id for row in found],
+                         ['evmiles97_00001', 'evmiles97_00002'])
+        self.assertIsNone(main.search_all_status_updates('nobody', self.status_collection))
+        self.assertEqual([row.status_id for row in main.filter_status_by_string(
+            'SEATTLE', self.status_collection, ['status_id'])], ['dave03_00001'])
+        self.assertEqual([row.status_id for row in main.search_status_by_phrase(
+            'beautiful day', self.status_collection, ['status_id'])], ['dave03_00010'])
+        self.assertIsNone(main.search_status_by_phrase('day beautiful', self.status_collection))
+        latest = main.latest_statuses('dave03', 1, self.status_collection)
+        self.assertEqual([row.status_id for row in latest], ['dave03_00010'])
+        latest = main.latest_statuses('dave03', 5, self.status_collection, before='dave03_00010')
+        self.assertEqual([row.status_id for row in latest], ['dave03_00001'])
+        self.assertTrue(main.add_status('dave03', 'dave03_1', 'Tie', self.status_collection))
+        latest = main.latest_statuses('dave03', 1, self.status_collection, before='dave03_1')
+        self.assertEqual([row.status_id for row in latest], ['dave03_00001'])
+        self.assertTrue(main.delete_status('dave03_00010', self.status_collection))
+        self.assertEqual(main.delete_statuses(['dave03_00010', 'dave03_00001'],
+                                              self.status_collection), [False, True])
+        self.assertTrue(main.delete_status('dave03_1', self.status_collection))
+
+    def test_load_rollback(self):
+        '''
+        Test a failed load leaves the rows as they were.
+        '''
+        bad = os.path.join('test_files', 'test_bad_status_updates.csv')
+        main.delete_statuses(['dave03_00001'], self.status_collection)
+        self.assertFalse(main.load_status_updates(bad, self.status_collection, chunk_size=1,
+                                                  conflict='ignore'))
+        self.assertEqual(self.backend.count(sm.Status), 2)
+        self.assertIsNone(main.search_status('dave03_00001', self.status_collection))
+        good = os.path.join('test_files', 'test_good_status_updates.csv')
+        result = main.load_status_updates(good, self.status_collection, conflict='replace')
+        self.assertEqual((result.inserted, result.replaced), (1, 2))
+        self.assertRaises(ValueError, main.load_status_updates, good, self.status_collection,
+                          checkpoint=True)
+
+    def test_sync(self):
+        '''
+        Test sync_users applies only the changes.
+        '''
+        accounts = os.path.join('test_files', 'test_overlap_accounts.csv')
+        result = main.sync_users(accounts, self.user_collection)
+        self.assertEqual((result.inserted, result.updated, result.deleted,
+                          result.unchanged), (1, 1, 1, 0))
+        self.assertEqual(self.backend.count(sm.Status), 1)
+        result = main.sync_users(accounts, self.user_collection)
+        self.assertEqual((result.inserted, result.updated, result.deleted,
+                          result.unchanged), (0, 0, 0, 2))
+
+    def test_snapshot(self):
+        '''
+        Test save and load of snapshots, and save_users from memory.
+        '''
+        snapshot = os.path.join(self.directory, 'snapshot.json.gz')
+        self.assertRaises(ValueError, self.backend.save)
+        self.assertEqual(self.backend.save(snapshot), snapshot)
+        restored = main.init_memory_backend(snapshot)
+        statuses = main.init_status_collection(backend=restored, id_filter=True)
+        self.assertEqual(restored.count(sm.Users), 2)
+        self.assertEqual(main.search_all_status_updates('evmiles97', statuses).count(), 2)
+        self.assertIsNone(statuses.search_status('evmiles97_00003'))
+        accounts = os.path.join(self.directory, 'accounts.csv')
+        self.assertTrue(main.save_users(accounts, self.user_collection))
+        with open(accounts, encoding='utf-8') as file:
+            self.assertEqual(len(file.readlines()), 3)
+
+    def test_transaction(self):
+        '''
+        Test nested transactions roll back to where they began.
+        '''
+        with self.backend.atomic(sm.Users) as outer:
+            self.backend.insert(sm.Users, {'user_id': 'kwong', 'user_email': 'k@uw.edu',
+                                           'user_name': 'Kathleen', 'user_last_name': 'Wong'})
+            with self.assertRaises(ZeroDivisionError):
+                with self.backend.atomic(sm.Users):
+                    self.backend.delete(sm.Users, ['dave03'])
+                    raise ZeroDivisionError
+            self.assertEqual(self.backend.count(sm.Status), 3)
+            outer.rollback()
+        self.assertIsNone(self.backend.get(sm.Users, 'kwong'))
+        self.assertEqual(backends.status_sequence('dave03_00012'), 12)
+        self.assertEqual(backends.status_sequence('dave03'), 0)
+
+    def test_primary_key_filter(self):
+        '''
+        Test ids added to the registry while the filter is filled are kept.
+        '''
+        registry = set()
+        scan = self.backend.rows
+
+        def rows(model, fields):
+            for row in scan(model, fields):
+                for id_filter in registry:
+                    id_filter.add('kwong')
+                yield row
+
+        with mock.patch.object(self.backend, 'rows', rows):
+            id_filter = self.backend.primary_key_filter(sm.Users, registry)
+        self.assertEqual(registry, {id_filter})
+        self.assertIn('dave03', id_filter)
+        self.assertIn('kwong', id_filter)
+
+
+class TestLoadParity(unittest.TestCase):
+    '''
+    Test the database and memory backends give the same load results
+    '''
+    def setUp(self):
+        '''
+        Bind the models to the test database.
+        '''
+        self.overlap = os.path.join('test_files', 'test_overlap_accounts.csv')
+        self.invalid = os.path.join('test_files', 'test_invalid_accounts.csv')
+        test_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+        test_db.connect()
+        test_db.create_tables(MODELS)
+        test_db.execute_sql('PRAGMA foreign_keys = ON;')
+
+    def tearDown(self):
+        '''
+        Drop the tables.
+        '''
+        test_db.drop_tables(MODELS)
+        test_db.close()
+
+    def load_all(self, backend):
+        '''
+        Runs every load of the test through backend and returns the
+        results and the users left afterwards
+        '''
+        user_collection = main.init_user_collection(backend=backend)
+        good = os.path.join('test_files', 'test_good_accounts.csv')
+        results = []
+        for filename, conflict in [(good, 'fail'), (self.overlap, 'fail'),
+                                   (self.invalid, 'fail'), (self.invalid, 'ignore'),
+                                   (self.invalid, 'replace'), (self.overlap, 'ignore'),
+                                   (self.overlap, 'replace')]:
+            result = main.load_users(filename, user_collection, conflict=conflict)
+            results.append((bool(result), result.inserted, result.skipped, result.replaced))
+        users = sorted(backend.rows(sm.Users, USER_COLUMNS))
+        return results, users
+
+    def test_load(self):
+        '''
+        Test each conflict policy, including rows breaking a CHECK.
+        '''
+        results, users = self.load_all(backends.PeeweeBackend())
+        self.assertEqual(results, [(True, 2, 0, 0), (False, 0, 0, 0), (False, 0, 0, 0),
+                                   (False, 0, 0, 0), (False, 0, 0, 0), (True, 1, 1, 0),
+                                   (True, 0, 0, 2)])
+        self.assertEqual((results, users), self.load_all(backends.MemoryBackend()))
+
+    def test_replace_row_hash(self):
+        '''
+        Test a replacing insert stores the row_hash it is given.
+        '''
+        row = {'user_id': 'dave03', 'user_email': 'dave@uw.edu', 'user_name': 'Dave',
+               'user_last_name': 'Yuen'}
+        for backend in [backends.PeeweeBackend(), backends.MemoryBackend()]:
+            backend.insert_many(sm.Users, [row])
+            backend.insert_many(sm.Users, [dict(row, user_name='David', row_hash='a1')],
+                                'replace')
+            self.assertEqual(backend.get(sm.Users, 'dave03').row_hash, 'a1')
+            backend.insert_many(sm.Users, [dict(row, user_name='Dave')], 'replace')
+            self.assertIsNone(backend.get(sm.Users, 'dave03').row_hash)
+
+
+class TestSqliteBackend(unittest.TestCase):
+    '''
+    Test class for backends.SqliteBackend
+    '''
+    def setUp(self):
+        '''
+        Bind model classes to test database. Create collections using the
+        prepared statement path.
+        '''
+        test_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+        test_db.connect()
+        test_db.create_tables(MODELS)
+        test_db.execute_sql('PRAGMA foreign_keys = ON;')
+        self.backend = backends.SqliteBackend()
+        self.user_collection = main.init_user_collection(backend=self.backend)
+        self.status_collection = main.init_status_collection(backend=self.backend)
+        main.load_users(os.path.join('test_files', 'test_good_accounts.csv'),
+                        self.user_collection)
+
+    def tearDown(self):
+        '''
+        Drop the tables and close the test database.
+        '''
+        test_db.drop_tables(MODELS)
+        test_db.close()
+
+    def test_point_queries(self):
+        '''
+        Test lookups, inserts and deletes return what the ORM path does.
+        '''
+        orm = backends.PeeweeBackend()
+        self.assertTrue(main.add_status('dave03', 'dave03_00001', 'Sunny in Seattle',
+                                        self.status_collection))
+        self.assertFalse(main.add_status('dave03', 'dave03_00001', 'Sunny in Seattle',
+                                         self.status_collection))
+        self.assertFalse(main.add_status('nobody', 'nobody_00001', 'Who am I?',
+                                         self.status_collection))
+        for model, key in [(sm.Users, 'dave03'), (sm.Status, 'dave03_00001')]:
+            fast = self.backend.get(model, key)
+            slow = orm.get(model, key)
+            self.assertIsInstance(fast, model)
+            self.assertEqual(fast.__data__, slow.__data__)
+            self.assertFalse(fast.is_dirty())
+        self.assertEqual(self.backend.get(sm.Status, 'dave03_00001', ['user_id', 'status_text']),
+                         orm.get(sm.Status, 'dave03_00001', ['user_id', 'status_text']))
+        self.assertIsNone(self.backend.get(sm.Users, 'nobody'))
+        status = main.search_status('dave03_00001', self.status_collection)
+        self.assertEqual(status.user.user_name, 'David')
+        # Statuses found in the full-text index were added by the trigger
+        self.assertTrue(main.search_status_by_phrase('sunny', self.status_collection))
+        self.assertTrue(main.delete_user('dave03', self.user_collection))
+        self.assertFalse(main.delete_user('dave03', self.user_collection))
+        self.assertIsNone(main.search_status('dave03_00001', self.status_collection))
+
+    def test_transaction(self):
+        '''
+        Test prepared statements take part in peewee transactions.
+        '''
+        with test_db.atomic() as transaction:
+            self.backend.insert(sm.Users, {'user_id': 'kwong', 'user_email': 'k@uw.edu',
+                                           'user_name': 'Kathleen', 'user_last_name': 'Wong'})
+            self.assertEqual(self.backend.delete(sm.Users, ['evmiles97']), 1)
+            transaction.rollback()
+        self.assertIsNone(self.backend.get(sm.Users, 'kwong'))
+        self.assertIsNotNone(self.backend.get(sm.Users, 'evmiles97'))
+        self.assertEqual(self.backend.delete(sm.Users, ['evmiles97', 'dave03', 'nobody']), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
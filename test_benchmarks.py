@@ -0,0 +1,102 @@
+'''
+Unittests for the benchmarks package.
+Author: Marcus Bakke
+'''
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+import main
+from benchmarks import concurrency, generate, run
+
+
+class TestBenchmarks(unittest.TestCase):
+    '''
+    Test class for benchmarks
+    '''
+    def setUp(self):
+        '''
+        Create a scratch directory.
+        '''
+        self.directory = tempfile.mkdtemp()
+
+    def test_parse_scale(self):
+        '''
+        Test parse_scale.
+        '''
+        self.assertEqual(generate.parse_scale('10k'), 10000)
+        self.assertEqual(generate.parse_scale('1M'), 1000000)
+        self.assertEqual(generate.parse_scale('2.5k'), 2500)
+        self.assertEqual(generate.parse_scale(300), 300)
+
+    def test_generate(self):
+        '''
+        Test generated rows pass the loaders' validation.
+        '''
+        users_file, statuses_file, ids = generate.generate(self.directory, 250)
+        self.assertEqual(len(ids), 2)
+        self.assertEqual(len(set(generate.user_ids(1000))), 1000)
+        keys = {'USER_ID': {'validate': main.validate_user_id, 'key': 'user_id'},
+                'NAME': {'validate': main.validate_name, 'key': 'user_name'},
+                'LASTNAME': {'validate': main.validate_name, 'key': 'user_last_name'},
+                'EMAIL': {'validate': main.validate_email, 'key': 'user_email'}}
+        for filename, validate_keys, rows in [
+                (users_file, keys, 2),
+                (statuses_file, {'STATUS_ID': {'validate': main.validate_status_id,
+                                               'key': 'status_id'},
+                                 'USER_ID': keys['USER_ID'],
+                                 'STATUS_TEXT': {'validate': main.validate_status_text,
+                                                 'key': 'status_text'}}, 250)]:
+            with main.open_csv(filename, 'r') as file:
+                reader = csv.DictReader(file)
+                for chunk in main.read_chunks(reader, 1000):
+                    valid, error = main.validate_chunk(chunk, validate_keys, filename)
+                    self.assertIsNone(error)
+                    self.assertEqual(len(valid), rows)
+
+    def test_run(self):
+        '''
+        Test a tiny benchmark run reports every operation.
+        '''
+        results = run.run('300', self.directory)
+        self.assertEqual(results['scale'], 300)
+        self.assertEqual(set(results['results']),
+                         {'load_users', 'load_status_updates', 'search_user', 'search_status',
+                          'add_status', 'delete_status', 'search_all_status_updates',
+                          'filter_status_by_string', 'search_status_by_phrase',
+                          'delete_user_cascade'})
+        output = os.path.join(self.directory, 'results.jsonl')
+        run.write_results(results, output)
+        run.write_results(results, output)
+        with open(output, encoding='utf-8') as file:
+            self.assertEqual(len(file.readlines()), 2)
+
+    def test_run_memory(self):
+        '''
+        Test a tiny benchmark run against the other backends.
+        '''
+        for backend in ['memory', 'sqlite-raw']:
+            results = run.run('300', self.directory, backend=backend)
+            self.assertEqual(results['backend'], backend)
+            self.assertEqual(len(results['results']), 10)
+        self.assertRaises(ValueError, run.run, '300', self.directory, backend='redis')
+
+    def test_run_reads(self):
+        '''
+        Test the concurrent read benchmark reports each thread count.
+        '''
+        results = concurrency.run_reads(self.directory, [1, 2])
+        self.assertEqual(set(results['results']), {'concurrent_reads_1', 'concurrent_reads_2'})
+        self.assertEqual(results['results']['concurrent_reads_2']['operations'],
+                         2 * concurrency.READS_PER_THREAD)
+
+    def tearDown(self):
+        '''
+        Remove the scratch directory.
+        '''
+        shutil.rmtree(self.directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
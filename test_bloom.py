@@ -0,0 +1,52 @@
+'''
+Unittests for bloom.py.
+Author: Marcus Bakke
+'''
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from bloom import BloomFilter
+
+
+class TestBloomFilter(unittest.TestCase):
+    '''
+    Test class for bloom.py
+    '''
+    def test_membership(self):
+        '''
+        Test added keys are always found and few others are.
+        '''
+        bloom = BloomFilter(10000, error_rate=0.01)
+        keys = [f'user{i}' for i in range(10000)]
+        bloom.update(keys)
+        self.assertTrue(all(key in bloom for key in keys))
+        self.assertEqual(len(bloom), 10000)
+        false_positives = sum(f'other{i}' in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_add(self):
+        '''
+        Test a single add and an empty filter.
+        '''
+        bloom = BloomFilter(0)
+        self.assertNotIn('dave03', bloom)
+        bloom.add('dave03')
+        self.assertIn('dave03', bloom)
+        self.assertGreaterEqual(bloom.size, 64)
+
+    def test_threads(self):
+        '''
+        Test no key is lost when many threads add at once.
+        '''
+        bloom = BloomFilter(1000)
+
+        def worker(offset):
+            for i in range(250):
+                bloom.add(f'status{offset}_{i}')
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            list(pool.map(worker, range(4)))
+        self.assertTrue(all(f'status{offset}_{i}' in bloom
+                            for offset in range(4) for i in range(250)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+'''
+Unittests for cache.py.
+Author: Marcus Bakke
+'''
+import time
+import unittest
+from cache import LRUCache
+
+
+class TestLRUCache(unittest.TestCase):
+    '''
+    Test class for cache.py
+    '''
+    def test_get_put(self):
+        '''
+        Test get and put with hit and miss counters.
+        '''
+        cache = LRUCache(2)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats(), {'size': 1, 'maxsize': 2, 'hits': 1, 'misses': 1})
+
+    def test_eviction(self):
+        '''
+        Test the least recently used entry is evicted.
+        '''
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl(self):
+        '''
+        Test entries expire after ttl seconds.
+        '''
+        cache = LRUCache(2, ttl=0.01)
+        cache.put('a', 1)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_discard(self):
+        '''
+        Test discard, discard_if and clear.
+        '''
+        cache = LRUCache(5)
+        for key, value in [('a', 1), ('b', 2), ('c', 3)]:
+            cache.put(key, value)
+        cache.discard('a')
+        cache.discard('missing')
+        cache.discard_if(lambda value: value > 2)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.get('b'), 2)
+        cache.clear()
+        self.assertEqual(cache.stats(), {'size': 0, 'maxsize': 5, 'hits': 0, 'misses': 0})
+
+    def test_generation(self):
+        '''
+        Test put drops a value read before an entry was removed.
+        '''
+        cache = LRUCache(5)
+        generation = cache.generation
+        cache.put('a', 1, generation)
+        self.assertEqual(cache.get('a'), 1)
+        cache.discard('b')
+        cache.put('b', 'stale', generation)
+        self.assertIsNone(cache.get('b'))
+        cache.put('b', 2, cache.generation)
+        self.assertEqual(cache.get('b'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+'''
+Concurrency stress test for the pooled database connections.
+
+The read throughput itself is measured by python -m benchmarks --threads.
+Author: Marcus Bakke
+'''
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import main
+import socialnetwork_model as sm
+from benchmarks.concurrency import read_throughput
+
+USERS = 200
+THREAD_COUNTS = [1, 2, 4, 8]
+
+
+class TestConcurrentReads(unittest.TestCase):
+    '''
+    Test many threads sharing one UserCollection
+    '''
+    def setUp(self):
+        '''
+        Create a file database (WAL needs a real file) with some users.
+        '''
+        self.directory = tempfile.mkdtemp()
+        main.init_database(os.path.join(self.directory, 'stress.db'), profile='balanced')
+        self.user_collection = main.init_user_collection()
+        main.add_users([(f'user{i}', f'user{i}@uw.edu', 'Stress', 'Test')
+                        for i in range(USERS)], self.user_collection)
+
+    def test_concurrent_reads(self):
+        '''
+        Every read from every thread finds the right user.
+        '''
+        for threads in THREAD_COUNTS:
+            _, failures = read_throughput(self.user_collection, threads, USERS)
+            self.assertEqual(failures, 0)
+
+    def test_buffered_writer(self):
+        '''
+        Statuses added from many threads are group committed, and the
+        background thread flushes a lone status after max_delay.
+        '''
+        status_collection = main.init_status_collection()
+        futures = []
+        with main.open_status_writer(status_collection, max_size=50,
+                                     max_delay=0.05) as writer:
+            lone = main.add_status_buffered('user0', 'user0_99999', 'Anyone there?', writer)
+            self.assertTrue(lone.result(timeout=5))
+
+            def worker(offset):
+                with sm.db.connection_context():
+                    for i in range(100):
+                        futures.append(main.add_status_buffered(
+                            f'user{offset}', f'user{offset}_{i + 1:05}', 'Buffered', writer))
+            workers = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            futures.append(main.add_status_buffered('nobody', 'nobody_00001', 'Who?', writer))
+        self.assertEqual([future.result() for future in futures], [True] * 400 + [False])
+        self.assertEqual(len(list(status_collection.database)), 401)
+
+    def tearDown(self):
+        '''
+        Close every pooled connection and remove the database.
+        '''
+        sm.db.close_all()
+        shutil.rmtree(self.directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
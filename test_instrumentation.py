@@ -0,0 +1,127 @@
+'''
+Unittests for instrumentation.py.
+Author: Marcus Bakke
+'''
+import json
+import logging
+import unittest
+import peewee as pw
+import backends
+import instrumentation
+import main
+import socialnetwork_model as sm
+
+MODELS = [sm.Users, sm.Status, sm.StatusIndex]
+test_db = pw.SqliteDatabase(':memory:')
+
+
+class TestInstrumentation(unittest.TestCase):
+    '''
+    Test class for instrumentation.py
+    '''
+    def setUp(self):
+        '''
+        Bind model classes to test database and reset the counters.
+        '''
+        test_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+        test_db.connect()
+        test_db.create_tables(MODELS)
+        test_db.execute_sql('PRAGMA foreign_keys = ON;')
+        self.user_collection = main.init_user_collection()
+        instrumentation.reset()
+
+    def test_disabled(self):
+        '''
+        Test nothing is recorded while disabled.
+        '''
+        self.assertFalse(instrumentation.is_enabled())
+        main.add_user('dave03', 'dave@gmail.com', 'Dave', 'Yuen', self.user_collection)
+        self.assertEqual(instrumentation.snapshot(), {})
+
+    def test_enabled(self):
+        '''
+        Test calls, rows and queries are recorded per operation.
+        '''
+        instrumentation.enable()
+        instrumentation.enable()
+        try:
+            main.add_user('dave03', 'dave@gmail.com', 'Dave', 'Yuen', self.user_collection)
+            main.search_user('dave03', self.user_collection)
+            main.search_user('fail', self.user_collection)
+            main.search_users_many(['dave03', 'fail'], self.user_collection)
+            main.delete_users(['dave03'], self.user_collection)
+        finally:
+            instrumentation.disable()
+            instrumentation.disable()
+        stats = instrumentation.snapshot()
+        self.assertEqual(stats['main.search_user']['calls'], 2)
+        self.assertEqual(stats['main.search_user']['rows'], 1)
+        self.assertEqual(stats['main.search_users_many']['rows'], 1)
+        self.assertEqual(stats['main.search_user']['queries'], 2)
+        self.assertEqual(stats['users.UserCollection.search_user']['queries'], 2)
+        self.assertEqual(stats['main.delete_users']['rows'], 1)
+        self.assertEqual(sum(stats['main.add_user']['histogram'].values()), 1)
+        self.assertEqual(json.loads(instrumentation.dump()), stats)
+        self.assertFalse(logging.getLogger('peewee').isEnabledFor(logging.DEBUG))
+
+    def test_raw_queries(self):
+        '''
+        Test statements SqliteBackend runs without peewee are counted.
+        '''
+        user_collection = main.init_user_collection(backend=backends.SqliteBackend())
+        instrumentation.enable()
+        try:
+            main.add_user('dave03', 'dave@gmail.com', 'Dave', 'Yuen', user_collection)
+            main.search_user('dave03', user_collection)
+            main.delete_user('dave03', user_collection)
+        finally:
+            instrumentation.disable()
+        stats = instrumentation.snapshot()
+        self.assertEqual(stats['main.add_user']['queries'], 1)
+        self.assertEqual(stats['main.search_user']['queries'], 1)
+        self.assertEqual(stats['main.delete_user']['queries'], 1)
+
+    def test_errors(self):
+        '''
+        Test exceptions are counted as errors and re-raised.
+        '''
+        @instrumentation.instrumented
+        def fail():
+            raise ValueError('fail')
+        instrumentation.enable()
+        try:
+            self.assertRaises(ValueError, fail)
+        finally:
+            instrumentation.disable()
+        stats = instrumentation.snapshot()
+        name = [name for name in stats if name.endswith('fail')][0]
+        self.assertEqual(stats[name]['errors'], 1)
+
+    def test_prometheus_text(self):
+        '''
+        Test the Prometheus exporter.
+        '''
+        instrumentation.enable()
+        try:
+            main.search_user('fail', self.user_collection)
+        finally:
+            instrumentation.disable()
+        text = instrumentation.prometheus_text()
+        self.assertIn('# TYPE socialnetwork_operation_seconds histogram', text)
+        self.assertIn('socialnetwork_operation_seconds_bucket{operation="main.search_user",'
+                      'le="+Inf"} 1', text)
+        self.assertIn('socialnetwork_operation_queries_total{operation="main.search_user"} 1',
+                      text)
+        self.assertIn('socialnetwork_operation_seconds_count{operation="main.search_user"} 1',
+                      text)
+
+    def tearDown(self):
+        '''
+        Remove all tables at end of each test and close db.
+        '''
+        test_db.drop_tables(MODELS)
+        test_db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
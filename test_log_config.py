@@ -0,0 +1,85 @@
+'''
+Unittests for log_config.py.
+Author: Marcus Bakke
+'''
+import logging
+import os
+import tempfile
+import threading
+import unittest
+import log_config
+import users
+
+
+class TestLogConfig(unittest.TestCase):
+    '''
+    Test class for log_config.py
+    '''
+    def setUp(self):
+        self.level = logging.getLogger().level
+        self.tmp = tempfile.TemporaryDirectory()  # pylint: disable=R1732
+        self.log_file = os.path.join(self.tmp.name, 'test.log')
+
+    def tearDown(self):
+        logging.getLogger().setLevel(self.level)
+        self.tmp.cleanup()
+
+    def read_log(self):
+        '''
+        Returns the contents of the log file
+        '''
+        with open(self.log_file, encoding='utf-8') as file:
+            return file.read()
+
+    def test_queue_listener(self):
+        '''
+        Test records are written to the file by the listener thread.
+        '''
+        listener = log_config.setup_logging(self.log_file)
+        threads = []
+        file_handler = listener.handlers[0]
+        emit = file_handler.emit
+
+        def record_thread(record):
+            threads.append(threading.current_thread())
+            emit(record)
+        file_handler.emit = record_thread
+        try:
+            logging.info('Session launched.')
+        finally:
+            log_config.stop_logging(listener)
+        self.assertIn('INFO Session launched.', self.read_log())
+        self.assertEqual(len(threads), 1)
+        self.assertNotIn(threading.current_thread(), threads)
+        self.assertFalse(any(isinstance(handler, logging.handlers.QueueHandler)
+                             for handler in logging.getLogger().handlers))
+
+    def test_row_logging(self):
+        '''
+        Test per-record messages are only written with row logging on.
+        '''
+        listener = log_config.setup_logging(self.log_file)
+        try:
+            logging.log(log_config.ROW, 'Added user %s', 'quiet')
+            log_config.set_row_logging(True)
+            logging.log(log_config.ROW, 'Added user %s', 'loud')
+            log_config.set_row_logging(False)
+            logging.log(log_config.ROW, 'Added user %s', 'quiet again')
+        finally:
+            log_config.stop_logging(listener)
+        log = self.read_log()
+        self.assertIn('ROW Added user loud', log)
+        self.assertNotIn('quiet', log)
+
+    def test_collection_rows(self):
+        '''
+        Test the collection classes log per-record messages at ROW.
+        '''
+        self.assertEqual(logging.getLevelName(log_config.ROW), 'ROW')
+        self.assertIs(users.ROW, log_config.ROW)
+        self.assertLess(log_config.ROW, logging.INFO)
+        self.assertGreater(log_config.ROW, logging.DEBUG)
+
+
+if __name__ == '__main__':
+    unittest.main()
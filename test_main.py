@@ -6,13 +6,16 @@ Authors: Kathleen Wong and Marcus Bakke
 # pylint: disable=R0904
 import unittest
 import os
+import shutil
+import tempfile
+from unittest import mock
 import peewee as pw
 import users
 import user_status
 import main
 import socialnetwork_model as sm
 
-MODELS = [sm.Users, sm.Status]
+MODELS = [sm.Users, sm.Status, sm.StatusIndex, sm.ImportProgress]
 test_db = pw.SqliteDatabase(':memory:')
 
 
@@ -31,6 +34,28 @@ class TestMain(unittest.TestCase):
         self.user_collection = users.UserCollection()
         self.status_collection = user_status.UserStatusCollection()
 
+    def test_init_database(self):
+        '''
+        Test init_database opens a database and creates the tables
+        Author: Marcus Bakke
+        '''
+        database = main.init_database(':memory:')
+        self.assertIs(database, sm.db)
+        self.assertIs(sm.bound_database(sm.Users), sm.db)
+        self.assertTrue(sm.Status.table_exists())
+        self.assertEqual(database.execute_sql('PRAGMA foreign_keys').fetchone()[0], 1)
+        self.assertEqual(database.pragma('synchronous'), 2)
+        with sm.use_profile('bulk-load'):
+            self.assertEqual(database.pragma('synchronous'), 0)
+        self.assertEqual(database.pragma('synchronous'), 2)
+        self.assertRaises(ValueError, main.init_database, ':memory:', profile='fast')
+        database = main.init_database(':memory:', profile='balanced')
+        self.assertEqual(database.pragma('synchronous'), 1)
+        self.assertTrue(main.add_user('kwong', 'kwong@gmail.com', 'Kathleen', 'Wong',
+                                      main.init_user_collection()))
+        database.close()
+        test_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+
     def test_init_user_collection(self):
         '''
         Test UserCollection initialization
@@ -73,6 +98,233 @@ class TestMain(unittest.TestCase):
         fake = main.load_users(filename, user_collection)
         self.assertFalse(fake)
 
+    def test_load_users_chunked(self):
+        '''
+        Test load_users rolls back earlier chunks when a later row fails
+        Author: Marcus Bakke
+        '''
+        bad = os.path.join('test_files', 'test_bad_accounts_2.csv')
+        self.assertFalse(main.load_users(bad, self.user_collection, chunk_size=1))
+        self.assertEqual(len(list(self.user_collection.database)), 0)
+        extra = os.path.join('test_files', 'test_bad_accounts_3.csv')
+        self.assertFalse(main.load_users(extra, self.user_collection, chunk_size=1))
+        self.assertEqual(len(list(self.user_collection.database)), 0)
+        good = os.path.join('test_files', 'test_good_accounts.csv')
+        self.assertTrue(main.load_users(good, self.user_collection, chunk_size=1,
+                                        profile='bulk-load'))
+        self.assertEqual(len(list(self.user_collection.database)), 2)
+        self.assertEqual(test_db.pragma('synchronous'), 2)
+
+    def test_load_parallel(self):
+        '''
+        Test parallel validation matches the serial path
+        Author: Marcus Bakke
+        '''
+        good = os.path.join('test_files', 'test_good_accounts.csv')
+        self.assertTrue(main.load_users(good, self.user_collection, chunk_size=1, workers=2))
+        statuses = os.path.join('test_files', 'test_good_status_updates.csv')
+        self.assertTrue(main.load_status_updates(statuses, self.status_collection,
+                                                 chunk_size=1, workers=2))
+        self.assertEqual(len(list(self.status_collection.database)), 3)
+        bad = os.path.join('test_files', 'test_bad_status_updates.csv')
+        self.assertFalse(main.load_status_updates(bad, self.status_collection,
+                                                  chunk_size=1, workers=2))
+        chunks = [[(2, {'USER_ID': 'good01'})],
+                  [(3, {'USER_ID': '123'})],
+                  [(4, {'USER_ID': '456'})]]
+        keys = {'USER_ID': {'validate': main.validate_user_id, 'key': 'user_id'}}
+        serial = list(main.validated_chunks(chunks, keys, 'test.csv'))
+        parallel = list(main.validated_chunks(chunks, keys, 'test.csv', workers=2))
+        self.assertEqual(serial, parallel)
+        self.assertEqual(parallel[1], (None, 'Invalid value for USER_ID on line 3 of test.csv.'))
+
+    def test_load_conflict(self):
+        '''
+        Test the ignore and replace conflict policies of load_collection
+        Author: Marcus Bakke
+        '''
+        self.user_collection = users.UserCollection(cache_size=8)
+        good = os.path.join('test_files', 'test_good_accounts.csv')
+        result = main.load_users(good, self.user_collection)
+        self.assertEqual((result.inserted, result.skipped, result.replaced), (2, 0, 0))
+        statuses = os.path.join('test_files', 'test_good_status_updates.csv')
+        main.load_status_updates(statuses, self.status_collection)
+        self.assertEqual(main.search_user('dave03', self.user_collection).user_name, 'David')
+        overlap = os.path.join('test_files', 'test_overlap_accounts.csv')
+        self.assertFalse(main.load_users(overlap, self.user_collection))
+        self.assertEqual(len(list(self.user_collection.database)), 2)
+        result = main.load_users(overlap, self.user_collection, conflict='ignore')
+        self.assertTrue(result)
+        self.assertEqual((result.inserted, result.skipped, result.replaced), (1, 1, 0))
+        self.assertEqual(main.search_user('dave03', self.user_collection).user_name, 'David')
+        # Only duplicate ids are ignored, not rows breaking a CHECK
+        invalid = os.path.join('test_files', 'test_invalid_accounts.csv')
+        self.assertFalse(main.load_users(invalid, self.user_collection, conflict='ignore'))
+        self.assertIsNone(main.search_user('kwong', self.user_collection))
+        main.delete_user('mbak79', self.user_collection)
+        result = main.load_users(overlap, self.user_collection, conflict='replace')
+        self.assertTrue(result)
+        self.assertEqual((result.inserted, result.skipped, result.replaced), (1, 0, 1))
+        self.assertEqual(main.search_user('dave03', self.user_collection).user_name, 'Dave')
+        # Replacing a user keeps their statuses
+        self.assertEqual(len(list(self.status_collection.database)), 3)
+        self.assertRaises(ValueError, main.load_users, overlap, self.user_collection,
+                          conflict='merge')
+
+    def test_load_duplicates(self):
+        '''
+        Test duplicate ids are found before their chunk is inserted
+        Author: Marcus Bakke
+        '''
+        user_collection = main.init_user_collection(id_filter=True)
+        good = os.path.join('test_files', 'test_good_accounts.csv')
+        self.assertTrue(main.load_users(good, user_collection))
+        self.assertIn('dave03', user_collection.id_filter)
+        with self.assertLogs(level='ERROR') as logs:
+            self.assertFalse(main.load_users(good, user_collection))
+        self.assertIn('Duplicate user_id evmiles97', logs.output[0])
+        self.assertEqual(main.find_duplicate(['a', 'b', 'a'], user_collection), 'a')
+        self.assertIsNone(main.find_duplicate(['a', 'b'], user_collection))
+
+    def test_load_checkpointed(self):
+        '''
+        Test a checkpointed load resumes after the last committed chunk
+        Author: Marcus Bakke
+        '''
+        main.load_users(os.path.join('test_files', 'test_good_accounts.csv'),
+                        self.user_collection)
+        statuses = os.path.join('test_files', 'test_good_status_updates.csv')
+        inserted = []
+        insert_chunk = main.insert_chunk
+
+        def crash_on_third(rows, *args):
+            if len(inserted) == 2:
+                raise RuntimeError('Import killed')
+            inserted.extend(row['status_id'] for row in rows)
+            return insert_chunk(rows, *args)
+        with mock.patch('main.insert_chunk', crash_on_third):
+            self.assertRaises(RuntimeError, main.load_status_updates, statuses,
+                              self.status_collection, chunk_size=1, checkpoint=True)
+        self.assertEqual(len(list(self.status_collection.database)), 2)
+        progress = sm.ImportProgress.get()
+        self.assertEqual((progress.line, progress.table_name), (3, 'status'))
+        # The header and the two committed rows
+        with open(statuses, 'rb') as file:
+            self.assertEqual(progress.offset, sum(len(file.readline()) for _ in range(3)))
+        inserted.clear()
+        with mock.patch('main.insert_chunk', crash_on_third):
+            result = main.load_status_updates(statuses, self.status_collection, chunk_size=1,
+                                              checkpoint=True)
+        self.assertTrue(result)
+        self.assertEqual(inserted, ['evmiles97_00002'])
+        self.assertEqual(result.inserted, 1)
+        self.assertEqual(len(list(self.status_collection.database)), 3)
+        self.assertEqual(len(list(sm.ImportProgress)), 0)
+        # A failed load still counts the chunks it committed
+        directory = tempfile.mkdtemp()
+        try:
+            broken = os.path.join(directory, 'broken.csv')
+            with open(broken, 'w', encoding='utf-8') as file:
+                file.write('STATUS_ID,USER_ID,STATUS_TEXT\n'
+                           'evmiles97_00009,evmiles97,New\n'
+                           'dave03_00001,dave03,Replaced\n'
+                           'nobody_00001,nobody,Unknown user\n')
+            result = main.load_status_updates(broken, self.status_collection, chunk_size=1,
+                                              checkpoint=True, conflict='replace')
+            self.assertFalse(result)
+            self.assertEqual((result.inserted, result.skipped, result.replaced), (1, 0, 1))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_sync(self):
+        '''
+        Test sync_users and sync_status_updates only apply the changes
+        Author: Marcus Bakke
+        '''
+        main.load_users(os.path.join('test_files', 'test_good_accounts.csv'),
+                        self.user_collection)
+        main.load_status_updates(os.path.join('test_files', 'test_good_status_updates.csv'),
+                                 self.status_collection)
+        directory = tempfile.mkdtemp()
+        try:
+            accounts = os.path.join('test_files', 'test_overlap_accounts.csv')
+            result = main.sync_users(accounts, self.user_collection)
+            self.assertTrue(result)
+            self.assertEqual((result.inserted, result.updated, result.deleted,
+                              result.unchanged), (1, 1, 1, 0))
+            self.assertEqual(main.search_user('dave03', self.user_collection).user_name, 'Dave')
+            self.assertIsNone(main.search_user('evmiles97', self.user_collection))
+            # evmiles97's statuses went with them
+            self.assertEqual(len(list(self.status_collection.database)), 1)
+            result = main.sync_users(accounts, self.user_collection)
+            self.assertEqual((result.inserted, result.updated, result.deleted,
+                              result.unchanged), (0, 0, 0, 2))
+            # A write outside of a sync resets the stored hash
+            main.update_user('dave03', 'dave@uw.edu', 'David', 'Yuen', self.user_collection)
+            self.assertIsNone(sm.Users.get_by_id('dave03').row_hash)
+            result = main.sync_users(accounts, self.user_collection)
+            self.assertEqual((result.updated, result.unchanged), (1, 1))
+            self.assertIsNotNone(sm.Users.get_by_id('dave03').row_hash)
+
+            statuses = os.path.join(directory, 'status_updates.csv')
+            with open(statuses, 'w', encoding='utf-8') as file:
+                file.write('STATUS_ID,USER_ID,STATUS_TEXT\n'
+                           'dave03_00001,dave03,Sunny in Seattle this morning\n'
+                           'mbak79_00001,mbak79,Yay! Homework!\n')
+            result = main.sync_status_updates(statuses, self.status_collection)
+            self.assertEqual((result.inserted, result.updated, result.deleted,
+                              result.unchanged), (1, 0, 0, 1))
+            with open(statuses, 'a', encoding='utf-8') as file:
+                file.write('nobody_00001,nobody,Who am I?\n')
+            self.assertFalse(main.sync_status_updates(statuses, self.status_collection))
+            self.assertEqual(len(list(self.status_collection.database)), 2)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_row_hash_migration(self):
+        '''
+        Test row_hash is added to tables created before it existed
+        Author: Marcus Bakke
+        '''
+        test_db.drop_tables(MODELS)
+        test_db.execute_sql('CREATE TABLE users (user_id VARCHAR(30) NOT NULL PRIMARY KEY, '
+                            'user_name VARCHAR(30) NOT NULL, '
+                            'user_last_name VARCHAR(100) NOT NULL, '
+                            'user_email VARCHAR(255) NOT NULL)')
+        test_db.execute_sql("INSERT INTO users VALUES ('dave03', 'David', 'Yuen', 'dave@uw.edu')")
+        test_db.create_tables(MODELS)
+        self.assertIn('row_hash', [column.name for column in test_db.get_columns('users')])
+        self.assertIsNone(sm.Users.get_by_id('dave03').row_hash)
+
+    def test_save_collections(self):
+        '''
+        Test save_users and save_status_updates round trip through load
+        Author: Marcus Bakke
+        '''
+        main.load_users(os.path.join('test_files', 'test_save_accounts.csv'),
+                        self.user_collection)
+        main.load_status_updates(os.path.join('test_files', 'test_save_status_updates.csv'),
+                                 self.status_collection)
+        directory = tempfile.mkdtemp()
+        try:
+            users_file = os.path.join(directory, 'accounts.csv')
+            status_file = os.path.join(directory, 'status_updates.csv.gz')
+            self.assertTrue(main.save_users(users_file, self.user_collection))
+            self.assertTrue(main.save_status_updates(status_file, self.status_collection))
+            with open(users_file, encoding='utf-8') as file:
+                self.assertEqual(file.readline().strip(), 'USER_ID,EMAIL,NAME,LASTNAME')
+                self.assertEqual(file.readline().strip(), 'evmiles97,eve.miles@uw.edu,Eve,Miles')
+            main.delete_users(['evmiles97', 'dave03', 'mbak79'], self.user_collection)
+            self.assertTrue(main.load_users(users_file, self.user_collection))
+            self.assertTrue(main.load_status_updates(status_file, self.status_collection))
+            status = main.search_status('mbak79_00001', self.status_collection)
+            self.assertEqual(status.status_text, 'Yay! Homework!')
+            self.assertEqual(len(list(self.status_collection.database)), 4)
+            self.assertFalse(main.save_users(os.path.join(directory, 'missing', 'x.csv'),
+                                             self.user_collection))
+        finally:
+            shutil.rmtree(directory)
+
     def test_add_user(self):
         '''
         Test add_user method
@@ -282,6 +534,45 @@ class TestMain(unittest.TestCase):
         result = main.search_status(*inputs)
         self.assertIsNone(result)
 
+    def test_bulk_users(self):
+        '''
+        Test add_users, update_users and delete_users methods
+        Author: Kathleen Wong
+        '''
+        results = main.add_users([('kwong', 'kwong@gmail.com', 'Kathleen', 'Wong'),
+                                  ('k wong', 'kwong@gmail.com', 'Kathleen', 'Wong'),
+                                  ('dave03', 'dave@gmail.com', 'Dave', 'Yuen')],
+                                 self.user_collection)
+        self.assertEqual(results, [True, False, True])
+        results = main.update_users([('kwong', 'new@gmail.com', 'Kathleen', 'Wong'),
+                                     ('dave03', 'bad', 'Dave', 'Yuen'),
+                                     ('fail', 'fail@gmail.com', 'Fail', 'Test')],
+                                    self.user_collection)
+        self.assertEqual(results, [True, False, False])
+        self.assertEqual(main.delete_users(['kwong', 'fail'], self.user_collection),
+                         [True, False])
+
+    def test_bulk_statuses(self):
+        '''
+        Test add_statuses, update_statuses and delete_statuses methods
+        Author: Marcus Bakke
+        '''
+        main.load_users(os.path.join('test_files', 'test_good_accounts.csv'),
+                        self.user_collection)
+        results = main.add_statuses([('dave03', 'dave03_00001', 'First'),
+                                     ('dave03', 'dave03_x', 'Bad id'),
+                                     ('evmiles97', 'evmiles97_00001', 'Second')],
+                                    self.status_collection)
+        self.assertEqual(results, [True, False, True])
+        results = main.update_statuses([('dave03_00001', 'dave03', 'Changed'),
+                                        ('dave03_00002', 'dave03', 'Missing')],
+                                       self.status_collection)
+        self.assertEqual(results, [True, False])
+        self.assertEqual(main.search_status('dave03_00001', self.status_collection).status_text,
+                         'Changed')
+        self.assertEqual(main.delete_statuses(['dave03_00001', 'x_1'], self.status_collection),
+                         [True, False])
+
     def test_validate_user_id(self):
         '''
         Tests validate_user_id method
@@ -348,6 +639,34 @@ class TestMain(unittest.TestCase):
         test = main.filter_status_by_string('test', self.status_collection)
         self.assertTrue(test)
 
+    def test_latest_statuses(self):
+        '''
+        Test latest_statuses method
+        Author: Marcus Bakke
+        '''
+        main.load_users(os.path.join('test_files', 'test_good_accounts.csv'),
+                        self.user_collection)
+        main.load_status_updates(os.path.join('test_files', 'test_good_status_updates.csv'),
+                                 self.status_collection)
+        page = main.latest_statuses('evmiles97', 1, self.status_collection)
+        self.assertEqual(page[0].status_id, 'evmiles97_00002')
+        page = main.latest_statuses('evmiles97', 5, self.status_collection, 'evmiles97_00002')
+        self.assertEqual([status.status_id for status in page], ['evmiles97_00001'])
+        self.assertEqual(main.latest_statuses('evmiles97', 5, self.status_collection, 'bad'), [])
+
+    def test_search_status_by_phrase(self):
+        '''
+        Test search_status_by_phrase method
+        Author: Kathleen Wong
+        '''
+        main.load_users(os.path.join('test_files', 'test_good_accounts.csv'),
+                        self.user_collection)
+        main.load_status_updates(os.path.join('test_files', 'test_good_status_updates.csv'),
+                                 self.status_collection)
+        result = main.search_status_by_phrase('seattle', self.status_collection)
+        self.assertEqual(next(result).status_id, 'dave03_00001')
+        self.assertIsNone(main.search_status_by_phrase('portland', self.status_collection))
+
     def tearDown(self):
         '''
         Remove all tables at end of each test and close db.
@@ -0,0 +1,75 @@
+'''
+Unittests for menu.py.
+Author: Kathleen Wong
+'''
+import unittest
+from unittest import mock
+import peewee as pw
+import users
+import user_status
+import socialnetwork_model as sm
+
+# Importing menu would otherwise start a log file for the session
+with mock.patch('log_config.setup_logging'), mock.patch('atexit.register'):
+    import menu
+
+MODELS = [sm.Users, sm.Status, sm.StatusIndex]
+test_db = pw.SqliteDatabase(':memory:')
+
+
+class TestMenu(unittest.TestCase):
+    '''
+    Test class for menu.py
+    '''
+    def setUp(self):
+        '''
+        Bind model classes to test database and give menu its collections.
+        '''
+        test_db.bind(MODELS, bind_refs=False, bind_backrefs=False)
+        test_db.connect()
+        test_db.create_tables(MODELS)
+        user_collection = users.UserCollection()
+        user_collection.add_user('dave03', 'david.yuen@gmail.com', 'David', 'Yuen')
+        status_collection = user_status.UserStatusCollection()
+        status_collection.add_status('dave03_00001', 'dave03', 'Sunny in Seattle')
+        patches = [mock.patch('menu.user_collection', user_collection, create=True),
+                   mock.patch('menu.status_collection', status_collection, create=True)]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        '''
+        Drop the tables and close the test database.
+        '''
+        test_db.drop_tables(MODELS)
+        test_db.close()
+
+    def test_search_user(self):
+        '''
+        Test search_user shows every column of the user.
+        '''
+        with mock.patch('builtins.input', return_value='dave03'), \
+                self.assertLogs(level='INFO') as logs:
+            menu.search_user()
+        self.assertEqual(logs.output[-4:], ['INFO:root:User ID: dave03',
+                                            'INFO:root:Email: david.yuen@gmail.com',
+                                            'INFO:root:Name: David',
+                                            'INFO:root:Last name: Yuen'])
+        with mock.patch('builtins.input', return_value='nobody'), \
+                self.assertLogs(level='INFO') as logs:
+            menu.search_user()
+        self.assertIn('INFO:root:ERROR: User does not exist', logs.output)
+
+    def test_search_status(self):
+        '''
+        Test search_status shows the status.
+        '''
+        with mock.patch('builtins.input', return_value='dave03_00001'), \
+                self.assertLogs(level='INFO') as logs:
+            menu.search_status()
+        self.assertTrue(any('Sunny in Seattle' in line for line in logs.output))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,11 +3,13 @@ Unittests for users.py.
 Author: Kathleen Wong
 '''
 import unittest
+from unittest import mock
+from playhouse.test_utils import count_queries
 import peewee as pw
 import users
 import socialnetwork_model as sm
 
-MODELS = [sm.Users, sm.Status]
+MODELS = [sm.Users, sm.Status, sm.StatusIndex]
 test_db = pw.SqliteDatabase(':memory:')
 
 
@@ -74,6 +76,25 @@ class TestUser(unittest.TestCase):
         status = sm.Status.get_or_none(sm.Status.status_id == 'test_01')
         self.assertFalse(status)
 
+    def test_single_statement_writes(self):
+        '''
+        Test modify_user and delete_user issue one statement each and keep
+        the cache consistent.
+        '''
+        collection = users.UserCollection(cache_size=4)
+        collection.add_user('test01', 'test@gmail.com', 'Test', 'Account')
+        collection.search_user('test01')
+        with count_queries() as counter:
+            self.assertTrue(collection.modify_user('test01', 'new@gmail.com', 'New', 'Name'))
+            self.assertFalse(collection.modify_user('fail', 'fail@gmail.com', 'Fail', 'Name'))
+        self.assertEqual(counter.count, 2)
+        self.assertEqual(collection.search_user('test01').user_email, 'new@gmail.com')
+        with count_queries() as counter:
+            self.assertTrue(collection.delete_user('test01'))
+            self.assertFalse(collection.delete_user('test01'))
+        self.assertEqual(counter.count, 2)
+        self.assertIsNone(collection.search_user('test01'))
+
     def test_search_user(self):
         '''
         Test search_user
@@ -85,6 +106,143 @@ class TestUser(unittest.TestCase):
         self.assertEqual(user.user_last_name, 'Account')
         self.user_collection.search_user('fail')
 
+    def test_search_user_fields(self):
+        '''
+        Test search_user returns compact records of the requested fields
+        '''
+        user_collection = users.UserCollection(cache_size=10)
+        user_collection.add_user('test01', 'test@gmail.com', 'Test', 'Account')
+        user = user_collection.search_user('test01', fields=['user_id', 'user_name'])
+        self.assertEqual(user, ('test01', 'Test'))
+        self.assertEqual(user.user_name, 'Test')
+        self.assertNotIsInstance(user, sm.Users)
+        self.assertEqual(len(user_collection.cache), 0)
+        user_collection.search_user('test01')
+        self.assertEqual(user_collection.search_user('test01', ['user_name']), ('Test',))
+        self.assertIsNone(user_collection.search_user('fail', ['user_id']))
+        self.assertRaises(ValueError, user_collection.search_user, 'test01', ['password'])
+
+    def test_search_users_many(self):
+        '''
+        Test search_users_many resolves ids in chunks, using the cache
+        '''
+        user_collection = users.UserCollection(cache_size=10)
+        user_collection.add_users([(f'test{i:02}', f'test{i}@gmail.com', 'Test', 'Account')
+                                   for i in range(5)])
+        user_collection.search_user('test00')
+        with mock.patch.object(sm, 'BATCH_SIZE', 2):
+            found = user_collection.search_users_many(['test00', 'test01', 'test02', 'test03',
+                                                       'fail', 'test01'])
+        self.assertEqual(list(found), ['test00', 'test01', 'test02', 'test03', 'fail'])
+        self.assertIsNone(found['fail'])
+        self.assertEqual(found['test03'].user_email, 'test3@gmail.com')
+        self.assertEqual(user_collection.cache.hits, 1)
+        self.assertEqual(len(user_collection.cache), 4)
+        found = user_collection.search_users_many(['test04', 'test01'], fields=['user_email'])
+        self.assertEqual(found, {'test04': ('test4@gmail.com',), 'test01': ('test1@gmail.com',)})
+        self.assertEqual(user_collection.cache.hits, 2)
+
+    def test_id_filter(self):
+        '''
+        Test ids the membership filter has never seen skip the database
+        '''
+        self.user_collection.add_user('test01', 'test@gmail.com', 'Test', 'Account')
+        user_collection = users.UserCollection(id_filter=True)
+        self.assertEqual(user_collection.search_user('test01').user_name, 'Test')
+        # Inserted behind the filter's back, so it is not found
+        sm.Users.create(user_id='hidden', user_email='hidden@gmail.com', user_name='Hidden',
+                        user_last_name='Account')
+        self.assertIsNone(user_collection.search_user('hidden'))
+        self.assertEqual(user_collection.search_users_many(['hidden']), {'hidden': None})
+        # but writes still reach it
+        self.assertEqual(user_collection.modify_users([('hidden', 'h@gmail.com', 'Hidden',
+                                                        'Account')]), [True])
+        self.assertEqual(sm.Users.get_by_id('hidden').user_email, 'h@gmail.com')
+        self.assertEqual(user_collection.delete_users(['hidden']), [True])
+        sm.Users.create(user_id='hidden', user_email='hidden@gmail.com', user_name='Hidden',
+                        user_last_name='Account')
+        user_collection.remember_ids(['hidden'])
+        self.assertIsNotNone(user_collection.search_user('hidden'))
+        # Inserts through any collection reach the filter
+        self.user_collection.add_users([('test02', 'test2@gmail.com', 'Test', 'Account')])
+        self.assertIsNotNone(user_collection.search_user('test02'))
+        self.assertFalse(user_collection.add_user('test02', 'test2@gmail.com', 'Test', 'Two'))
+
+    def test_search_user_cache(self):
+        '''
+        Test search_user cache is invalidated by modify_user and delete_user
+        '''
+        user_collection = users.UserCollection(cache_size=10)
+        user_collection.add_user('test01', 'test@gmail.com', 'Test', 'Account')
+        user_collection.search_user('test01')
+        self.assertEqual(user_collection.search_user('test01').user_name, 'Test')
+        self.assertEqual(user_collection.cache.hits, 1)
+        user_collection.modify_user('test01', 'test@gmail.com', 'New', 'Account')
+        self.assertEqual(user_collection.search_user('test01').user_name, 'New')
+        user_collection.delete_user('test01')
+        self.assertIsNone(user_collection.search_user('test01'))
+        self.assertEqual(user_collection.cache.misses, 3)
+
+    def test_search_user_cache_shared(self):
+        '''
+        Test writes through one collection invalidate every cache, even
+        while another collection is reading the user
+        '''
+        user_collection = users.UserCollection(cache_size=10)
+        user_collection.add_user('test01', 'test@gmail.com', 'Test', 'Account')
+        self.assertEqual(user_collection.search_user('test01').user_name, 'Test')
+        self.user_collection.modify_user('test01', 'test@gmail.com', 'New', 'Account')
+        self.assertEqual(user_collection.search_user('test01').user_name, 'New')
+        read = user_collection.backend.get
+
+        def get_then_modify(*args):
+            user = read(*args)
+            self.user_collection.modify_user('test01', 'test@gmail.com', 'Newer', 'Account')
+            return user
+
+        self.user_collection.modify_users([('test01', 'test@gmail.com', 'Old', 'Account')])
+        with mock.patch.object(user_collection.backend, 'get', get_then_modify):
+            self.assertEqual(user_collection.search_user('test01').user_name, 'Old')
+        self.assertEqual(user_collection.search_user('test01').user_name, 'Newer')
+
+    def test_search_user_cache_copies(self):
+        '''
+        Test callers changing a user don't change what the cache returns
+        '''
+        user_collection = users.UserCollection(cache_size=10)
+        user_collection.add_user('test01', 'test@gmail.com', 'Test', 'Account')
+        first = user_collection.search_user('test01')
+        first.user_name = 'Changed'
+        second = user_collection.search_user('test01')
+        self.assertEqual(user_collection.cache.hits, 1)
+        self.assertEqual(second.user_name, 'Test')
+        second.user_name = 'Again'
+        self.assertEqual(user_collection.search_users_many(['test01'])['test01'].user_name,
+                         'Test')
+
+    def test_bulk_users(self):
+        '''
+        Test add_users, modify_users and delete_users
+        '''
+        results = self.user_collection.add_users([
+            ('test01', 'test@gmail.com', 'Test', 'Account'),
+            ('test02', 'test2@gmail.com', 'Test', 'Account'),
+            ('test01', 'test@gmail.com', 'Test', 'Account'),
+            ('test03', 'test3@gmail.com', 'A' * 40, 'Account')])
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(self.user_collection.add_users([('test02', 'x@y.com', 'X', 'Y')]),
+                         [False])
+        results = self.user_collection.modify_users([
+            ('test01', 'new@gmail.com', 'New', 'Name'),
+            ('fail', 'fail@gmail.com', 'Fail', 'Name')])
+        self.assertEqual(results, [True, False])
+        user = self.user_collection.search_user('test01')
+        self.assertEqual(user.user_email, 'new@gmail.com')
+        self.assertEqual(user.user_last_name, 'Name')
+        results = self.user_collection.delete_users(['test01', 'fail', 'test02', 'test01'])
+        self.assertEqual(results, [True, False, True, False])
+        self.assertEqual(len(list(self.user_collection.database)), 0)
+
     def tearDown(self):
         '''
         Remove all tables at end of each test and close db.
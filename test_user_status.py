@@ -1,13 +1,18 @@
 '''
 Unittests for user_status.py.
+Disable "Too many public methods" pylint message.
 Author: Marcus Bakke
 '''
+# pylint: disable=R0904
 import unittest
+from unittest import mock
+from playhouse.test_utils import count_queries
 import peewee as pw
 import user_status
+import users
 import socialnetwork_model as sm
 
-MODELS = [sm.Users, sm.Status]
+MODELS = [sm.Users, sm.Status, sm.StatusIndex]
 test_db = pw.SqliteDatabase(':memory:')
 
 class TestUserStatus(unittest.TestCase):
@@ -104,6 +109,231 @@ class TestUserStatus(unittest.TestCase):
         '''
         status = self.status_collection.filter_status_by_string('test')
         self.assertTrue(status)
+        self.assertEqual(status.count(), 1)
+        self.assertEqual(next(status).status_id, 'test123_00001')
+        self.assertRaises(StopIteration, next, status)
+        self.assertIsNone(self.status_collection.filter_status_by_string('missing'))
+
+    def test_search_all_status_updates(self):
+        '''
+        Test search_all_status_updates method
+        '''
+        self.status_collection.add_status('test123_00002', 'test123', 'test status 2')
+        result = self.status_collection.search_all_status_updates('test123')
+        self.assertEqual(result.count(), 2)
+        self.assertEqual([status.status_id for status in result],
+                         ['test123_00001', 'test123_00002'])
+        # The EXISTS probe and one SELECT, without a COUNT(*) for list()
+        with count_queries() as counter:
+            statuses = list(self.status_collection.search_all_status_updates('test123'))
+        self.assertEqual((len(statuses), counter.count), (2, 2))
+        self.assertIsNone(self.status_collection.search_all_status_updates('missing'))
+
+    def test_latest_statuses(self):
+        '''
+        Test latest_statuses pages by numeric suffix
+        '''
+        for i in [2, 10, 9]:
+            self.status_collection.add_status(f'test123_{i}', 'test123', f'status {i}')
+        page = self.status_collection.latest_statuses('test123', 2)
+        self.assertEqual([status.status_id for status in page], ['test123_10', 'test123_9'])
+        page = self.status_collection.latest_statuses('test123', 2, page[-1].status_id)
+        self.assertEqual([status.status_id for status in page], ['test123_2', 'test123_00001'])
+        self.assertEqual(self.status_collection.latest_statuses('test123', 2, 'test123_00001'), [])
+        self.assertEqual(self.status_collection.latest_statuses('missing', 2), [])
+
+    def test_latest_statuses_ties(self):
+        '''
+        Test latest_statuses pages through statuses with equal suffixes
+        '''
+        for status_id in ['test123_1', 'test123_01', 'test123_001', 'test123_2']:
+            self.status_collection.add_status(status_id, 'test123', 'tie')
+        pages, before = [], None
+        while page := self.status_collection.latest_statuses('test123', 2, before):
+            pages.append([status.status_id for status in page])
+            before = page[-1].status_id
+        self.assertEqual(pages, [['test123_2', 'test123_1'], ['test123_01', 'test123_001'],
+                                 ['test123_00001']])
+
+    def test_search_status_by_phrase(self):
+        '''
+        Test search_status_by_phrase stays in sync with Status
+        '''
+        self.status_collection.add_status('test123_00002', 'test123', "It's a beautiful day today")
+        result = self.status_collection.search_status_by_phrase('beautiful day')
+        self.assertEqual([status.status_id for status in result], ['test123_00002'])
+        self.assertIsNone(self.status_collection.search_status_by_phrase('day beautiful'))
+        self.assertIsNone(self.status_collection.search_status_by_phrase('"quoted'))
+        # Modified text is re-indexed
+        self.status_collection.modify_status('test123_00002', 'test123', 'cloudy day')
+        self.assertIsNone(self.status_collection.search_status_by_phrase('beautiful'))
+        result = self.status_collection.search_status_by_phrase('cloudy')
+        self.assertEqual(next(result).status_id, 'test123_00002')
+        # Deleted and cascaded statuses are removed from the index
+        self.status_collection.delete_status('test123_00002')
+        self.assertIsNone(self.status_collection.search_status_by_phrase('cloudy'))
+        sm.Users.get(sm.Users.user_id == 'test123').delete_instance()
+        self.assertIsNone(self.status_collection.search_status_by_phrase('test status'))
+
+    def test_search_fields(self):
+        '''
+        Test searches return compact records of the requested fields
+        '''
+        self.status_collection.add_status('test123_00002', 'test123', 'another status')
+        fields = ['status_id', 'user_id', 'status_text']
+        status = self.status_collection.search_status('test123_00001', fields)
+        self.assertEqual(status, ('test123_00001', 'test123', 'test status'))
+        self.assertEqual(status.user_id, 'test123')
+        result = self.status_collection.search_all_status_updates('test123', ['status_text'])
+        self.assertEqual(result.count(), 2)
+        self.assertEqual(sorted(status.status_text for status in result),
+                         ['another status', 'test status'])
+        result = self.status_collection.filter_status_by_string('another', fields)
+        self.assertEqual(list(result), [('test123_00002', 'test123', 'another status')])
+        result = self.status_collection.search_status_by_phrase('test status', ['status_id'])
+        self.assertEqual([status.status_id for status in result], ['test123_00001'])
+        self.assertIsNone(self.status_collection.filter_status_by_string('missing', fields))
+
+    def test_search_statuses_many(self):
+        '''
+        Test search_statuses_many maps each id to its status or None
+        '''
+        self.status_collection.add_status('test123_00002', 'test123', 'another status')
+        found = self.status_collection.search_statuses_many(['test123_00002', 'test123_00009',
+                                                             'test123_00001'])
+        self.assertEqual(found['test123_00001'].status_text, 'test status')
+        self.assertIsNone(found['test123_00009'])
+        found = self.status_collection.search_statuses_many(['test123_00002'],
+                                                            ['user_id', 'status_text'])
+        self.assertEqual(found, {'test123_00002': ('test123', 'another status')})
+        self.assertEqual(self.status_collection.search_statuses_many([]), {})
+
+    def test_buffered_writer(self):
+        '''
+        Test StatusWriter flushes by size, time, flush() and close().
+        '''
+        writer = self.status_collection.buffered_writer(max_size=3, max_delay=None,
+                                                        background=False)
+        first = writer.add('test123_00002', 'test123', 'buffered')
+        duplicate = writer.add('test123_00001', 'test123', 'duplicate')
+        self.assertFalse(first.done())
+        self.assertEqual(len(list(self.status_collection.database)), 1)
+        unknown = writer.add('nobody_00001', 'nobody', 'no such user')
+        self.assertEqual((first.result(), duplicate.result(), unknown.result()),
+                         (True, False, False))
+        self.assertEqual(len(list(self.status_collection.database)), 2)
+        later = writer.add('test123_00003', 'test123', 'flushed')
+        self.assertEqual(writer.flush(), 1)
+        self.assertTrue(later.result())
+        self.assertEqual(writer.flush(), 0)
+        timed = self.status_collection.buffered_writer(max_delay=0, background=False)
+        self.assertTrue(timed.add('test123_00004', 'test123', 'expired').done())
+        with self.status_collection.buffered_writer(max_delay=None) as closing:
+            last = closing.add('test123_00005', 'test123', 'closed')
+            self.assertFalse(last.done())
+        self.assertTrue(last.result())
+        self.assertRaises(ValueError, closing.add, 'test123_00006', 'test123', 'too late')
+
+    def test_buffered_writer_error(self):
+        '''
+        Test a failed flush fails its futures and the writer keeps going.
+        '''
+        with mock.patch.object(self.status_collection, 'add_statuses',
+                               side_effect=[KeyError('bad'), [True]]):
+            with self.status_collection.buffered_writer(max_delay=0.01) as writer:
+                failed = writer.add('test123_00002', 'test123', 'fails')
+                self.assertRaises(KeyError, failed.result, timeout=5)
+                later = writer.add('test123_00003', 'test123', 'written')
+                self.assertTrue(later.result(timeout=5))
+
+    def test_id_filter(self):
+        '''
+        Test status_ids the membership filter has never seen skip the database
+        '''
+        status_collection = user_status.UserStatusCollection(id_filter=True)
+        self.assertIsNotNone(status_collection.search_status('test123_00001'))
+        sm.Status.create(status_id='test123_00009', user='test123', status_text='hidden')
+        self.assertIsNone(status_collection.search_status('test123_00009'))
+        self.status_collection.add_status('test123_00002', 'test123', 'seen')
+        self.assertIsNotNone(status_collection.search_status('test123_00002'))
+        # Writes don't trust the filter, so they still find the hidden status
+        self.assertEqual(status_collection.existing_ids(['test123_00002', 'test123_00009']),
+                         {'test123_00002', 'test123_00009'})
+        self.assertEqual(status_collection.delete_statuses(['test123_00009']), [True])
+
+    def test_search_status_cache(self):
+        '''
+        Test search_status cache invalidation, including cascaded deletes
+        '''
+        status_collection = user_status.UserStatusCollection(cache_size=10)
+        status_collection.search_status('test123_00001')
+        status = status_collection.search_status('test123_00001')
+        self.assertEqual(status.status_text, 'test status')
+        self.assertEqual(status_collection.cache.stats()['hits'], 1)
+        status_collection.modify_status('test123_00001', 'test123', 'changed')
+        self.assertEqual(status_collection.search_status('test123_00001').status_text,
+                         'changed')
+        status_collection.add_status('test123_00002', 'test123', 'second')
+        status_collection.search_status('test123_00002')
+        status_collection.delete_status('test123_00002')
+        self.assertIsNone(status_collection.search_status('test123_00002'))
+        users.UserCollection().delete_user('test123')
+        self.assertEqual(len(status_collection.cache), 0)
+        self.assertIsNone(status_collection.search_status('test123_00001'))
+
+    def test_search_status_cache_shared(self):
+        '''
+        Test writes through one collection invalidate every cache, even
+        while another collection is reading the status
+        '''
+        status_collection = user_status.UserStatusCollection(cache_size=10)
+        status_collection.search_status('test123_00001')
+        self.status_collection.modify_statuses([('test123_00001', 'test123', 'changed')])
+        read = status_collection.backend.get_many
+
+        def get_then_modify(*args):
+            statuses = list(read(*args))
+            self.status_collection.modify_status('test123_00001', 'test123', 'newer')
+            return statuses
+
+        with mock.patch.object(status_collection.backend, 'get_many', get_then_modify):
+            found = status_collection.search_statuses_many(['test123_00001'])
+        self.assertEqual(found['test123_00001'].status_text, 'changed')
+        self.assertEqual(status_collection.search_status('test123_00001').status_text, 'newer')
+
+    def test_search_status_cache_copies(self):
+        '''
+        Test callers changing a status don't change what the cache returns
+        '''
+        status_collection = user_status.UserStatusCollection(cache_size=10)
+        status_collection.search_status('test123_00001').status_text = 'changed'
+        status = status_collection.search_status('test123_00001')
+        self.assertEqual(status.status_text, 'test status')
+        self.assertEqual(status.user_id, 'test123')
+        status.status_text = 'again'
+        found = status_collection.search_statuses_many(['test123_00001'])
+        self.assertEqual(found['test123_00001'].status_text, 'test status')
+        self.assertEqual(status_collection.cache.stats()['hits'], 2)
+
+    def test_bulk_statuses(self):
+        '''
+        Test add_statuses, modify_statuses and delete_statuses
+        '''
+        results = self.status_collection.add_statuses([
+            ('test123_00002', 'test123', 'second'),
+            ('test123_00001', 'test123', 'duplicate'),
+            ('fake_00001', 'fake', 'unknown user'),
+            ('test123_00003', 'test123', 'third')])
+        self.assertEqual(results, [True, False, False, True])
+        results = self.status_collection.modify_statuses([
+            ('test123_00002', 'test123', 'changed'),
+            ('test123_00009', 'test123', 'missing')])
+        self.assertEqual(results, [True, False])
+        self.assertEqual(self.status_collection.search_status('test123_00002').status_text,
+                         'changed')
+        results = self.status_collection.delete_statuses(['test123_00002', 'test123_00009'])
+        self.assertEqual(results, [True, False])
+        self.assertEqual(len(list(self.status_collection.database)), 2)
 
     def tearDown(self):
         '''
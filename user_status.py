@@ -11,31 +11,87 @@ it to work.
 This also appears to occur with Django as well.
 Source: https://stackoverflow.com/questions/115977/using-pylint-with-django
 '''
-# pylint: disable=E1101
+# pylint: disable=E1101,E1120
 import logging
+import threading
+import time
+import weakref
+from concurrent.futures import Future
 import peewee as pw
 import socialnetwork_model as sm
+import backends
+from cache import shared_cache
+from instrumentation import instrument_class
+from log_config import ROW
 
+# Status caches of every live collection, so a write through any collection
+# (or a cascaded delete) invalidates all of them
+_CACHES = weakref.WeakSet()
+# Membership filters of every live collection, so an insert through any
+# collection reaches all of them
+_ID_FILTERS = weakref.WeakSet()
 
+
+def invalidate(status_ids):
+    '''
+    Drops status_ids from the status cache of every collection
+    '''
+    status_ids = list(status_ids)
+    for cache in list(_CACHES):
+        for status_id in status_ids:
+            cache.discard(status_id)
+
+
+def invalidate_users(user_ids):
+    '''
+    Drops every cached status belonging to one of user_ids
+    '''
+    for cache in list(_CACHES):
+        cache.discard_if(lambda status: status.user_id in user_ids)
+
+
+@instrument_class
 class UserStatusCollection:
     '''
     Collection of UserStatus messages
+
+    If cache_size is given, search_status results are kept in a bounded
+    LRU cache (optionally expiring after cache_ttl seconds). Writes through
+    any collection (or main.py's loads and syncs, or a deleted user)
+    invalidate the caches of all of them. Every lookup returns its own
+    copy of a cached row, so callers may change it.
+
+    All methods are safe to call from many worker threads at once: each
+    thread uses its own pooled connection (see socialnetwork_model.init_db)
+    and the cache is locked.
+
+    If id_filter is True, a Bloom filter of every status_id lets lookups of
+    status_ids which were never added skip the database, as in
+    UserCollection.
+
+    Statuses are stored by backend, as in UserCollection. Give both
+    collections the same backend, as statuses must belong to its users.
     '''
 
-    def __init__(self):
+    def __init__(self, cache_size=0, cache_ttl=None, id_filter=False, backend=None):
         logging.info('UserStatusCollection initialized.')
         self.database = sm.Status
+        self.backend = backend if backend is not None else backends.PeeweeBackend()
+        self.cache = shared_cache(cache_size, cache_ttl, _CACHES)
+        self.id_filter = None
+        if id_filter:
+            self.id_filter = self.backend.primary_key_filter(self.database, _ID_FILTERS)
 
     def add_status(self, status_id, user_id, status_text):
         '''
         add a new status message to the collection
         '''
         try:
-            status = self.database.create(status_id=status_id,
-                                          user_id=user_id,
-                                          status_text=status_text)
-            status.save()
-            logging.info('Added status %s by %s.', status_id, user_id)
+            self.backend.insert(self.database, {'status_id': status_id,
+                                                'user_id': user_id,
+                                                'status_text': status_text})
+            self.remember_ids([status_id])
+            logging.log(ROW, 'Added status %s by %s.', status_id, user_id)
             return True
         except pw.IntegrityError:
             logging.error('Unable to add %s.', status_id)
@@ -44,67 +100,408 @@ class UserStatusCollection:
     def modify_status(self, status_id, user_id, status_text):
         '''
         Modifies a status message
+
+        A single UPDATE is issued; the status existed if it changed a row.
         '''
-        try:
-            status = self.database.get(sm.Status.status_id == status_id)
-            status.status_text = status_text
-            status.save()
-            logging.info('Modified status %s by %s.', status_id, user_id)
-            return True
-        except self.database.DoesNotExist:
+        modified = self.backend.update(self.database, status_id, {'status_text': status_text})
+        if not modified:
             logging.error('Unable to modify %s.', status_id)
             return False
+        invalidate([status_id])
+        logging.log(ROW, 'Modified status %s by %s.', status_id, user_id)
+        return True
 
     def delete_status(self, status_id):
         '''
         deletes the status message with id, status_id
+
+        A single DELETE is issued; the status existed if it removed a row.
         '''
-        try:
-            status = self.database.get(sm.Status.status_id == status_id)
-            status.delete_instance()
-            logging.info('Deleted status %s.', status_id)
-            return True
-        except self.database.DoesNotExist:
+        deleted = self.backend.delete(self.database, [status_id])
+        if not deleted:
             logging.error('Unable to delete %s.', status_id)
             return False
+        invalidate([status_id])
+        logging.log(ROW, 'Deleted status %s.', status_id)
+        return True
+
+    def add_statuses(self, records):
+        '''
+        Adds many status messages in a single transaction
+
+        records is an iterable of (status_id, user_id, status_text)
+        tuples. Returns a list with True for each record that was added and
+        False for each that was not (duplicate status_id or unknown user).
+        '''
+        records = list(records)
+        results = [False] * len(records)
+        with self.backend.atomic(self.database):
+            seen = self.existing_ids(record[0] for record in records)
+            users = self.backend.existing_ids(sm.Users, (record[1] for record in records))
+            rows = []
+            for i, (status_id, user_id, status_text) in enumerate(records):
+                if status_id in seen or user_id not in users:
+                    logging.error('Unable to add %s.', status_id)
+                    continue
+                seen.add(status_id)
+                rows.append((i, {'status_id': status_id, 'user_id': user_id,
+                                 'status_text': status_text}))
+            self.backend.insert_rows(self.database, rows, results)
+        self.remember_ids(record[0] for record, added in zip(records, results) if added)
+        logging.info('Added %i of %i statuses.', sum(results), len(records))
+        return results
+
+    def modify_statuses(self, records):
+        '''
+        Modifies many status messages in a single transaction
+
+        records is an iterable of (status_id, user_id, status_text)
+        tuples. Returns a list with True for each record that was modified
+        and False for each status that does not exist.
+        '''
+        records = list(records)
+        with self.backend.atomic(self.database):
+            existing = self.existing_ids(record[0] for record in records)
+            results = [record[0] in existing for record in records]
+            self.backend.update_rows(self.database, [
+                {'status_id': status_id, 'status_text': status_text}
+                for status_id, _, status_text in records if status_id in existing])
+        invalidate(existing)
+        logging.info('Modified %i of %i statuses.', sum(results), len(records))
+        return results
+
+    def delete_statuses(self, status_ids):
+        '''
+        Deletes many status messages in a single transaction
+
+        Returns a list with True for each status_id that was deleted and
+        False for each that does not exist.
+        '''
+        status_ids = list(status_ids)
+        with self.backend.atomic(self.database):
+            existing = self.existing_ids(status_ids)
+            self.backend.delete(self.database, existing)
+        results = []
+        for status_id in status_ids:
+            results.append(status_id in existing)
+            existing.discard(status_id)
+        invalidate(status_ids)
+        logging.info('Deleted %i of %i statuses.', sum(results), len(status_ids))
+        return results
+
+    def existing_ids(self, status_ids):
+        '''
+        Returns the set of the given status_ids which exist in the database
+
+        The id_filter is not used, so writes never skip statuses it
+        cannot see.
+        '''
+        return self.backend.existing_ids(self.database, status_ids)
+
+    def remember_ids(self, status_ids):
+        '''
+        Adds newly inserted status_ids to the membership filter of every
+        collection. Call after inserting statuses by other means than this
+        class, e.g. bulk loads.
+        '''
+        if _ID_FILTERS:
+            status_ids = list(status_ids)
+            for id_filter in list(_ID_FILTERS):
+                id_filter.update(status_ids)
+
+    @staticmethod
+    def forget_ids(status_ids):
+        '''
+        Drops changed status_ids from the cache of every collection. Call
+        after modifying statuses by other means than this class, e.g.
+        loads replacing rows.
+        '''
+        invalidate(status_ids)
 
-    def search_status(self, status_id):
+    def buffered_writer(self, max_size=500, max_delay=1.0, background=True):
+        '''
+        Returns a StatusWriter which adds statuses to this collection in
+        batches, see StatusWriter
+        '''
+        return StatusWriter(self, max_size, max_delay, background)
+
+    def search_status(self, status_id, fields=None):
         '''
         Find and return a status message by its status_id
 
         Returns an empty UserStatus object if status_id does not exist
+
+        If fields is given, the status is returned as a compact named
+        tuple of just those fields, as in UserCollection.search_user.
         '''
-        try:
-            status = self.database.get(sm.Status.status_id == status_id)
-            logging.info('Found status %s.', status_id)
-            return status
-        except self.database.DoesNotExist:
+        if self.id_filter is not None and status_id not in self.id_filter:
             logging.error('Unable to find %s.', status_id)
             return None
+        generation = self.cache.generation if self.cache is not None else None
+        if self.cache is not None:
+            status = self.cache.get(status_id)
+            if status is not None:
+                logging.log(ROW, 'Found status %s.', status_id)
+                return sm.copy_instance(status) if fields is None else sm.as_record(status, fields)
+        status = self.backend.get(self.database, status_id, fields)
+        if status is None:
+            logging.error('Unable to find %s.', status_id)
+            return None
+        if fields is None and self.cache is not None:
+            # Not stored if the status was invalidated while it was read
+            self.cache.put(status_id, sm.copy_instance(status), generation)
+        logging.log(ROW, 'Found status %s.', status_id)
+        return status
+
+    def search_statuses_many(self, status_ids, fields=None):
+        '''
+        Searches for many statuses at once
+
+        Returns a dict of each status_id to its Status instance (or
+        compact record of fields, as in search_status), or None if it
+        does not exist. Statuses missing from the cache are read with
+        chunked IN queries rather than one query each.
+        '''
+        found = dict.fromkeys(status_ids)
+        missing = []
+        generation = self.cache.generation if self.cache is not None else None
+        for status_id in found:
+            if self.id_filter is not None and status_id not in self.id_filter:
+                continue
+            status = self.cache.get(status_id) if self.cache is not None else None
+            if status is None:
+                missing.append(status_id)
+            else:
+                found[status_id] = sm.copy_instance(status) if fields is None \
+                    else sm.as_record(status, fields)
+        for status_id, status in self.backend.get_many(self.database, missing, fields):
+            found[status_id] = status
+            if fields is None and self.cache is not None:
+                self.cache.put(status_id, sm.copy_instance(status), generation)
+        hits = sum(status is not None for status in found.values())
+        logging.info('Found %i statuses, %i missing.', hits, len(found) - hits)
+        return found
 
-    def search_all_status_updates(self, user_id: str):
+    def search_all_status_updates(self, user_id: str, fields=None):
         '''
         Given user_id, return all status updates for that user.
         Return None if user_id not found.
+
+        If fields is given, the statuses are compact named tuples of just
+        those fields. Compact rows are much smaller than Status instances,
+        so prefer them for large scans.
         '''
-        query = self.database.select().where(sm.Status.user_id == user_id)
-        if len(query) == 0:
+        result = StatusSearchResult(self.backend.statuses_by_user(user_id, fields))
+        if not result:
             logging.error('Unable to find %s.', user_id)
             return None
-        logging.info("Found %i status' for %s.", len(query), user_id)
-        return query
+        logging.log(ROW, "Found status' for %s.", user_id)
+        return result
+
+    def latest_statuses(self, user_id, limit, before=None):
+        '''
+        Return up to limit of the user's statuses, newest first, as a list.
 
-    def filter_status_by_string(self, search_word):
+        Statuses are ordered by the numeric suffix of status_id. Pass the
+        status_id of the last status on the previous page as before to
+        fetch the next page; each page is a single index range scan.
         '''
-        Find and return status messages that contain a certain phrase
+        statuses = self.backend.latest_statuses(user_id, limit, before)
+        logging.log(ROW, "Found %i status' for %s.", len(statuses), user_id)
+        return statuses
+
+    def filter_status_by_string(self, search_word, fields=None):
+        '''
+        Find and return status messages that contain a certain phrase,
+        as compact named tuples of fields if given
         Author: Kathleen Wong
         '''
-        status = self.database.select().where\
-            (self.database.status_text.contains(search_word)).iterator()
-        length = len(list(status))
-        if length == 0:
+        result = StatusSearchResult(self.backend.statuses_containing(search_word, fields))
+        if not result:
             logging.error('Unable to find %s', search_word)
             return None
-        logging.info('Found %i results with %s', length, search_word)
-        return self.database.select().where\
-            (self.database.status_text.contains(search_word)).iterator()
+        logging.log(ROW, 'Found results with %s', search_word)
+        return result
+
+    def search_status_by_phrase(self, phrase, fields=None):
+        '''
+        Find and return status messages containing phrase using the
+        full-text index, as a lazy iterator like filter_status_by_string.
+
+        Matches whole words in order (so "beautiful day" matches
+        "It's a beautiful day today"), rather than any substring.
+        Returns None if nothing matches.
+        '''
+        result = StatusSearchResult(self.backend.statuses_matching(phrase, fields))
+        if not result:
+            logging.error('Unable to find %s', phrase)
+            return None
+        logging.log(ROW, 'Found results with %s', phrase)
+        return result
+
+
+class StatusSearchResult:
+    '''
+    Lazy iterator over the statuses matched by a search query
+
+    Truth testing runs an EXISTS probe and count() runs SELECT COUNT(*),
+    neither of which loads any rows. Iterating streams the rows through a
+    single cursor which is opened on the first call to next(). There is
+    deliberately no len(), as list() would otherwise run the count as a
+    length hint before the scan.
+
+    query is a peewee select, or a query of another backend with the same
+    exists(), count() and iterator() methods (see backends.MemoryQuery).
+    '''
+
+    def __init__(self, query):
+        self.query = query
+        self._exists = None
+        self._cursor = None
+
+    def exists(self):
+        '''
+        Returns True if the query matches at least one status
+        '''
+        if self._exists is None:
+            self._exists = self.query.exists()
+        return self._exists
+
+    def count(self):
+        '''
+        Returns the number of matching statuses
+        '''
+        return self.query.count()
+
+    def __bool__(self):
+        return self.exists()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._cursor is None:
+            self._cursor = self.query.iterator()
+        return next(self._cursor)
+
+
+@instrument_class
+class StatusWriter:
+    '''
+    Write-behind buffer for adding statuses to a UserStatusCollection
+
+    add() queues a status and returns a concurrent.futures.Future which
+    resolves to True once the status is committed, or False if it could
+    not be added (duplicate status_id or unknown user), just like
+    add_status. If the write itself fails, the future raises the error.
+
+    Queued statuses are written with add_statuses, so each flush is a
+    single transaction. A flush happens when max_size statuses are queued
+    (in the thread calling add), when the oldest has waited max_delay
+    seconds, on flush() and on close(). With background=True a thread
+    flushes on time even when no more statuses arrive; it uses its own
+    connection, so it needs a database file rather than ':memory:'.
+    Without it, the time limit is only checked on the next add.
+
+    Use the writer as a context manager, or call close(), so the last
+    statuses are written. add() may be called from many threads.
+    '''
+    # pylint: disable=R0902
+
+    def __init__(self, collection, max_size=500, max_delay=1.0, background=True):
+        self.collection = collection
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self._pending = []
+        self._oldest = None
+        self._closed = False
+        # Guards _pending and _closed, and wakes the background thread
+        self._condition = threading.Condition()
+        # Keeps flushes, and so the statuses, in the order they were added
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        if background and max_delay is not None:
+            self._thread = threading.Thread(target=self._run, name='status_writer', daemon=True)
+            self._thread.start()
+
+    def add(self, status_id, user_id, status_text):
+        '''
+        Queues a status and returns a Future of its add_status result
+        '''
+        future = Future()
+        with self._condition:
+            if self._closed:
+                raise ValueError('StatusWriter is closed.')
+            if not self._pending:
+                self._oldest = time.monotonic()
+                self._condition.notify()
+            self._pending.append(((status_id, user_id, status_text), future))
+            due = len(self._pending) >= self.max_size or \
+                (self._thread is None and self._expired())
+        if due:
+            self.flush()
+        return future
+
+    def flush(self):
+        '''
+        Writes every queued status in one transaction and resolves their
+        futures. Returns the number of statuses added.
+        '''
+        with self._flush_lock:
+            with self._condition:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return 0
+            try:
+                results = self.collection.add_statuses(record for record, _ in pending)
+            except Exception as err:  # pylint: disable=W0718
+                # Any error must reach the futures rather than end the
+                # background thread and leave later statuses unwritten
+                logging.error('Unable to write %i statuses: %s', len(pending), err)
+                for _, future in pending:
+                    future.set_exception(err)
+                return 0
+            for (_, future), result in zip(pending, results):
+                future.set_result(result)
+            return sum(results)
+
+    def close(self):
+        '''
+        Stops accepting statuses and writes the ones still queued
+        '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _expired(self):
+        '''
+        Returns True if the oldest queued status has waited max_delay
+        '''
+        return self.max_delay is not None and bool(self._pending) and \
+            time.monotonic() - self._oldest >= self.max_delay
+
+    def _run(self):
+        '''
+        Background thread flushing statuses which have waited max_delay
+        '''
+        backend = self.collection.backend
+        while True:
+            with self._condition:
+                while not self._closed and not self._expired():
+                    timeout = None
+                    if self._pending:
+                        timeout = self._oldest + self.max_delay - time.monotonic()
+                    self._condition.wait(timeout)
+                if self._closed:
+                    return
+            with backend.connection_context(sm.Status):
+                self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -2,32 +2,82 @@
 Classes for user information for the social network project
 All edits made by Kathleen Wong to incorporate logging issues.
 '''
-# pylint: disable=E1101
+# pylint: disable=E1101,E1120
 import logging
+import weakref
 import peewee as pw
 import socialnetwork_model as sm
+import backends
+import user_status
+from cache import shared_cache
+from instrumentation import instrument_class
+from log_config import ROW
 
+# Membership filters of every live collection, so an insert through any
+# collection reaches all of them
+_ID_FILTERS = weakref.WeakSet()
+# User caches of every live collection, so a write through any collection
+# invalidates all of them
+_CACHES = weakref.WeakSet()
 
+
+def invalidate(user_ids):
+    '''
+    Drops user_ids from the user cache of every collection
+    '''
+    user_ids = list(user_ids)
+    for cache in list(_CACHES):
+        for user_id in user_ids:
+            cache.discard(user_id)
+
+
+@instrument_class
 class UserCollection:
     '''
     Contains a collection of Users objects
+
+    If cache_size is given, search_user results are kept in a bounded LRU
+    cache (optionally expiring after cache_ttl seconds). Writes through any
+    collection (or main.py's loads and syncs) invalidate the caches of
+    all of them. Every lookup returns its own copy of a cached row, so
+    callers may change it.
+
+    All methods are safe to call from many worker threads at once: each
+    thread uses its own pooled connection (see socialnetwork_model.init_db)
+    and the cache is locked.
+
+    If id_filter is True, a Bloom filter of every user_id is built when the
+    collection is created and kept up to date by the inserts made through
+    any collection (or main.load_users), so lookups of user_ids which
+    were never added skip the database. Rows inserted by other means
+    (another process, raw SQL) are not seen by the filter, so searches
+    miss them; writes always look the ids up in the backend.
+
+    Users are stored by backend (see backends.py), by default the SQLite
+    database the models are bound to. database is the Users model either
+    way, naming the table and its fields.
     '''
 
-    def __init__(self):
+    def __init__(self, cache_size=0, cache_ttl=None, id_filter=False, backend=None):
         logging.info('UserCollection initialized.')
         self.database = sm.Users
+        self.backend = backend if backend is not None else backends.PeeweeBackend()
+        self.id_filter = None
+        if id_filter:
+            self.id_filter = self.backend.primary_key_filter(self.database, _ID_FILTERS)
+        self.cache = shared_cache(cache_size, cache_ttl, _CACHES)
 
     def add_user(self, user_id, user_email, user_name, user_last_name):
         '''
         Adds a new user to the collection
         '''
         try:
-            user = self.database.create(user_id=user_id,
-                                        user_email=user_email,
-                                        user_name=user_name,
-                                        user_last_name=user_last_name)
-            user.save()
-            logging.info('Added user %s', user_id)
+            self.backend.insert(self.database, {'user_id': user_id,
+                                                'user_email': user_email,
+                                                'user_name': user_name,
+                                                'user_last_name': user_last_name})
+            self.remember_ids([user_id])
+            logging.log(ROW, 'Added user %s', user_id)
             return True
         except pw.IntegrityError:
             logging.error('Unable to add %s.', user_id)
@@ -36,40 +86,185 @@ class UserCollection:
     def modify_user(self, user_id, user_email, user_name, user_last_name):
         '''
         Modifies an existing user
+
+        A single UPDATE is issued; the user existed if it changed a row.
         '''
-        try:
-            user = self.database.get(self.database.user_id == user_id)
-            user.user_email = user_email
-            user.user_name = user_name
-            user.user_last_name = user_last_name
-            user.save()
-            logging.info('Modified user %s.', user_id)
-            return True
-        except self.database.DoesNotExist:
+        modified = self.backend.update(self.database, user_id,
+                                       {'user_email': user_email,
+                                        'user_name': user_name,
+                                        'user_last_name': user_last_name})
+        if not modified:
             logging.error('Unable to user %s.', user_id)
             return False
+        invalidate([user_id])
+        logging.log(ROW, 'Modified user %s.', user_id)
+        return True
 
     def delete_user(self, user_id):
         '''
         Deletes an existing user
+
+        A single DELETE is issued; the user existed if it removed a row.
         '''
-        try:
-            user = self.database.get(sm.Users.user_id == user_id)
-            user.delete_instance()
-            logging.info('Deleted user %s.', user_id)
-            return True
-        except self.database.DoesNotExist:
+        deleted = self.backend.delete(self.database, [user_id])
+        if not deleted:
             logging.error('Unable to delete %s.', user_id)
             return False
+        invalidate([user_id])
+        # Their statuses were removed by ON DELETE CASCADE
+        user_status.invalidate_users({user_id})
+        logging.log(ROW, 'Deleted user %s.', user_id)
+        return True
 
-    def search_user(self, user_id):
+    def search_user(self, user_id, fields=None):
         '''
         Searches for user data
+
+        If fields (a list of field names) is given, only those columns are
+        read and the user is returned as a compact named tuple rather than
+        a Users instance. Compact reads are served from the cache when the
+        user is already in it, but don't add to it.
         '''
-        try:
-            user = self.database.get(sm.Users.user_id == user_id)
-            logging.info('Found user %s.', user_id)
-            return user
-        except self.database.DoesNotExist:
+        if self.id_filter is not None and user_id not in self.id_filter:
             logging.error('Unable to find %s.', user_id)
             return None
+        generation = self.cache.generation if self.cache is not None else None
+        if self.cache is not None:
+            user = self.cache.get(user_id)
+            if user is not None:
+                logging.log(ROW, 'Found user %s.', user_id)
+                return sm.copy_instance(user) if fields is None else sm.as_record(user, fields)
+        user = self.backend.get(self.database, user_id, fields)
+        if user is None:
+            logging.error('Unable to find %s.', user_id)
+            return None
+        if fields is None and self.cache is not None:
+            # Not stored if the user was invalidated while it was read
+            self.cache.put(user_id, sm.copy_instance(user), generation)
+        logging.log(ROW, 'Found user %s.', user_id)
+        return user
+
+    def search_users_many(self, user_ids, fields=None):
+        '''
+        Searches for many users at once
+
+        Returns a dict of each user_id to its Users instance (or compact
+        record of fields, as in search_user), or None if it does not
+        exist. Users missing from the cache are read with chunked IN
+        queries rather than one query each.
+        '''
+        found = dict.fromkeys(user_ids)
+        missing = []
+        generation = self.cache.generation if self.cache is not None else None
+        for user_id in found:
+            if self.id_filter is not None and user_id not in self.id_filter:
+                continue
+            user = self.cache.get(user_id) if self.cache is not None else None
+            if user is None:
+                missing.append(user_id)
+            else:
+                found[user_id] = sm.copy_instance(user) if fields is None \
+                    else sm.as_record(user, fields)
+        for user_id, user in self.backend.get_many(self.database, missing, fields):
+            found[user_id] = user
+            if fields is None and self.cache is not None:
+                self.cache.put(user_id, sm.copy_instance(user), generation)
+        hits = sum(user is not None for user in found.values())
+        logging.info('Found %i users, %i missing.', hits, len(found) - hits)
+        return found
+
+    def add_users(self, records):
+        '''
+        Adds many users in a single transaction
+
+        records is an iterable of (user_id, user_email, user_name,
+        user_last_name) tuples. Returns a list with True for each record
+        that was added and False for each that was not (e.g. duplicates).
+        '''
+        records = list(records)
+        results = [False] * len(records)
+        with self.backend.atomic(self.database):
+            seen = self.existing_ids(record[0] for record in records)
+            rows = []
+            for i, (user_id, user_email, user_name, user_last_name) in enumerate(records):
+                if user_id in seen:
+                    logging.error('Unable to add %s.', user_id)
+                    continue
+                seen.add(user_id)
+                rows.append((i, {'user_id': user_id, 'user_email': user_email,
+                                 'user_name': user_name, 'user_last_name': user_last_name}))
+            self.backend.insert_rows(self.database, rows, results)
+        self.remember_ids(record[0] for record, added in zip(records, results) if added)
+        logging.info('Added %i of %i users.', sum(results), len(records))
+        return results
+
+    def modify_users(self, records):
+        '''
+        Modifies many existing users in a single transaction
+
+        records is an iterable of (user_id, user_email, user_name,
+        user_last_name) tuples. Returns a list with True for each record
+        that was modified and False for each user that does not exist.
+        '''
+        records = list(records)
+        with self.backend.atomic(self.database):
+            existing = self.existing_ids(record[0] for record in records)
+            rows = [{'user_id': user_id, 'user_email': user_email, 'user_name': user_name,
+                     'user_last_name': user_last_name}
+                    for user_id, user_email, user_name, user_last_name in records
+                    if user_id in existing]
+            self.backend.update_rows(self.database, rows)
+        results = [record[0] in existing for record in records]
+        invalidate(existing)
+        logging.info('Modified %i of %i users.', sum(results), len(records))
+        return results
+
+    def delete_users(self, user_ids):
+        '''
+        Deletes many existing users (and, by cascade, their statuses) in a
+        single transaction
+
+        Returns a list with True for each user_id that was deleted and
+        False for each that does not exist.
+        '''
+        user_ids = list(user_ids)
+        with self.backend.atomic(self.database):
+            existing = self.existing_ids(user_ids)
+            self.backend.delete(self.database, existing)
+        results = []
+        for user_id in user_ids:
+            results.append(user_id in existing)
+            existing.discard(user_id)
+        invalidate(user_ids)
+        user_status.invalidate_users(set(user_ids))
+        logging.info('Deleted %i of %i users.', sum(results), len(user_ids))
+        return results
+
+    def existing_ids(self, user_ids):
+        '''
+        Returns the set of the given user_ids which exist in the database
+
+        The id_filter is not used, so writes never skip users it cannot
+        see.
+        '''
+        return self.backend.existing_ids(self.database, user_ids)
+
+    def remember_ids(self, user_ids):
+        '''
+        Adds newly inserted user_ids to the membership filter of every
+        collection. Call after inserting users by other means than this
+        class, e.g. bulk loads.
+        '''
+        if _ID_FILTERS:
+            user_ids = list(user_ids)
+            for id_filter in list(_ID_FILTERS):
+                id_filter.update(user_ids)
+
+    @staticmethod
+    def forget_ids(user_ids):
+        '''
+        Drops changed user_ids from the cache of every collection. Call
+        after modifying users by other means than this class, e.g. loads
+        replacing rows.
+        '''
+        invalidate(user_ids)